@@ -1,13 +1,13 @@
 __author__ = 'raek'
 # -*- coding: utf-8 -*-
 
-import copy
 import datetime as dt
-from icemodelling import constants as const
+from icemodelling import modelparameters as mpar
 from experimental import energybalancedefaults as defaults
-from utilities import doconversions as dc
 from icemodelling import parameterization as dp
-from math import log, exp, sin, cos, pi, fabs, sqrt, acos
+from icemodelling import solargeometry as sg
+from utilities import makelogs as ml
+from math import log, exp, sin, cos, pi
 
 
 class EnergyBalanceElement:
@@ -16,6 +16,7 @@ class EnergyBalanceElement:
     def __init__(self, date_inn):
         self.date = date_inn
         self.iterations = None
+        self.converged = None
 
 
     def add_model_input(self, utm33_x_inn, utm33_y_inn, snow_depth_inn, snow_density_inn,
@@ -40,8 +41,9 @@ class EnergyBalanceElement:
         self.time_hour = time_hour_inn
         self.time_span_in_sec = time_span_in_sec_inn
 
-    def add_iterations(self, iterations_inn):
+    def add_iterations(self, iterations_inn, converged_inn=None):
         self.iterations = iterations_inn
+        self.converged = converged_inn
 
     def add_no_energy_balance(self, is_ice_inn):
         self.is_ice = is_ice_inn
@@ -84,6 +86,178 @@ class EnergyBalanceElement:
         self.EB = EB_inn
 
 
+class EnergyBalanceDay:
+    """The energy balance on one day split in two. The terms that do not depend on the surface temperature (incoming
+    short wave, Todd Walter albedo, atmospheric long wave, ground heat and precipitation heat) are calculated once
+    when the object is made. The terms that do (UEB albedo, terrestrial long wave, turbulent fluxes, cold content and
+    surface heat conduction) are calculated for each surface temperature asked for. Used when iterating surface
+    temperatures in temp_surface_from_eb. See energy_balance_from_temp_sfc for the parameters."""
+
+    def __init__(self, utm33_x, utm33_y, ice_column, temp_atm, prec, prec_snow, albedo_prim, time_span_in_sec,
+                 age_factor_tau=None, cloud_cover=None, wind=None, rel_hum=None, pressure_atm=None):
+
+        self.utm33_x = utm33_x
+        self.utm33_y = utm33_y
+        self.ice_column = ice_column
+        self.temp_atm = temp_atm
+        self.prec = prec
+        self.prec_snow = prec_snow
+        self.time_span_in_sec = time_span_in_sec
+        self.age_factor_tau = age_factor_tau
+        self.wind = wind
+        self.rel_hum = rel_hum
+        self.pressure_atm = pressure_atm
+
+        self.date = ice_column.date
+        self.day_no = ice_column.date.timetuple().tm_yday
+        # time given as the end of the time span
+        self.time_hour = (ice_column.date + dt.timedelta(seconds=time_span_in_sec)).hour
+
+        # Variables picked out from ice_column
+        p = ice_column.parameters
+        self.parameters = p
+        self.is_ice = True
+        self.snow_depth = 0.
+        self.snow_density = p.rho_snow
+
+        if len(ice_column.column) == 0:
+            self.is_ice = False
+            # albedo_prim = 0.10      # no ice, water absobs much of the short wave
+        else:
+            if ice_column.column[0].type == "snow":
+                self.snow_density = ice_column.column[0].density
+                self.snow_depth = ice_column.column[0].height
+            if ice_column.column[0].type == "black_ice":
+                albedo_prim = p.alfa_black_ice
+            if ice_column.column[0].type == "slush_ice":
+                albedo_prim = p.alfa_slush_ice
+
+        self.albedo_prim_before = albedo_prim
+
+        # Calculate some parameters
+        if cloud_cover is None:
+            cloud_cover = dp.clouds_from_precipitation(prec, method=defaults.default_cloud_cover_method)
+        self.cloud_cover = cloud_cover
+
+        # The terms that do not depend on the surface temperature
+        time_hour = self.time_hour
+        if time_hour == 0:
+            time_hour = 24
+
+        self.s_inn, self.zenith_angle = get_incoming_short_wave(
+            utm33_x, utm33_y, self.day_no, cloud_cover, time_hour, time_span_in_sec, parameters=p)
+
+        self.albedo_prim, self.albedo_walter = get_albedo_walter_on_snow(
+            prec_snow, self.snow_depth, self.snow_density, temp_atm, albedo_prim, time_span_in_sec, time_hour,
+            parameters=p)
+
+        self.L_a = get_long_wave(cloud_cover, temp_atm, temp_atm, self.snow_depth, self.is_ice, time_span_in_sec,
+                                 parameters=p)[0]
+        self.G = get_ground_heat(time_span_in_sec)
+        self.R = get_prec_heat(temp_atm, prec, parameters=p)
+        self.conductance = ice_column.get_conductance_at_z()
+
+        # Layer temperatures are linear in surface temperature and so is the cold content
+        self.CC_0, self.d_CC = get_cold_content_coefficients(ice_column)
+
+    def get_terms(self, temp_surface):
+        """The terms of the energy balance that depend on the surface temperature.
+
+        :param temp_surface:    [C]
+        :return:                S, albedo, age_factor_tau, L_t, H, LE, R_i, stability_correction, CC, SC
+        """
+
+        albedo, age_factor_tau = get_albedo(
+            self.prec_snow, self.snow_depth, temp_surface, self.zenith_angle, self.time_span_in_sec,
+            self.albedo_prim, self.albedo_walter, age_factor_tau=self.age_factor_tau,
+            albedo_method=defaults.default_albedo_method, parameters=self.parameters)
+        S = (1-albedo) * self.s_inn           # se likning Liston 1995, eq. 26 (Nett SW-radiation)
+
+        L_t = get_terrestrial_long_wave(
+            temp_surface, self.snow_depth, self.is_ice, self.time_span_in_sec, parameters=self.parameters)
+
+        H, LE, R_i, stability_correction = get_turbulent_flux(
+            self.temp_atm, temp_surface, self.time_span_in_sec, self.ice_column, pressure_atm=self.pressure_atm,
+            wind=self.wind, rel_hum=self.rel_hum)
+
+        CC = self.CC_0 + self.d_CC * temp_surface
+
+        SC = get_surface_heat_conduction(
+            self.ice_column, temp_surface, self.time_span_in_sec, surface_conductance=self.conductance)[0]
+
+        return S, albedo, age_factor_tau, L_t, H, LE, R_i, stability_correction, CC, SC
+
+    def get_energy_balance_value(self, temp_surface):
+        """The energy budget EB on a given surface temperature. This is the residual to bring to zero when solving
+        for the surface temperature.
+
+        :param temp_surface:    [C]
+        :return EB:             [kJm^-2]
+        """
+
+        S, albedo, age_factor_tau, L_t, H, LE, R_i, stability_correction, CC, SC = self.get_terms(temp_surface)
+
+        return S + (self.L_a + L_t) + (LE + H) + self.G + self.R + (CC + SC)
+
+    def get_energy_balance_derivative(self, temp_surface):
+        """Derivative of the energy budget with respect to surface temperature, from the derivative of each term.
+
+        :param temp_surface:    [C]
+        :return:                [kJm^-2K^-1] dEB/d(temp_surface)
+        """
+
+        p = self.parameters
+        d_S = 0.
+        if self.snow_depth != 0. and defaults.default_albedo_method == "ueb":
+            d_S = -self.s_inn * get_albedo_ueb_derivative(
+                self.prec_snow, self.snow_depth, temp_surface, self.zenith_angle, self.time_span_in_sec,
+                age_factor_tau=self.age_factor_tau)
+
+        d_L_t = 0.
+        if self.is_ice:
+            eps_surface = p.eps_snow if self.snow_depth != 0 else p.eps_ice
+            d_L_t = -4 * eps_surface * p.sigma_pr_second * (temp_surface - p.absolute_zero)**3 * self.time_span_in_sec / 1000
+
+        d_turbulent = get_turbulent_flux_derivative(
+            self.temp_atm, temp_surface, self.time_span_in_sec, self.ice_column, pressure_atm=self.pressure_atm,
+            wind=self.wind, rel_hum=self.rel_hum)
+
+        d_SC = -self.conductance * self.time_span_in_sec / 1000
+
+        return d_S + d_L_t + d_turbulent + self.d_CC + d_SC
+
+    def get_energy_balance(self, temp_surface):
+        """The energy balance with all terms on a given surface temperature.
+
+        :param temp_surface:    [C]
+        :return:                [EnergyBalanceElement]
+        """
+
+        S, albedo, age_factor_tau, L_t, H, LE, R_i, stability_correction, CC, SC = self.get_terms(temp_surface)
+        EB = S + (self.L_a + L_t) + (LE + H) + self.G + self.R + (CC + SC)
+
+        # Define an energy balance object to put inn all resources data.
+        energy_balance = EnergyBalanceElement(self.date)
+        energy_balance.add_model_input(
+            utm33_x_inn=self.utm33_x, utm33_y_inn=self.utm33_y, snow_depth_inn=self.snow_depth,
+            snow_density_inn=self.snow_density, temp_surface_inn=temp_surface, is_ice_inn=self.is_ice,
+            temp_atm_inn=self.temp_atm, prec_inn=self.prec, prec_snow_inn=self.prec_snow,
+            cloud_cover_inn=self.cloud_cover, age_factor_tau_inn=self.age_factor_tau,
+            albedo_prim_inn=self.albedo_prim_before, day_no_inn=self.day_no, time_hour_inn=self.time_hour,
+            time_span_in_sec_inn=self.time_span_in_sec)
+
+        energy_balance.add_short_wave(S, self.s_inn, albedo, self.albedo_prim, age_factor_tau)
+        energy_balance.add_long_wave(self.L_a, L_t)
+        energy_balance.add_sensible_and_latent_heat(H, LE, R_i, stability_correction)
+        energy_balance.add_ground_heat(self.G)
+        energy_balance.add_prec_heat(self.R)
+        energy_balance.add_cold_content(CC)
+        energy_balance.add_surface_heat_conduction(SC, self.conductance)
+        energy_balance.add_energy_budget(EB)
+
+        return energy_balance
+
+
 def energy_balance_from_temp_sfc(
         utm33_x, utm33_y, ice_column, temp_atm, prec, prec_snow, albedo_prim, time_span_in_sec,
         temp_surface, age_factor_tau=None, cloud_cover=None, wind=None, rel_hum=None, pressure_atm=None):
@@ -117,75 +291,11 @@ def energy_balance_from_temp_sfc(
 
     """
 
-    date = ice_column.date
-    day_no = ice_column.date.timetuple().tm_yday
-    # time given as the end of the time span
-    time_hour = (ice_column.date + dt.timedelta(seconds=time_span_in_sec)).hour
-
-    # Variables picked out from ice_column
-    is_ice = True
-    snow_depth = 0.
-    snow_density = const.rho_snow
-
-    if len(ice_column.column) == 0:
-        is_ice = False
-        # albedo_prim = 0.10      # no ice, water absobs much of the short wave
-    else:
-        if ice_column.column[0].type == "snow":
-            snow_density = ice_column.column[0].density
-            snow_depth = ice_column.column[0].height
-        if ice_column.column[0].type == "black_ice":
-            albedo_prim = const.alfa_black_ice
-        if ice_column.column[0].type == "slush_ice":
-            albedo_prim = const.alfa_slush_ice
-
-    # Calculate some parameters
-    if cloud_cover is None:
-        cloud_cover = dp.clouds_from_precipitation(prec, method=defaults.default_cloud_cover_method)
-
-    # This scenario should be avoided but I keep it for now because it it the method used in senorge_eb
-    #if temp_surface is None:
-    #    temp_surface = ice_column.get_surface_temperature_estimate(temp_atm)
-
-    # Define an energy balance object to put inn all resources data.
-    energy_balance = EnergyBalanceElement(date)
-    energy_balance.add_model_input(
-        utm33_x_inn=utm33_x, utm33_y_inn=utm33_y, snow_depth_inn=snow_depth, snow_density_inn=snow_density,
-        temp_surface_inn=temp_surface, is_ice_inn=is_ice, temp_atm_inn=temp_atm,
-        prec_inn=prec, prec_snow_inn=prec_snow, cloud_cover_inn=cloud_cover,
-        age_factor_tau_inn=age_factor_tau, albedo_prim_inn=albedo_prim,
-        day_no_inn=day_no, time_hour_inn=time_hour, time_span_in_sec_inn=time_span_in_sec)
-
-    # Calculate the energy balance terms
-    S, s_inn, albedo, albedo_prim, age_factor_tau = get_short_wave(
-        utm33_x, utm33_y, day_no, temp_atm, cloud_cover, snow_depth, snow_density, prec_snow, time_hour,
-        time_span_in_sec, temp_surface, albedo_prim, age_factor_tau=age_factor_tau, albedo_method=defaults.default_albedo_method)
-
-    L_a, L_t = get_long_wave(cloud_cover, temp_atm, temp_surface, snow_depth, is_ice, time_span_in_sec)
-
-    H, LE, R_i, stability_correction = get_turbulent_flux(
-        temp_atm, temp_surface, time_span_in_sec, ice_column, pressure_atm=pressure_atm, wind=wind, rel_hum=rel_hum)
-
-    G = get_ground_heat(time_span_in_sec)
-
-    R = get_prec_heat(temp_atm, prec)
-
-    CC = get_cold_content_change(ice_column, temp_surface)
-
-    SC, conductance = get_surface_heat_conduction(ice_column, temp_surface, time_span_in_sec)
-
-    EB = S + (L_a + L_t) + (LE + H) + G + R + (CC + SC)
-
-    energy_balance.add_short_wave(S, s_inn, albedo, albedo_prim, age_factor_tau)
-    energy_balance.add_long_wave(L_a, L_t)
-    energy_balance.add_sensible_and_latent_heat(H, LE, R_i, stability_correction)
-    energy_balance.add_ground_heat(G)
-    energy_balance.add_prec_heat(R)
-    energy_balance.add_cold_content(CC)
-    energy_balance.add_surface_heat_conduction(SC, conductance)
-    energy_balance.add_energy_budget(EB)
+    energy_balance_day = EnergyBalanceDay(
+        utm33_x, utm33_y, ice_column, temp_atm, prec, prec_snow, albedo_prim, time_span_in_sec,
+        age_factor_tau=age_factor_tau, cloud_cover=cloud_cover, wind=wind, rel_hum=rel_hum, pressure_atm=pressure_atm)
 
-    return energy_balance
+    return energy_balance_day.get_energy_balance(temp_surface)
 
 
 def energy_balance_from_temp_sfc_value(
@@ -194,25 +304,28 @@ def energy_balance_from_temp_sfc_value(
     """Same as energy_balance_from_temp_sfc but this method returns only the value EB.
     """
 
-    obj = energy_balance_from_temp_sfc(
-        utm33_x=utm33_x, utm33_y=utm33_y, ice_column=ice_column, temp_atm=temp_atm, prec=prec, prec_snow=prec_snow,
-        albedo_prim=albedo_prim, time_span_in_sec=time_span_in_sec,
-        temp_surface=temp_surface, age_factor_tau=age_factor_tau, cloud_cover=cloud_cover, wind=wind, rel_hum=rel_hum,
-        pressure_atm=pressure_atm)
+    energy_balance_day = EnergyBalanceDay(
+        utm33_x, utm33_y, ice_column, temp_atm, prec, prec_snow, albedo_prim, time_span_in_sec,
+        age_factor_tau=age_factor_tau, cloud_cover=cloud_cover, wind=wind, rel_hum=rel_hum, pressure_atm=pressure_atm)
 
-    return obj.EB
+    return energy_balance_day.get_energy_balance_value(temp_surface)
 
 
 def temp_surface_from_eb(
         utm33_x, utm33_y, ice_column, temp_atm, prec, prec_snow, albedo_prim, time_span_in_sec,
         error=defaults.default_iteration_error, age_factor_tau=None, cloud_cover=None, wind=None, rel_hum=None,
-        pressure_atm=None, iteration_method=defaults.default_iteration_method):
+        pressure_atm=None, iteration_method=defaults.default_iteration_method, temp_surface_start=None):
     """Solves surface temperature from the criteria that the energy budget has to be zero. In case of melting the
     energy budget is balanced with a surface melting so that the sum of energy fluxes are 0.
 
-    This method iterates surface temperatures so that the error goes below a requested threshold. Two iteration
+    This method iterates surface temperatures so that the error goes below a requested threshold. Three iteration
     methods possible:
 
+    Newton_bracket:
+        Newton's method with the analytic derivative of the energy budget, safeguarded by a bracket around the
+        root. Steps leaving the bracket or not reducing the error are replaced by bisection, so it always
+        converges. See solve_temp_surface_bracketed.
+
     Newton-Raphson:
         based on Newton Raphson method of root finding. Methos itteates to p/m 1 in energy balance in 3-6 iterations.
         x_{n+1} = x_{n} - f(x_{n})/ df(x_{n})/dx
@@ -238,15 +351,26 @@ def temp_surface_from_eb(
     :param cloud_cover:
     :param wind:
     :param pressure_atm:
-    :param iteration_method
+    :param iteration_method:    Newton_bracket, Newton_Raphson or Delta_T. Other values give Newton_bracket.
+    :param temp_surface_start:  [C] First guess of surface temperature, e.g. that of the day before. Default is
+                                air temperature.
 
-    :return eb_obj:             EnergyBalanceElement given in the weather module.
+    :return eb_obj:             EnergyBalanceElement given in the weather module. It has the number of iterations and
+                                whether the error was reached (converged).
 
     """
 
+    # The terms that do not depend on the surface temperature are calculated once
+    energy_balance_day = EnergyBalanceDay(
+        utm33_x, utm33_y, ice_column, temp_atm, prec, prec_snow, albedo_prim, time_span_in_sec,
+        age_factor_tau=age_factor_tau, cloud_cover=cloud_cover, wind=wind, rel_hum=rel_hum, pressure_atm=pressure_atm)
+
     temp = temp_atm     # initial value
+    if temp_surface_start is not None:
+        temp = temp_surface_start
     num_iterations = 0
     eb_condition = error + 1    # initial value to start while loop
+    temp_f = ice_column.parameters.temp_f
 
     # Start debug. Calculate energy balances around surface temp to se development.
     debug = False
@@ -266,22 +390,24 @@ def temp_surface_from_eb(
         temps_sfc = np.linspace(temp-2., temp+2.)
         ebs = []
         for t in temps_sfc:
-            eb_check = energy_balance_from_temp_sfc(
-                utm33_x, utm33_y, ice_column, temp_atm, prec, prec_snow, albedo_prim, time_span_in_sec,
-                temp_surface=t, age_factor_tau=age_factor_tau, cloud_cover=cloud_cover, wind=wind, rel_hum=rel_hum,
-                pressure_atm=pressure_atm)
+            eb_check = energy_balance_day.get_energy_balance(t)
             ebs.append(eb_check.EB)
 
         mp.debug_plot_eb(temps_sfc, ebs, ice_column.date)
     # End debug
 
+    if iteration_method not in ["Newton_bracket", "Delta_T", "Newton_Raphson"]:
+        ml.log_and_print("[warning] energybalance.py -> temp_surface_from_eb: No valid iteration method {0}. "
+                         "Using Newton_bracket.".format(iteration_method))
+        iteration_method = "Newton_bracket"
+
+    if iteration_method == "Newton_bracket":
+        temp, eb, num_iterations = solve_temp_surface_bracketed(energy_balance_day, temp, error, temp_f)
+
     if iteration_method == "Delta_T":
         while abs(eb_condition) > error:
 
-            eb = energy_balance_from_temp_sfc_value(
-                utm33_x, utm33_y, ice_column, temp_atm, prec, prec_snow, albedo_prim, time_span_in_sec,
-                temp_surface=temp, age_factor_tau=age_factor_tau, cloud_cover=cloud_cover, wind=wind, rel_hum=rel_hum,
-                pressure_atm=pressure_atm)
+            eb = energy_balance_day.get_energy_balance_value(temp)
             delta_t = abs(eb) / defaults.delta_t_eb_fraction
 
             if eb > 0.:   # to much energy coming inn.
@@ -306,18 +432,12 @@ def temp_surface_from_eb(
         """
 
         temp_prev = temp
-        eb_prev = energy_balance_from_temp_sfc_value(
-            utm33_x, utm33_y, ice_column, temp_atm, prec, prec_snow, albedo_prim, time_span_in_sec,
-            temp_surface=temp_prev, age_factor_tau=age_factor_tau, cloud_cover=cloud_cover, wind=wind,
-            rel_hum=rel_hum, pressure_atm=pressure_atm)
+        eb_prev = energy_balance_day.get_energy_balance_value(temp_prev)
 
         # if eb is positive, to much energy is coming inn and thus the surface temp is to low.
         delta_t = eb_prev / defaults.init_d_t_eb_fraction
         temp = temp_prev + delta_t
-        eb = energy_balance_from_temp_sfc_value(
-            utm33_x, utm33_y, ice_column, temp_atm, prec, prec_snow, albedo_prim, time_span_in_sec,
-            temp_surface=temp, age_factor_tau=age_factor_tau, cloud_cover=cloud_cover, wind=wind,
-            rel_hum=rel_hum, pressure_atm=pressure_atm)
+        eb = energy_balance_day.get_energy_balance_value(temp)
         d_eb = (eb-eb_prev)/(temp-temp_prev)
         eb_sign = abs(eb)/eb
 
@@ -355,10 +475,7 @@ def temp_surface_from_eb(
 
                 temp = (temp_plus + temp_minus)/2
 
-            eb = energy_balance_from_temp_sfc_value(
-                utm33_x, utm33_y, ice_column, temp_atm, prec, prec_snow, albedo_prim, time_span_in_sec,
-                temp_surface=temp, age_factor_tau=age_factor_tau, cloud_cover=cloud_cover, wind=wind, rel_hum=rel_hum,
-                pressure_atm=pressure_atm)
+            eb = energy_balance_day.get_energy_balance_value(temp)
             eb_sign = abs(eb)/eb
             d_eb = (eb-eb_prev)/(temp-temp_prev)
 
@@ -383,26 +500,137 @@ def temp_surface_from_eb(
 
     # If temp_surf is above freezing temp, get energy balance at freezing and transfer energy to surface melt.
     # Also, get the full object. Note that in earlier steps only the energy balance value is requested.
-    if temp > const.temp_f:
-        eb_obj = energy_balance_from_temp_sfc(
-            utm33_x, utm33_y, ice_column, temp_atm, prec, prec_snow, albedo_prim, time_span_in_sec,
-            temp_surface=const.temp_f, age_factor_tau=age_factor_tau, cloud_cover=cloud_cover, wind=wind,
-            rel_hum=rel_hum, pressure_atm=pressure_atm)
+    # An energy surplus at freezing temperature (root above it) is melt and the iteration has converged.
+    is_melting = temp > temp_f or (temp == temp_f and eb > 0.)
+    if is_melting:
+        eb_obj = energy_balance_day.get_energy_balance(temp_f)
         eb_obj.add_surface_melt(-1 * eb_obj.EB)
         eb_obj.EB = 0.
     else:
-        eb_obj = energy_balance_from_temp_sfc(
-            utm33_x, utm33_y, ice_column, temp_atm, prec, prec_snow, albedo_prim, time_span_in_sec,
-            temp_surface=temp, age_factor_tau=age_factor_tau, cloud_cover=cloud_cover, wind=wind, rel_hum=rel_hum,
-            pressure_atm=pressure_atm)
+        eb_obj = energy_balance_day.get_energy_balance(temp)
         eb_obj.add_surface_melt(0.)
 
-    eb_obj.add_iterations(num_iterations)
+    eb_obj.add_iterations(num_iterations, abs(eb) <= error or (temp == temp_f and eb > 0.))
 
     return eb_obj
 
 
-def get_albedo_walter(prec_snow, snow_depth, snow_density, temp_atm, albedo_prim, time_span_in_sec, time_hour):
+def solve_temp_surface_bracketed(energy_balance_day, temp, error, temp_f):
+    """Finds the surface temperature where the energy budget is zero. The energy budget decreases with surface
+    temperature. First a bracket [temp_minus, temp_plus] is found where the budget is positive at temp_minus and
+    negative at temp_plus. Then Newton steps with the analytic derivative are taken inside the bracket and the bracket
+    is narrowed on each step. A step outside the bracket, or a step not halving the error, is replaced by bisection.
+
+    If the budget is positive at freezing temperature the root is above it, and freezing temperature is returned
+    since the surplus goes to surface melt.
+
+    :param energy_balance_day:  [EnergyBalanceDay]
+    :param temp:                [C] First guess of surface temperature.
+    :param error:               [kJm^-2] Requested accuracy in energy budget.
+    :param temp_f:              [C] Freezing temperature.
+    :return temp, eb, num_iterations:   The surface temperature, the budget on it and the number of budgets
+                                        calculated. If abs(eb) > error the iteration did not converge.
+    """
+
+    def get_eb(temp):
+        return energy_balance_day.get_energy_balance_value(temp), energy_balance_day.get_energy_balance_derivative(temp)
+
+    if temp > temp_f:
+        temp = temp_f
+    eb, d_eb = get_eb(temp)
+    num_iterations = 1
+
+    if abs(eb) <= error:
+        return temp, eb, num_iterations
+
+    # Find the bracket. The first step is a bit longer than the Newton step and the step is doubled until the sign
+    # of the budget changes.
+    direction = 1. if eb > 0. else -1.
+    if d_eb < 0.:
+        step = min(1.5 * abs(eb / d_eb), defaults.d_temp_max)
+    else:
+        step = defaults.bracket_step
+    temp_prev, eb_prev = temp, eb
+
+    while True:
+        temp_next = temp_prev + direction * step
+        if temp_next >= temp_f:
+            temp_next = temp_f
+
+        eb_next, d_eb_next = get_eb(temp_next)
+        num_iterations += 1
+
+        if abs(eb_next) <= error:
+            return temp_next, eb_next, num_iterations
+        if eb_next < 0. < eb_prev or eb_prev < 0. < eb_next:
+            break
+        if temp_next == temp_f and eb_next > 0.:
+            # energy surplus at freezing temperature goes to surface melt
+            return temp_f, eb_next, num_iterations
+        if num_iterations > defaults.num_bracket_steps_max:
+            return temp_next, eb_next, num_iterations
+
+        temp_prev, eb_prev = temp_next, eb_next
+        step *= 2
+
+    if eb_next > 0.:
+        temp_minus, temp_plus = temp_next, temp_prev
+    else:
+        temp_minus, temp_plus = temp_prev, temp_next
+    temp, eb, d_eb = temp_next, eb_next, d_eb_next
+    eb_before = None
+
+    # Newton steps inside the bracket
+    while abs(eb) > error and temp_plus - temp_minus > defaults.temp_tolerance \
+            and num_iterations < defaults.num_iterations_cut_of:
+
+        temp_newton = temp - eb / d_eb if d_eb != 0. else None
+        is_slow = eb_before is not None and abs(eb) > abs(eb_before) / 2
+        if temp_newton is None or not (temp_minus < temp_newton < temp_plus) or is_slow:
+            temp_newton = (temp_minus + temp_plus) / 2
+
+        eb_before = eb
+        temp = temp_newton
+        eb, d_eb = get_eb(temp)
+        num_iterations += 1
+
+        if eb > 0.:
+            temp_minus = temp
+        else:
+            temp_plus = temp
+
+    return temp, eb, num_iterations
+
+
+def get_iteration_statistics(energy_balance):
+    """Statistics of the surface temperature iterations over many days.
+
+    :param energy_balance:  [list of EnergyBalanceElement] E.g. from icethickness.calculate_ice_cover_eb. Days
+                            without energy balance (no ice) are not counted.
+    :return:                [dict] 'days': number of days iterated, 'histogram': {number of iterations: number of
+                            days}, 'mean_iterations' and 'not_converged': dates where the error was not reached.
+    """
+
+    histogram = {}
+    not_converged = []
+    for eb in energy_balance:
+        if eb.iterations is None:
+            continue
+        histogram[eb.iterations] = histogram.get(eb.iterations, 0) + 1
+        if eb.converged is False:
+            not_converged.append(eb.date)
+
+    days = sum(histogram.values())
+    mean_iterations = sum(i * n for i, n in histogram.items()) / days if days > 0 else None
+
+    return {'days': days,
+            'histogram': dict(sorted(histogram.items())),
+            'mean_iterations': mean_iterations,
+            'not_converged': not_converged}
+
+
+def get_albedo_walter(prec_snow, snow_depth, snow_density, temp_atm, albedo_prim, time_span_in_sec, time_hour,
+                      parameters=None):
     """
     Calculates albedo according to Todd Walters paper (2005) in journal of hydrology.
     It works for time intervals of 24hrs, 12, 6, 4 and 3hrs. That is, for albedo decay to work time_hour
@@ -418,6 +646,7 @@ def get_albedo_walter(prec_snow, snow_depth, snow_density, temp_atm, albedo_prim
     :param albedo_prim:         primary albedo.
     :param time_span_in_sec:
     :param time_hour:
+    :param parameters:          [ModelParameters] Model constants. Default is icemodelling.constants.
     :return:    albedo_prim:    primary albedo decayed on time step.
                 albedo:         are equal in the cases where snow depth is above critical 15-20cm.
 
@@ -427,8 +656,9 @@ def get_albedo_walter(prec_snow, snow_depth, snow_density, temp_atm, albedo_prim
     swe = snow_depth / snow_density
     swe += delta_swe
 
-    albedo_max = const.alfa_max     # maximum albedo
-    albedo_bare_ground = const.alfa_bare_ground
+    p = mpar.get_parameters(parameters)
+    albedo_max = p.alfa_max     # maximum albedo
+    albedo_bare_ground = p.alfa_bare_ground
     swe_minimum = 0.05                  # Aprox 15-20cm snow height.
 
     A = None
@@ -461,7 +691,8 @@ def get_albedo_walter(prec_snow, snow_depth, snow_density, temp_atm, albedo_prim
     return albedo_prim, albedo
 
 
-def get_albedo_ueb(prec_snow, snow_depth, temp_surface, zenith_angle, time_span_in_sec, age_factor_tau=None):
+def get_albedo_ueb(prec_snow, snow_depth, temp_surface, zenith_angle, time_span_in_sec, age_factor_tau=None,
+                   parameters=None):
     """
     Method estimates albedo as in the Utah energy balance Snow Accumulation and Melt Model (UEB).
     Adaption from Dickinson et al. 1993 (BATS, NCAR).
@@ -474,6 +705,7 @@ def get_albedo_ueb(prec_snow, snow_depth, temp_surface, zenith_angle, time_span_
                                 by a quantity designed to emulate the effect of the growth of surface
                                 grain sizes. Defalt 0. as for new snow
     :param time_span_in_sec:
+    :param parameters:          [ModelParameters] Model constants. Default is icemodelling.constants.
     :return:
 
     """
@@ -483,7 +715,7 @@ def get_albedo_ueb(prec_snow, snow_depth, temp_surface, zenith_angle, time_span_
     snow_depth += prec_snow
 
     # Constants from Tarboton and Luce, Utah energy balance Snow Accumulation and Melt Model UEB, 1996
-    albedo_bare_ground = const.alfa_black_ice   # Bare ground albedo means albedo of the ice beneath
+    albedo_bare_ground = mpar.get_parameters(parameters).alfa_black_ice   # Bare ground albedo means albedo of the ice beneath
     C_v = 0.2           # sensitivity of albedo to snow surface aging (grain size growth)
     C_ir = 0.5          # sensitivity of albedo to snow surface aging (grain size growth)
     alfa_v0 = 0.95      # fresh snow diffuse reflectances in the visible
@@ -543,10 +775,56 @@ def get_albedo_ueb(prec_snow, snow_depth, temp_surface, zenith_angle, time_span_
     return age_factor_tau, albedo
 
 
+def get_albedo_ueb_derivative(prec_snow, snow_depth, temp_surface, zenith_angle, time_span_in_sec, age_factor_tau=None):
+    """Derivative of the UEB albedo (see get_albedo_ueb) with respect to surface temperature. The surface temperature
+    ages the snow surface during the time step.
+
+    :return:    [K^-1] d(albedo)/d(temp_surface)
+    """
+
+    snow_depth += prec_snow
+
+    # Constants as in get_albedo_ueb
+    C_v = 0.2
+    C_ir = 0.5
+    alfa_v0 = 0.95
+    alfa_ir0 = 0.65
+    tau_0 = 1000000
+    h_sd = 0.05
+    b = 2
+
+    r1 = exp(5000*((1/273.16)-(1/(temp_surface+273.16))))
+    d_r1 = r1 * 5000/(temp_surface+273.16)**2
+    d_r2 = 10*r1**9*d_r1 if r1**10 < 1 else 0.
+    r2 = min(r1**10, 1)
+    r3 = 0.03
+    d_tau = ((r1+r2+r3)/tau_0)*time_span_in_sec
+    d_d_tau = ((d_r1+d_r2)/tau_0)*time_span_in_sec
+
+    if not age_factor_tau or prec_snow >= 0.01:
+        age_factor_tau = 0.
+    age_factor_tau += d_tau
+    d_F_age = d_d_tau/(1+age_factor_tau)**2
+
+    f_omg = 0.
+    if cos(zenith_angle) < 0.5:
+        f_omg = (1/b)*(((b+1)/(1+2*b*cos(zenith_angle)))-1)
+
+    d_alfa_v = -C_v*alfa_v0*d_F_age * (1-0.4*f_omg)
+    d_alfa_ir = -C_ir*alfa_ir0*d_F_age * (1-0.4*f_omg)
+    d_albedo = 0.5*d_alfa_v+0.5*d_alfa_ir
+
+    if snow_depth < h_sd:
+        radiation_extinction = (1-(snow_depth/h_sd))*exp(-(snow_depth/(2*h_sd)))
+        d_albedo *= (1-radiation_extinction)
+
+    return d_albedo
+
+
 # http://www.physics.gla.ac.uk/~shild/grid2025challenge/data.html
 def get_short_wave(
         utm33_x, utm33_y, day_no, temp_atm, cloud_cover, snow_depth, snow_density, prec_snow, time_hour,
-        time_span_in_sec, temp_surface, albedo_prim, age_factor_tau=None, albedo_method="ueb"):
+        time_span_in_sec, temp_surface, albedo_prim, age_factor_tau=None, albedo_method="ueb", parameters=None):
     """
     S [kJm^(-2)]is the net incident solar (short wave) radiation
     Method calculates albedo in two different ways for comparison and testing. In the end one is chose based on
@@ -564,6 +842,7 @@ def get_short_wave(
     :param albedo_prim:         Primary albedo from last time step. Used in the albedo_walters routine.
     :param age_factor_tau:      [-] Age factor in the UEB albedo routine.
     :param albedo_method:
+    :param parameters:          [ModelParameters] Model constants. Default is icemodelling.constants.
 
     :return:    S, s_inn, albedo, albedo_prim, age_factor_tau
 
@@ -572,130 +851,94 @@ def get_short_wave(
     if time_hour == 0:
         time_hour = 24
 
-    phi, thi, ddphi, ddthi = dc.lat_long_from_utm33(utm33_x,utm33_y, output= "both")
-
-    thetaW = 0.4102*sin((2*pi/365)*(day_no-80))     # solar declination angleday angle, Walter 2005
-    # print("sol.decl.angle={0} on daynumber={1}".format(thetaW, day_no))
-
-    #theta <- vector("numeric", 365)
-    #theta2 <- vector("numeric", 365)
-    #for (day_no in 1:365)theta[day_no] <- 0.4092*cos((2*pi/365)*(day_no-173))#solar declination angleday angle, Liston 1995
-    #for (day_no in 1:365)theta2[day_no] <- 0.4102*sin((2*pi/365)*(day_no-80))#solar declination angleday angle
+    s_inn, zenith_angle = get_incoming_short_wave(
+        utm33_x, utm33_y, day_no, cloud_cover, time_hour, time_span_in_sec, parameters=parameters)
 
-    theta = 0.4092*cos((2*pi/365.25)*(day_no-173))  # solar declination angleday angle, Liston 1995
-    theta2 = 2*pi/365.25*(day_no-80)
+    albedo_prim, albedo_walter = get_albedo_walter_on_snow(
+        prec_snow, snow_depth, snow_density, temp_atm, albedo_prim, time_span_in_sec, time_hour, parameters=parameters)
 
-    r = 149598000   # distance from the sun
-    R = 6378        # Radius of earth
+    albedo, age_factor_tau = get_albedo(
+        prec_snow, snow_depth, temp_surface, zenith_angle, time_span_in_sec, albedo_prim, albedo_walter,
+        age_factor_tau=age_factor_tau, albedo_method=albedo_method, parameters=parameters)
 
-    timezone = -4 * (fabs(thi) % 15) * thi/fabs(thi)      # ang lengdegrad ikke
-    epsilon = 0.4092    # rad(23.45)
-
-    z_s = r*sin(theta2)*sin(epsilon)
-    r_p = sqrt(r**2-z_s**2)
-    nevner = (R-z_s*sin(phi))/(r_p*cos(phi))
-
-    if(nevner > -1) and (nevner < 1):
+    S = (1-albedo) * s_inn           # se likning Liston 1995, eq. 26 (Nett SW-radiation)
 
-        # acos(mÂ ha inn verdier ,(mellom-1,1) hvis <-1 sÂ er det midnattsol > 1 er det m¯rketid.
-        t0 = 1440/(2*pi)*acos((R-z_s*sin(phi))/(r_p*cos(phi)))
-        that = t0+5
-        n = 720-10*sin(4*pi*(day_no-80)/365.25)+8*sin(2*pi*day_no/365.25)
-        sr = (n-that+timezone)/60 #soloppgang
-        ss = (n+that+timezone)/60 #solnedgang
+    return S, s_inn, albedo, albedo_prim, age_factor_tau
 
-        #sunhrs = ss-sr# antall soltimer
-        #time_hour er tidsvariabel
-        #Trise = -(1/0.2618)*cos(-tan(theta)*tan(phi))**-1
-        #Tset = (1/0.2618)*cos(-tan(theta)*tan(phi))**-1
-        #Trise = round(-sunhrs/2)
-        #Tset = round(sunhrs/2)
 
-    if nevner <= -1:    # Midnattsol
-        sr = 0.
-        ss = 24.
+def get_incoming_short_wave(utm33_x, utm33_y, day_no, cloud_cover, time_hour, time_span_in_sec, parameters=None):
+    """The incoming short wave radiation, before albedo. It does not depend on the surface temperature.
 
-    if nevner >= 1:     # Mørketid
-        sr = 12.
-        ss = 12.
+    :param utm33_x, utm33_y:    koordinat i UTM 33
+    :param day_no:              Dagnummer
+    :param cloud_cover:         [-] Cloud cover 0-1.
+    :param time_hour:           [1-24] Hour of the day the time_span_in_sec ends
+    :param time_span_in_sec:    [sec] Time resolution in sec
+    :param parameters:          [ModelParameters] Model constants. Default is icemodelling.constants.
+    :return s_inn, zenith_angle: [kJm^(-2)] and [rad]
+    """
 
-    #time_hour <- 22
-    TTList = {}         # Values for transmissivity for every hr
-    dingom = {}         # Values for zenith angle (0 straight up)
+    # The solar geometry on the location is computed once and looked up (see icemodelling.solargeometry)
+    clear_sky_transmissivity, zenith_angle = sg.get_solar_geometry_table(utm33_x, utm33_y).get_mean_values(
+        day_no, time_hour, time_span_in_sec)
 
-    for tid in range(1, 24, 1):
+    # Transmissivity inspirert av G. Liston 1995
+    Trans = clear_sky_transmissivity*(1.0-0.5*cloud_cover)
 
-        if (tid > sr) and (tid < ss):
+    #Solar radiation
+    S0 = mpar.get_parameters(parameters).solar_constant   #[J/m2/s] Solar constant pr sec
+    S0 *= time_span_in_sec      # solar constant pr time step
+    S0 /=1000                   # J to kJ
 
-            tom = tid-12    # Number of hours from solar noon. Solar noon is tom=0
-            cosarg = 0.2618 * tom   # Radians pr hour
+    s_inn = Trans * sin((pi/2)-zenith_angle) * S0   #
 
-            dingom[tid] = acos(sin(phi)*sin(theta)+cos(phi)*cos(theta)*cos(cosarg))  # Dingmans zenith angle
-            TTList[tid] = (0.6 + 0.2*sin((0.5*pi)-dingom[tid]))*(1.0-0.5*cloud_cover)         # Inspirert av G. Liston 1995 transmissivitet
+    return s_inn, zenith_angle
 
-            # TTList[tid] = (0.6-0.2*sin(dingom[tid]))*(1.0-0.5*cloud_cover) #Inspirert av G. Liston 1995 transmissivitet
-            # TTList[tid] = (0.6-0.2*sin(dingom[tid]))*(1.0-0.5*cloud_cover) #Inspirert av G. Liston 1995 transmissivitet
 
-        if (tid < sr) or (tid > ss):  # If time is outside sunrise-sunset
+def get_albedo_walter_on_snow(prec_snow, snow_depth, snow_density, temp_atm, albedo_prim, time_span_in_sec, time_hour,
+                              parameters=None):
+    """The Todd Walter albedo if there is snow on the surface. It does not depend on the surface temperature.
 
-            TTList[tid] = 0.       # Transmissivity = 0 when sun is below horizon.
-            dingom[tid] = pi/2     # Angle below horizin is set to be on the horizon.
+    :return albedo_prim, albedo_walter: As get_albedo_walter. Without snow albedo_prim is returned as given and the
+                                        albedo is None.
+    """
 
-    # pi/2 minus zenith angle, initielt, ikke helt sikker. Blir veldig lav med init dingom lik pi/2
-    # blir på den annen side høy med init dingom lik 0. Albedo ser ganske fornuftig ut.
+    if snow_depth == 0.:
+        return albedo_prim, None
 
-    if time_span_in_sec == 86400:
-        Trans = TTList.values()                 # list
-        zenith_angle = dingom.values()          # list
+    return get_albedo_walter(prec_snow, snow_depth, snow_density, temp_atm, albedo_prim, time_span_in_sec, time_hour,
+                             parameters=parameters)
 
-    elif time_span_in_sec < 86400:              # Midler transmissvitet og solvinkel For finere tidssoppløsning
-        interv = list(range(time_hour-int(time_span_in_sec/3600)+1, time_hour, 1))     # aktuelle timer
-        Trans = [TTList[i] for i in interv]     # selection of transmisions in intervall
-        zenith_angle = [dingom[i] for i in interv]
 
-    else:
-        print("Method doesnt work on time intervals greater than 24hrs")
-        Trans = None
-        zenith_angle = None
+def get_albedo(prec_snow, snow_depth, temp_surface, zenith_angle, time_span_in_sec, albedo_prim, albedo_walter,
+               age_factor_tau=None, albedo_method="ueb", parameters=None):
+    """The albedo used for the net short wave radiation. The UEB albedo and the age factor depend on the surface
+    temperature. The Todd Walter albedo is given, see get_albedo_walter_on_snow.
 
-    # Mean values
-    Trans = float( sum(Trans) / len(Trans) )
-    zenith_angle = float( sum(zenith_angle) / len(zenith_angle) )
+    :return albedo, age_factor_tau:
+    """
 
     if snow_depth == 0.:
-        albedo = albedo_prim
-        age_factor_tau = 0.
-
+        return albedo_prim, 0.
+
+    # UEB albedo
+    age_factor_tau, albedo_ueb \
+        = get_albedo_ueb(prec_snow, snow_depth, temp_surface, zenith_angle, time_span_in_sec, age_factor_tau=age_factor_tau,
+                         parameters=parameters)
+
+    # At this point I choose which albedo variant to use in calculating short wave radiation
+    if albedo_method == "ueb":
+        albedo = albedo_ueb
+    elif albedo_method == "walter":
+        albedo = albedo_walter
     else:
-        # UEB albedo
-        age_factor_tau, albedo_ueb \
-            = get_albedo_ueb(prec_snow, snow_depth, temp_surface, zenith_angle, time_span_in_sec, age_factor_tau=age_factor_tau)
-
-        # Todd Walters albedo
-        albedo_prim, albedo_walter \
-            = get_albedo_walter(prec_snow, snow_depth, snow_density, temp_atm, albedo_prim, time_span_in_sec, time_hour)
-
-        # At this point I choose which albedo variant to use in calculating short wave radiation
-        if albedo_method == "ueb":
-            albedo = albedo_ueb
-        elif albedo_method == "walter":
-            albedo = albedo_walter
-        else:
-            print("No valid albedo method selected.")
-            albedo = None
+        print("No valid albedo method selected.")
+        albedo = None
 
-    #Solar radiation
-    S0 = const.solar_constant   #[J/m2/s] Solar constant pr sec
-    S0 *= time_span_in_sec      # solar constant pr time step
-    S0 /=1000                   # J to kJ
-
-    s_inn = Trans * sin((pi/2)-zenith_angle) * S0   #
-    S = (1-albedo) * s_inn           # se likning Liston 1995, eq. 26 (Nett SW-radiation)
-
-    return S, s_inn, albedo, albedo_prim, age_factor_tau
+    return albedo, age_factor_tau
 
 
-def get_long_wave(cloud_cover, temp_atm, temp_surface, snow_depth, is_ice, time_span_in_sec):
+def get_long_wave(cloud_cover, temp_atm, temp_surface, snow_depth, is_ice, time_span_in_sec, parameters=None):
     """
     Long wave radiation, both atmospheric and terrestrial, calculated from precipitation and temperature.
 
@@ -708,6 +951,7 @@ def get_long_wave(cloud_cover, temp_atm, temp_surface, snow_depth, is_ice, time_
     :param is_ice:              [Bool]  It there ice or not?
     :param temp_surface:
     :param snow_depth:
+    :param parameters:          [ModelParameters] Model constants. Default is icemodelling.constants.
     :return     L_a:            [kJm^(-2)] is the atmospheric long wave radiation over the given time span
                 L_t:            [kJm^(-2)] is the terrestrial long wave radiation over the given time span
 
@@ -716,25 +960,41 @@ def get_long_wave(cloud_cover, temp_atm, temp_surface, snow_depth, is_ice, time_
 
     eps_atm = (0.72+0.005*temp_atm)*(1-0.84*cloud_cover)+0.84*cloud_cover    # Atmospheric emissivity from Campbell and Norman, 1998. Emissivity er dimasnjonsløs
     # eps_atm = (1.0+0.0025*temp_atm)-(1-cloud_cover)*(0.25*(1.0+0.0025*temp_atm))        # From THS og 2005 WALTER
-    eps_surface = const.eps_snow                       # By default we assume snow cover
-    sigma = const.sigma_pr_second                      # Stefan-Boltzmann constant
+    p = mpar.get_parameters(parameters)
+    sigma = p.sigma_pr_second                          # Stefan-Boltzmann constant
+
+    L_a = eps_atm * sigma * (temp_atm - p.absolute_zero)**4            # temp_atm skal være i Celsisus. Atmosfærisk innstsåling
+    L_a *= time_span_in_sec
+    L_a /= 1000
+
+    L_t = get_terrestrial_long_wave(temp_surface, snow_depth, is_ice, time_span_in_sec, parameters=p)
+
+    return L_a, L_t                     # Gir verdier av riktig størrelsesorden og balanserer hverandre sånn passe
+
+
+def get_terrestrial_long_wave(temp_surface, snow_depth, is_ice, time_span_in_sec, parameters=None):
+    """The long wave radiation out from the surface. This is the part of get_long_wave that depends on the surface
+    temperature.
+
+    :return L_t:    [kJm^(-2)] terrestrial long wave radiation over the given time span
+    """
+
+    p = mpar.get_parameters(parameters)
+    eps_surface = p.eps_snow                           # By default we assume snow cover
+    sigma = p.sigma_pr_second                          # Stefan-Boltzmann constant
 
     if snow_depth == 0:
-        eps_surface = const.eps_ice           # No snow gives ice emissivity
+        eps_surface = p.eps_ice               # No snow gives ice emissivity
 
     if is_ice == False:
         temp_surface = 0                      # water at 0degC
-        eps_surface = const.eps_water         # water emissivity is the same as snow emidsitivity
-
-    L_a = eps_atm * sigma * (temp_atm - const.absolute_zero)**4            # temp_atm skal være i Celsisus. Atmosfærisk innstsåling
-    L_t = -1 * eps_surface * sigma * (temp_surface - const.absolute_zero)**4    # terrestrisk utstråling emmisivity for snø er 0.97, er ogsÂ brukt for bar bakke, se Dingman p.583
+        eps_surface = p.eps_water             # water emissivity is the same as snow emidsitivity
 
-    L_a *= time_span_in_sec
+    L_t = -1 * eps_surface * sigma * (temp_surface - p.absolute_zero)**4    # terrestrisk utstråling emmisivity for snø er 0.97, er ogsÂ brukt for bar bakke, se Dingman p.583
     L_t *= time_span_in_sec
-    L_a /= 1000
     L_t /= 1000
 
-    return L_a, L_t                     # Gir verdier av riktig størrelsesorden og balanserer hverandre sånn passe
+    return L_t
 
 
 def get_turbulent_flux_MARTIN_1998(
@@ -754,10 +1014,11 @@ def get_turbulent_flux_MARTIN_1998(
 
     """
 
-    c_air = const.c_air             # Specific heat capacity air.
-    rho_air = const.rho_air         # Density of air.
-    k = const.von_karmans_const     # Von Karmans constant.
-    g = const.g
+    p = ice_column.parameters
+    c_air = p.c_air                 # Specific heat capacity air.
+    rho_air = p.rho_air             # Density of air.
+    k = p.von_karmans_const         # Von Karmans constant.
+    g = p.g
 
     zu = 10                         # Height of wind measurements.
     zt = 10                         # Height of temperature measurements.
@@ -772,7 +1033,7 @@ def get_turbulent_flux_MARTIN_1998(
     coeff_n = coeff_H
 
     # Richardsons number relating horizontal (nominator) vs vertical (denominator) momentum in the atmosphere,
-    R_i = 2*g/(temp_atm - const.absolute_zero) * (temp_atm - temp_surface)/zt * zu/wind     # error in paper. use Z_a not Z_0
+    R_i = 2*g/(temp_atm - p.absolute_zero) * (temp_atm - temp_surface)/zt * zu/wind     # error in paper. use Z_a not Z_0
     #R_i = 0
     stability_correction = 1        # neutral case (R_i = 0)
     if R_i > 0:                     # for stable case
@@ -793,8 +1054,8 @@ def get_turbulent_flux_MARTIN_1998(
     ea = 0.611 * exp( (17.3*temp_atm)/(temp_atm+273.3) )           # atmosphere [kPa] always positive
     es = 0.611 * exp( (17.3*temp_surface)/(temp_surface+273.3) )   # surface [kPa] always positive
 
-    L_s = const.L_sublimation
-    molecular_weight_ratio = const.molecular_weight_ratio
+    L_s = p.L_sublimation
+    molecular_weight_ratio = p.molecular_weight_ratio
 
     LE = L_s*rho_air/pressure_atm * molecular_weight_ratio * coeff*wind * (ea * rel_hum - es)
 
@@ -824,10 +1085,11 @@ def get_turbulent_flux_YOU_2014(
     :return:
     """
 
-    c_air = const.c_air             # Specific heat capacity air.
-    rho_air = const.rho_air         # Density of air.
-    k = const.von_karmans_const     # Von Karmans constant.
-    g = const.g
+    p = ice_column.parameters
+    c_air = p.c_air                 # Specific heat capacity air.
+    rho_air = p.rho_air             # Density of air.
+    k = p.von_karmans_const         # Von Karmans constant.
+    g = p.g
 
     zu = 10                         # Height of wind measurements.
     zt = 10                         # Height of temperature measurements.
@@ -842,7 +1104,7 @@ def get_turbulent_flux_YOU_2014(
 
     # Richardsons number relating horizontal (nominator) vs vertical (denominator) momentum in the atmosphere,
     # Correction when temperature gradient near surface.
-    R_i = g * zu * (temp_atm-temp_surface) / (0.5 * (temp_atm + temp_surface - const.absolute_zero*2) * wind**2)
+    R_i = g * zu * (temp_atm-temp_surface) / (0.5 * (temp_atm + temp_surface - p.absolute_zero*2) * wind**2)
     #R_i = 0
     stability_correction = 1
     if R_i > 0:             # for stable conditions
@@ -863,8 +1125,8 @@ def get_turbulent_flux_YOU_2014(
     es = 0.611 * exp( (17.3*temp_surface)/(temp_surface+273.3) )   # [kPa] always positive
 
     # Where λ_F and λ_V are the latent heats involved in fusion and vaporization-condensation respectively
-    lambda_V = const.L_vapour           # Jkg-1 latent varme fra fordampning
-    lambda_F = const.L_fusion        # Jkg-1 latent varme fra fusjon
+    lambda_V = p.L_vapour               # Jkg-1 latent varme fra fordampning
+    lambda_F = p.L_fusion            # Jkg-1 latent varme fra fusjon
 
     if temp_surface < 0.:
         LE = (lambda_V+lambda_F)*0.622*(rho_air/pressure_atm)*common*wind*(ea-es)
@@ -926,6 +1188,86 @@ def get_turbulent_flux(
     return H, LE, R_i, stability_correction
 
 
+def get_turbulent_flux_derivative(
+        temp_atm, temp_surface, time_span_in_sec, ice_column, pressure_atm, wind, rel_hum,
+        method=defaults.default_turbulent_flux_method):
+    """Derivative of the turbulent fluxes (H + LE) with respect to surface temperature. The fluxes are as in
+    get_turbulent_flux. The stability correction is not continuous where Richardsons number is 0 and the
+    derivative is that on the side of the given surface temperature.
+
+    :return:    [kJm^(-2)K^(-1)] d(H + LE)/d(temp_surface)
+    """
+
+    p = ice_column.parameters
+    c_air = p.c_air
+    rho_air = p.rho_air
+    k = p.von_karmans_const
+    g = p.g
+
+    zu = 10                         # Height of wind measurements.
+    zt = 10                         # Height of temperature measurements.
+    z_0 = ice_column.column[0].get_surface_roughness()
+
+    # saturation vapor pressure at the surface and its derivative
+    ea = 0.611 * exp( (17.3*temp_atm)/(temp_atm+273.3) )
+    es = 0.611 * exp( (17.3*temp_surface)/(temp_surface+273.3) )
+    d_es = es * 17.3*273.3/(temp_surface+273.3)**2
+
+    if method == "MARTIN 1998":
+        coeff_n = k**2 / (log(zu/z_0)*log(zt/z_0))
+        R_i = 2*g/(temp_atm - p.absolute_zero) * (temp_atm - temp_surface)/zt * zu/wind
+        d_R_i = -2*g/(temp_atm - p.absolute_zero) / zt * zu/wind
+
+        stability_correction = 1
+        d_stability_correction = 0.
+        if R_i > 0:
+            stability_correction = rho_air * c_air * coeff_n * max(0.75, (1-5*R_i)**2)
+            if (1-5*R_i)**2 > 0.75:
+                d_stability_correction = rho_air * c_air * coeff_n * -10*(1-5*R_i) * d_R_i
+        elif R_i < 0:
+            a = 0.83*coeff_n**(-0.62)
+            stability_correction = (1 + 7/a * log(1-a*R_i))
+            d_stability_correction = -7/(1-a*R_i) * d_R_i
+
+        d_H = rho_air * c_air * coeff_n * wind * (d_stability_correction*(temp_atm - temp_surface) - stability_correction)
+        d_LE = p.L_sublimation*rho_air/pressure_atm * p.molecular_weight_ratio * coeff_n*wind \
+            * (d_stability_correction*(ea * rel_hum - es) - stability_correction*d_es)
+
+    elif method == "YOU 2014":
+        common = k**2/(log(zu/z_0))**2
+        denominator = 0.5 * (temp_atm + temp_surface - p.absolute_zero*2) * wind**2
+        R_i = g * zu * (temp_atm-temp_surface) / denominator
+        d_R_i = -g * zu * (temp_atm - p.absolute_zero) * wind**2 / denominator**2
+
+        stability_correction = 1
+        d_stability_correction = 0.
+        if R_i > 0:
+            stability_correction = 1/(1+10*R_i)
+            d_stability_correction = -10/(1+10*R_i)**2 * d_R_i
+        elif R_i < 0:
+            stability_correction = (1-16*R_i)**0.75
+            d_stability_correction = -12*(1-16*R_i)**-0.25 * d_R_i
+        if stability_correction > 3.:
+            stability_correction = 3.
+            d_stability_correction = 0.
+
+        if temp_surface < 0.:
+            latent_heat = p.L_vapour + p.L_fusion
+        else:
+            latent_heat = p.L_vapour
+
+        d_H = c_air*rho_air*common*wind*(d_stability_correction*(temp_atm-temp_surface) - stability_correction)
+        d_LE = latent_heat*0.622*(rho_air/pressure_atm)*common*wind \
+            * (d_stability_correction*(ea-es) - stability_correction*d_es)
+
+    else:
+        print("energybalance.py -> get_turbulent_flux_derivative: No valid method given.")
+        return None
+
+    # J pr time span to kJ
+    return (d_H + d_LE) * time_span_in_sec / 1000
+
+
 def get_ground_heat(time_span_in_sec):
     """
     G [kJm^(-2)] is ground heat conduction to the bottom of the snowpack
@@ -941,23 +1283,26 @@ def get_ground_heat(time_span_in_sec):
     return G
 
 
-def get_prec_heat(temp_atm, prec):
+def get_prec_heat(temp_atm, prec, parameters=None):
     """
     Heat from liquid precipitation. We assume rainwater has the same temperature as air and that heat is added to the
     snowpack when the rain’s temperature is lowered to zero degrees.
 
     :param temp_atm:    [C] Air temperature.
     :param prec_rain:   [m/24hrs] Precipitation as liquid water.
+    :param parameters:  [ModelParameters] Model constants. Default is icemodelling.constants.
     :return R:          [kJm^-2] Heat added by precipitation
     """
 
-    if temp_atm >= const.temp_rain_snow:
+    p = mpar.get_parameters(parameters)
+
+    if temp_atm >= p.temp_rain_snow:
         prec_rain = prec
     else:
         prec_rain = 0.
 
     if prec_rain > 0.:
-        R = const.rho_water * const.c_water * prec_rain * temp_atm
+        R = p.rho_water * p.c_water * prec_rain * temp_atm
     else:
         R = 0.
 
@@ -975,34 +1320,68 @@ def get_cold_content_change(ice_column, temp_surf):
 
     :param ice_column:  From previous time step. The column variable has layers with layer.density, layer.height and layer.temp.
     :param temp_surf:   [C] surface temperature.
-    :param temp_atm:    [C] air temperature for estimating new snow temp.
-    :param prec_snow:   [m] Prec as snow from this time step (new snow)
 
     :return CC:         [kJm^-2]
 
     Dimensions:     kg m^-3 * J kg^-1 K^-1 * m * K = Jm^-2
     """
 
-    CC_prev = 0.
-    CC_this = 0.
+    CC_0, d_CC = get_cold_content_coefficients(ice_column)
 
-    for layer in ice_column.column:
-        CC_prev += layer.density * layer.get_heat_capacity() * layer.height * (layer.temperature - const.absolute_zero)
+    return CC_0 + d_CC * temp_surf
 
-    ice_column_copy = copy.deepcopy(ice_column)
-    ice_column_copy.set_surface_temperature(temp_surf)
-    ice_column_copy.update_column_temperatures()
 
-    for layer in ice_column_copy.column:
-        CC_this += layer.density * layer.get_heat_capacity() * layer.height * (layer.temperature - const.absolute_zero)
+def get_cold_content_coefficients(ice_column):
+    """The change in cold content as a linear function of surface temperature, CC = CC_0 + d_CC * temp_surf.
 
-    CC = CC_this - CC_prev
-    CC /= 1000              # J to kJ
+    The layer temperatures after ice_column.update_column_temperatures are those of a steady state through the dry
+    layers at the top, where each dry layer has the conductance k*h of that solve. The temperature at a boundary is
+    then the surface temperature and the bottom temperature weighted by the part of the resistance 1/(k*h) above and
+    below it, and the layer temperature is the mean of the boundaries. Wet layers and layers below them are 0C. So
+    the cold content is found without copying the column and solving for its temperatures.
+
+    :param ice_column:  From previous time step.
+    :return CC_0, d_CC: [kJm^-2] Change in cold content at 0C surface temperature and [kJm^-2K^-1] its change pr
+                        degree surface temperature.
+    """
+
+    p = ice_column.parameters
+    absolute_zero = p.absolute_zero
+    temp_bottom = p.temp_f
+
+    # only continuous dry layers from surface can be below freezing (0C)
+    num_dry_layers = 0
+    for layer in ice_column.column:
+        if layer.get_enum() > 9:
+            num_dry_layers += 1
+        else:
+            break
+
+    resistances = [1 / (layer.conductivity * layer.height) for layer in ice_column.column[:num_dry_layers]]
+    resistance_total = sum(resistances)
+
+    CC_prev = 0.
+    CC_0 = 0.
+    d_CC = 0.
+    resistance_above = 0.
+
+    for i, layer in enumerate(ice_column.column):
+        heat = layer.density * layer.get_heat_capacity() * layer.height
+        CC_prev += heat * (layer.temperature - absolute_zero)
+
+        if i < num_dry_layers:
+            # part of the resistance above the middle of the layer, from the boundaries above and below it
+            part_bottom = (2 * resistance_above + resistances[i]) / 2 / resistance_total
+            resistance_above += resistances[i]
+            CC_0 += heat * (temp_bottom * part_bottom - absolute_zero)
+            d_CC += heat * (1 - part_bottom)
+        else:
+            CC_0 += heat * (0. - absolute_zero)
 
-    return CC
+    return (CC_0 - CC_prev) / 1000, d_CC / 1000     # J to kJ
 
 
-def get_surface_heat_conduction(ice_column, temp_surface, time_span_in_sec):
+def get_surface_heat_conduction(ice_column, temp_surface, time_span_in_sec, surface_conductance=None):
     """Heat conduction driven by the temperature difference between surface temp and freezing temp
     at the bottom of the ice. This assumes that the temperature gradient is at steady state, which
     is the assumption for cahning the ice ticknes in the doicethickness module.
@@ -1012,10 +1391,12 @@ def get_surface_heat_conduction(ice_column, temp_surface, time_span_in_sec):
     :param ice_column:
     :param temp_surface:
     :param time_span_in_sec
+    :param surface_conductance: Optional. The conductance of the ice column, if already known.
     :return:
     """
 
-    surface_conductance = ice_column.get_conductance_at_z()  # should return U_surface
+    if surface_conductance is None:
+        surface_conductance = ice_column.get_conductance_at_z()  # should return U_surface
 
     SC = -temp_surface*surface_conductance   # freezing temp is 0C
     SC *= time_span_in_sec                  # energy over 24hrs
@@ -0,0 +1,696 @@
+# -*- coding: utf-8 -*-
+"""The energy balance on many lakes at the same time. This is experimental.energybalance done with NumPy on all
+lakes of an icemodelling.icebatch.IceColumnBatch. The terms are the same as in EnergyBalanceDay and the surface
+temperature is solved as in solve_temp_surface_bracketed, with masks selecting the lakes on each branch of the
+iteration. Only time steps of 24hrs are supported."""
+
+import numpy as np
+from icemodelling import constants as const
+from icemodelling import ice as ice
+from icemodelling import solargeometry as sg
+from experimental import energybalancedefaults as defaults
+from utilities import makelogs as ml
+
+__author__ = 'raek'
+
+
+_snow = ice.layer_type_codes['snow']
+_slush_ice = ice.layer_type_codes['slush_ice']
+_black_ice = ice.layer_type_codes['black_ice']
+
+# Names of the terms of the energy balance as returned by EnergyBalanceBatch.get_energy_balance.
+term_names = ['S', 's_inn', 'albedo', 'albedo_prim', 'age_factor_tau', 'L_a', 'L_t', 'H', 'LE', 'R_i',
+              'stability_correction', 'G', 'R', 'CC', 'SC', 'conductance', 'EB']
+
+
+class EnergyBalanceBatch:
+    """The energy balance on the lakes of an IceColumnBatch. The solar geometry and the model constants of each lake
+    are looked up once. For each day set_day calculates the terms that do not depend on the surface temperature on
+    the lakes with ice, and the other terms are calculated for the surface temperatures asked for. See
+    energybalance.EnergyBalanceDay.
+
+    The lakes of the day are in the index array lakes, and rows are positions in it.
+    """
+
+    def __init__(self, batch, utm33_x, utm33_y):
+        """
+        :param batch:               [IceColumnBatch]
+        :param utm33_x, utm33_y:    [array or int] Coordinates of each lake in UTM 33.
+        """
+
+        number_of_lakes = len(batch)
+        self.batch = batch
+        self.utm33_x = np.broadcast_to(np.asarray(utm33_x), (number_of_lakes,))
+        self.utm33_y = np.broadcast_to(np.asarray(utm33_y), (number_of_lakes,))
+
+        tables = [sg.get_solar_geometry_table(x, y) for x, y in zip(self.utm33_x.tolist(), self.utm33_y.tolist())]
+        self.mean_transmissivities = np.array([t.mean_transmissivity for t in tables]).reshape(number_of_lakes, 366)
+        self.mean_zenith_angles = np.array([t.mean_zenith_angle for t in tables]).reshape(number_of_lakes, 366)
+
+        sets = batch.parameter_sets
+        self.layer_heat_capacities = np.array([s.layer_heat_capacities for s in sets], dtype=float).reshape(
+            number_of_lakes, len(ice.layer_types))
+        self.layer_surface_roughness = np.array([s.layer_surface_roughness for s in sets], dtype=float).reshape(
+            number_of_lakes, len(ice.layer_types))
+
+        self.lakes = np.zeros(0, dtype=int)
+
+    def set_day(self, lakes, temp_atm, prec, prec_snow, albedo_prim, age_factor_tau, cloud_cover, wind, rel_hum,
+                pressure_atm, time_span_in_sec=60*60*24):
+        """Calculates the terms that do not depend on the surface temperature on the given lakes. The day is the
+        date of the ice columns in the batch. All arrays have one value pr lake in lakes.
+
+        :param lakes:           [array of int] Lakes with ice.
+        :param temp_atm:        [array] [C]
+        :param prec:            [array] [m]
+        :param prec_snow:       [array] [m]
+        :param albedo_prim:     [array] Primary albedo from the day before.
+        :param age_factor_tau:  [array] Snow age factor from the day before. nan or 0 for new snow.
+        :param cloud_cover:     [array] nan where not given. Then it is estimated from precipitation (Binary).
+        :param wind:            [array] [m/s]
+        :param rel_hum:         [array]
+        :param pressure_atm:    [array] [kPa]
+        :param time_span_in_sec: [int] 24hrs given in seconds.
+        """
+
+        if time_span_in_sec != 60*60*24:
+            ml.log_and_print("[warning] energybalancebatch.py -> EnergyBalanceBatch.set_day: Only time steps of 24hrs "
+                             "are supported. Got {} sec.".format(time_span_in_sec))
+
+        batch = self.batch
+        p = {name: values[lakes] for name, values in batch.parameters.items()}
+        self.lakes = lakes
+        self.temp_atm = temp_atm
+        self.prec = prec
+        self.prec_snow = prec_snow
+        self.age_factor_tau = age_factor_tau
+        self.wind = wind
+        self.rel_hum = rel_hum
+        self.pressure_atm = pressure_atm
+        self.time_span_in_sec = time_span_in_sec
+        self.temp_f = p['temp_f']
+        self.eps_ice = p['eps_ice']
+        self.eps_snow = p['eps_snow']
+        self.albedo_bare_ground = p['alfa_black_ice']      # Bare ground albedo in UEB is the albedo of the ice beneath
+
+        days = batch.dates[lakes].astype('datetime64[D]')
+        self.day_no = (days - days.astype('datetime64[Y]')).astype(int) + 1
+
+        # Variables picked out from the ice columns
+        top_types = batch.type_codes[lakes, 0]
+        is_snow = top_types == _snow
+        self.snow_depth = np.where(is_snow, batch.heights[lakes, 0], 0.)
+        self.snow_density = np.where(is_snow, batch.densities[lakes, 0], p['rho_snow'])
+        albedo_prim = np.where(top_types == _black_ice, p['alfa_black_ice'], albedo_prim)
+        albedo_prim = np.where(top_types == _slush_ice, p['alfa_slush_ice'], albedo_prim)
+        self.albedo_prim_before = albedo_prim
+        self.surface_roughness = self.layer_surface_roughness[lakes, top_types]
+
+        cloud_cover = np.where(np.isnan(cloud_cover), np.where(prec == 0, 0.1, 1.), cloud_cover)
+        self.cloud_cover = cloud_cover
+
+        # Incoming short wave. See energybalance.get_incoming_short_wave.
+        clear_sky_transmissivity = self.mean_transmissivities[lakes, self.day_no - 1]
+        self.zenith_angle = self.mean_zenith_angles[lakes, self.day_no - 1]
+        S0 = const.solar_constant * time_span_in_sec / 1000
+        self.s_inn = clear_sky_transmissivity * (1.0-0.5*cloud_cover) * np.sin((np.pi/2)-self.zenith_angle) * S0
+
+        self.albedo_prim, self.albedo_walter = get_albedo_walter_on_snow(
+            prec_snow, self.snow_depth, self.snow_density, temp_atm, albedo_prim, p['alfa_max'], p['alfa_bare_ground'])
+
+        # Atmospheric long wave. See energybalance.get_long_wave.
+        eps_atm = (0.72+0.005*temp_atm)*(1-0.84*cloud_cover)+0.84*cloud_cover
+        self.L_a = eps_atm * const.sigma_pr_second * (temp_atm - const.absolute_zero)**4 * time_span_in_sec / 1000
+
+        self.G = 173./86400 * time_span_in_sec
+        is_rain = (temp_atm >= p['temp_rain_snow']) & (prec > 0.)
+        self.R = np.where(is_rain, p['rho_water'] * const.c_water * prec * temp_atm, 0.) / 1000
+
+        is_layer = batch._is_layer()[lakes]
+        resistances = np.where(is_layer, batch.heights[lakes] / np.where(is_layer, batch.conductivities[lakes], 1.), 0.)
+        self.conductance = 1 / resistances.sum(axis=1)
+
+        # Layer temperatures are linear in surface temperature and so is the cold content
+        self.CC_0, self.d_CC = get_cold_content_coefficients(batch, lakes, self.layer_heat_capacities[lakes])
+
+    def get_terms(self, temp_surface, rows=None):
+        """The terms of the energy balance that depend on the surface temperature.
+
+        :param temp_surface:    [array] [C] One pr row.
+        :param rows:            [array of int] Positions in lakes. If None, all lakes of the day.
+        :return:                [dict of arrays] S, albedo, age_factor_tau, L_t, H, LE, R_i, stability_correction,
+                                CC and SC.
+        """
+
+        if rows is None:
+            rows = slice(None)
+        time_span_in_sec = self.time_span_in_sec
+        snow_depth = self.snow_depth[rows]
+
+        age_factor_tau, albedo_ueb = get_albedo_ueb(
+            self.prec_snow[rows], snow_depth, temp_surface, self.zenith_angle[rows], time_span_in_sec,
+            self.age_factor_tau[rows], self.albedo_bare_ground[rows])
+        if defaults.default_albedo_method == "walter":
+            albedo_ueb = self.albedo_walter[rows]
+        albedo = np.where(snow_depth == 0., self.albedo_prim[rows], albedo_ueb)
+        age_factor_tau = np.where(snow_depth == 0., 0., age_factor_tau)
+
+        eps_surface = np.where(snow_depth == 0, self.eps_ice[rows], self.eps_snow[rows])
+        L_t = -1 * eps_surface * const.sigma_pr_second * (temp_surface - const.absolute_zero)**4 * time_span_in_sec / 1000
+
+        H, LE, R_i, stability_correction = get_turbulent_flux(
+            self.temp_atm[rows], temp_surface, time_span_in_sec, self.surface_roughness[rows],
+            self.pressure_atm[rows], self.wind[rows], self.rel_hum[rows])
+
+        return {'S': (1-albedo) * self.s_inn[rows],
+                'albedo': albedo,
+                'age_factor_tau': age_factor_tau,
+                'L_t': L_t,
+                'H': H,
+                'LE': LE,
+                'R_i': R_i,
+                'stability_correction': stability_correction,
+                'CC': self.CC_0[rows] + self.d_CC[rows] * temp_surface,
+                'SC': -temp_surface * self.conductance[rows] * time_span_in_sec / 1000}
+
+    def get_energy_balance_value(self, temp_surface, rows=None):
+        """The energy budget EB on given surface temperatures.
+
+        :param temp_surface:    [array] [C] One pr row.
+        :param rows:            [array of int] Positions in lakes. If None, all lakes of the day.
+        :return EB:             [array] [kJm^-2]
+        """
+
+        if rows is None:
+            rows = slice(None)
+        t = self.get_terms(temp_surface, rows)
+
+        return t['S'] + (self.L_a[rows] + t['L_t']) + (t['LE'] + t['H']) + self.G + self.R[rows] + (t['CC'] + t['SC'])
+
+    def get_energy_balance_derivative(self, temp_surface, rows=None):
+        """Derivative of the energy budget with respect to surface temperature. See
+        EnergyBalanceDay.get_energy_balance_derivative.
+
+        :param temp_surface:    [array] [C] One pr row.
+        :param rows:            [array of int] Positions in lakes. If None, all lakes of the day.
+        :return:                [array] [kJm^-2K^-1] dEB/d(temp_surface)
+        """
+
+        if rows is None:
+            rows = slice(None)
+        time_span_in_sec = self.time_span_in_sec
+        snow_depth = self.snow_depth[rows]
+
+        d_S = 0.
+        if defaults.default_albedo_method == "ueb":
+            d_S = np.where(snow_depth != 0., -self.s_inn[rows] * get_albedo_ueb_derivative(
+                self.prec_snow[rows], snow_depth, temp_surface, self.zenith_angle[rows], time_span_in_sec,
+                self.age_factor_tau[rows]), 0.)
+
+        eps_surface = np.where(snow_depth == 0, self.eps_ice[rows], self.eps_snow[rows])
+        d_L_t = -4 * eps_surface * const.sigma_pr_second * (temp_surface - const.absolute_zero)**3 * time_span_in_sec / 1000
+
+        d_turbulent = get_turbulent_flux_derivative(
+            self.temp_atm[rows], temp_surface, time_span_in_sec, self.surface_roughness[rows],
+            self.pressure_atm[rows], self.wind[rows], self.rel_hum[rows])
+
+        d_SC = -self.conductance[rows] * time_span_in_sec / 1000
+
+        return d_S + d_L_t + d_turbulent + self.d_CC[rows] + d_SC
+
+    def get_energy_balance(self, temp_surface):
+        """The energy balance with all terms on given surface temperatures on all lakes of the day.
+
+        :param temp_surface:    [array] [C] One pr lake of the day.
+        :return:                [dict of arrays] The terms in term_names.
+        """
+
+        terms = self.get_terms(temp_surface)
+        terms['s_inn'] = self.s_inn
+        terms['albedo_prim'] = self.albedo_prim
+        terms['L_a'] = self.L_a
+        terms['G'] = np.full(len(self.lakes), self.G)
+        terms['R'] = self.R
+        terms['conductance'] = self.conductance
+        terms['EB'] = terms['S'] + (self.L_a + terms['L_t']) + (terms['LE'] + terms['H']) + self.G + self.R \
+            + (terms['CC'] + terms['SC'])
+
+        return terms
+
+
+def temp_surface_from_eb(energy_balance_batch, temp_surface_start, error=defaults.default_iteration_error):
+    """Solves surface temperature on all lakes of the day from the criteria that the energy budget has to be zero.
+    In case of melting the energy budget is balanced with a surface melting. This is energybalance.temp_surface_from_eb
+    with the Newton_bracket method.
+
+    :param energy_balance_batch:    [EnergyBalanceBatch] With the day set.
+    :param temp_surface_start:      [array] [C] First guess of surface temperature, e.g. that of the day before.
+                                    Air temperature where nan.
+    :param error:                   [kJm^-2] Requested accuracy in energy budget.
+    :return:                        [dict of arrays] The terms in term_names on the surface temperature and
+                                    'temp_surface', 'SM' (surface melt), 'iterations' and 'converged'.
+    """
+
+    temp_f = energy_balance_batch.temp_f
+    temp_start = np.where(np.isnan(temp_surface_start), energy_balance_batch.temp_atm, temp_surface_start)
+    temp, eb, num_iterations = solve_temp_surface_bracketed(energy_balance_batch, temp_start, error, temp_f)
+
+    # An energy surplus at freezing temperature is melt
+    is_melting = (temp > temp_f) | ((temp == temp_f) & (eb > 0.))
+    temp_surface = np.where(is_melting, temp_f, temp)
+
+    energy_balance = energy_balance_batch.get_energy_balance(temp_surface)
+    energy_balance['temp_surface'] = temp_surface
+    energy_balance['SM'] = np.where(is_melting, -1 * energy_balance['EB'], 0.)
+    energy_balance['EB'] = np.where(is_melting, 0., energy_balance['EB'])
+    energy_balance['iterations'] = num_iterations
+    energy_balance['converged'] = (np.abs(eb) <= error) | ((temp == temp_f) & (eb > 0.))
+
+    return energy_balance
+
+
+def solve_temp_surface_bracketed(energy_balance_batch, temp, error, temp_f):
+    """Finds the surface temperature where the energy budget is zero on all lakes of the day. The iteration on each
+    lake is that of energybalance.solve_temp_surface_bracketed: first a bracket is searched for by doubling steps and
+    then safeguarded Newton steps are taken inside it. On each iteration the lakes in the bracket search and the lakes
+    taking Newton steps are selected by masks, and the budgets of all of them are calculated together.
+
+    :param energy_balance_batch:    [EnergyBalanceBatch] With the day set.
+    :param temp:                    [array] [C] First guess of surface temperature.
+    :param error:                   [kJm^-2] Requested accuracy in energy budget.
+    :param temp_f:                  [float or array] [C] Freezing temperature on each lake.
+    :return temp, eb, num_iterations:   [arrays] The surface temperature, the budget on it and the number of budgets
+                                        calculated on each lake.
+    """
+
+    def get_eb(temp, rows):
+        return energy_balance_batch.get_energy_balance_value(temp, rows), \
+               energy_balance_batch.get_energy_balance_derivative(temp, rows)
+
+    temp = np.minimum(np.asarray(temp, dtype=float), temp_f)
+    number_of_lakes = len(temp)
+    temp_f = np.broadcast_to(temp_f, (number_of_lakes,))
+    eb, d_eb = get_eb(temp, np.arange(number_of_lakes))
+    num_iterations = np.ones(number_of_lakes, dtype=int)
+    is_done = np.abs(eb) <= error
+
+    # The bracket search. The first step is a bit longer than the Newton step.
+    direction = np.where(eb > 0., 1., -1.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        step = np.where(d_eb < 0., np.minimum(1.5 * np.abs(eb / d_eb), defaults.d_temp_max), defaults.bracket_step)
+    temp_prev, eb_prev = temp.copy(), eb.copy()
+    in_search = ~is_done
+
+    temp_minus = np.full(number_of_lakes, np.nan)
+    temp_plus = np.full(number_of_lakes, np.nan)
+    eb_before = np.full(number_of_lakes, np.nan)
+    in_newton = np.zeros(number_of_lakes, dtype=bool)
+
+    while in_search.any() or in_newton.any():
+        search = np.flatnonzero(in_search)
+        newton = np.flatnonzero(in_newton)
+
+        # Next temperature in the bracket search
+        temp_next = np.minimum(temp_prev[search] + direction[search] * step[search], temp_f[search])
+
+        # Newton steps inside the bracket. Steps outside it or not halving the error are bisection.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            temp_newton = temp[newton] - eb[newton] / d_eb[newton]
+        is_slow = ~np.isnan(eb_before[newton]) & (np.abs(eb[newton]) > np.abs(eb_before[newton]) / 2)
+        is_bisection = (d_eb[newton] == 0.) | ~((temp_minus[newton] < temp_newton) & (temp_newton < temp_plus[newton])) | is_slow
+        temp_newton = np.where(is_bisection, (temp_minus[newton] + temp_plus[newton]) / 2, temp_newton)
+        eb_before[newton] = eb[newton]
+
+        rows = np.concatenate((search, newton))
+        eb_new, d_eb_new = get_eb(np.concatenate((temp_next, temp_newton)), rows)
+        num_iterations[rows] += 1
+        eb_next, d_eb_next = eb_new[:len(search)], d_eb_new[:len(search)]
+
+        # Lakes searching for a bracket
+        is_found = np.abs(eb_next) <= error
+        is_crossing = ~is_found & (((eb_next < 0.) & (0. < eb_prev[search])) | ((eb_prev[search] < 0.) & (0. < eb_next)))
+        is_melt = ~is_found & ~is_crossing & (temp_next == temp_f[search]) & (eb_next > 0.)
+        is_given_up = ~is_found & ~is_crossing & ~is_melt & (num_iterations[search] > defaults.num_bracket_steps_max)
+        is_ended = is_found | is_melt | is_given_up
+
+        ended = search[is_ended]
+        temp[ended], eb[ended] = temp_next[is_ended], eb_next[is_ended]
+        is_done[ended] = True
+        in_search[ended] = False
+
+        crossing = search[is_crossing]
+        is_positive = eb_next[is_crossing] > 0.
+        temp_minus[crossing] = np.where(is_positive, temp_next[is_crossing], temp_prev[crossing])
+        temp_plus[crossing] = np.where(is_positive, temp_prev[crossing], temp_next[is_crossing])
+        temp[crossing], eb[crossing], d_eb[crossing] = temp_next[is_crossing], eb_next[is_crossing], d_eb_next[is_crossing]
+        eb_before[crossing] = np.nan
+        in_search[crossing] = False
+        in_newton[crossing] = True
+
+        searching = search[~is_ended & ~is_crossing]
+        temp_prev[searching], eb_prev[searching] = temp_next[~is_ended & ~is_crossing], eb_next[~is_ended & ~is_crossing]
+        step[searching] *= 2
+
+        # Lakes taking Newton steps narrow the bracket
+        temp[newton], eb[newton], d_eb[newton] = temp_newton, eb_new[len(search):], d_eb_new[len(search):]
+        is_positive = eb[newton] > 0.
+        temp_minus[newton] = np.where(is_positive, temp[newton], temp_minus[newton])
+        temp_plus[newton] = np.where(is_positive, temp_plus[newton], temp[newton])
+
+        # Newton steps are taken until the error is reached, the bracket is narrow or there are too many iterations
+        stepping = np.flatnonzero(in_newton)
+        is_stopped = (np.abs(eb[stepping]) <= error) | (temp_plus[stepping] - temp_minus[stepping] <= defaults.temp_tolerance) \
+            | (num_iterations[stepping] >= defaults.num_iterations_cut_of)
+        in_newton[stepping[is_stopped]] = False
+        is_done[stepping[is_stopped]] = True
+
+    return temp, eb, num_iterations
+
+
+def get_cold_content_coefficients(batch, lakes, layer_heat_capacities):
+    """The change in cold content as a linear function of surface temperature, CC = CC_0 + d_CC * temp_surf, on
+    many lakes. See energybalance.get_cold_content_coefficients.
+
+    :param batch:                   [IceColumnBatch]
+    :param lakes:                   [array of int] Lakes with ice.
+    :param layer_heat_capacities:   [2D array] Heat capacity pr lake and type code, shape [lakes, types].
+    :return CC_0, d_CC:             [arrays] [kJm^-2] and [kJm^-2K^-1]
+    """
+
+    is_layer = batch._is_layer()[lakes]
+    heights = batch.heights[lakes]
+    heat_capacities = np.take_along_axis(layer_heat_capacities, batch.type_codes[lakes].astype(int), axis=1)
+    heat = np.where(is_layer, batch.densities[lakes] * heat_capacities * heights, 0.)
+
+    # only continuous dry layers from surface can be below freezing (0C)
+    is_dry = (ice.layer_type_enums[batch.type_codes[lakes]] > 9) & is_layer
+    is_dry_layer = np.cumprod(is_dry, axis=1).astype(bool)
+
+    # part of the resistance 1/(k*h) above the middle of each dry layer
+    resistances = np.where(is_dry_layer, 1 / np.where(is_dry_layer, batch.conductivities[lakes] * heights, 1.), 0.)
+    resistances_below = np.cumsum(resistances, axis=1)
+    resistance_total = resistances_below[:, -1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        part_bottom = np.where(is_dry_layer, (2 * resistances_below - resistances) / 2 / resistance_total, 0.)
+
+    temperatures_0 = np.where(is_dry_layer, batch.parameters['temp_f'][lakes, None] * part_bottom, 0.)
+    CC_prev = (heat * np.where(is_layer, batch.temperatures[lakes] - const.absolute_zero, 0.)).sum(axis=1)
+    CC_0 = (heat * (temperatures_0 - const.absolute_zero)).sum(axis=1)
+    d_CC = (heat * np.where(is_dry_layer, 1 - part_bottom, 0.)).sum(axis=1)
+
+    return (CC_0 - CC_prev) / 1000, d_CC / 1000     # J to kJ
+
+
+def get_albedo_walter_on_snow(prec_snow, snow_depth, snow_density, temp_atm, albedo_prim, albedo_max=const.alfa_max,
+                              albedo_bare_ground=const.alfa_bare_ground):
+    """The Todd Walter albedo on lakes with snow on the surface, updated once a day. See
+    energybalance.get_albedo_walter.
+
+    :param albedo_max:          [float or array] Maximum albedo.
+    :param albedo_bare_ground:  [float or array] Albedo of snow less ground.
+
+    :return albedo_prim, albedo_walter: [arrays] Without snow albedo_prim is as given and the albedo is nan.
+    """
+
+    has_snow = snow_depth != 0.
+    swe_minimum = 0.05
+
+    # Method uses snow water equivalents SWE
+    temp_fahrenheit = temp_atm * 9.0/5.0 + 32.0
+    rho_new_snow = np.where(temp_fahrenheit > 0., 0.05 + (temp_fahrenheit/100)**2, 0.05)
+    delta_swe = prec_snow / rho_new_snow
+    with np.errstate(divide='ignore', invalid='ignore'):
+        swe = np.where(has_snow, snow_depth / snow_density, 0.) + delta_swe
+
+    # case no new snow or melt. Apply albedo decay
+    is_decay = has_snow & (delta_swe <= 0.)
+    is_low = is_decay & (albedo_prim <= 0.35)
+    if is_low.any():
+        print("get_albedo_walter: albedo_prim <= 0.35 (value: [0]). Forced to 0.355.")
+    albedo_prim_decay = np.where(is_low, 0.355, albedo_prim)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        A_decay = 0.35-(0.35-albedo_max)*np.exp(
+            -(0.177+np.log((albedo_max-0.35)/(albedo_prim_decay-0.35))**2.16))**0.46
+        # Case new snow
+        A_new = albedo_max-(albedo_max-albedo_prim)*np.exp(-((4*delta_swe*rho_new_snow)/0.12))
+    A = np.where(delta_swe <= 0., A_decay, A_new)
+
+    albedo = A
+    R = (1-(swe/swe_minimum)) * np.exp(-(swe/(2*swe_minimum)))
+    albedo = np.where(swe < swe_minimum, R*albedo_bare_ground + (1-R)*albedo, albedo)
+
+    return np.where(has_snow, A, albedo_prim), np.where(has_snow, albedo, np.nan)
+
+
+def get_albedo_ueb(prec_snow, snow_depth, temp_surface, zenith_angle, time_span_in_sec, age_factor_tau,
+                   albedo_bare_ground=const.alfa_black_ice):
+    """The UEB albedo on many lakes. See energybalance.get_albedo_ueb.
+
+    :param age_factor_tau:      [array] Snow age factor. nan or 0 is new snow.
+    :param albedo_bare_ground:  [float or array] Albedo of the ice beneath the snow.
+    :return age_factor_tau, albedo: [arrays]
+    """
+
+    snow_depth = snow_depth + prec_snow
+
+    # Constants as in energybalance.get_albedo_ueb
+    C_v = 0.2
+    C_ir = 0.5
+    alfa_v0 = 0.95
+    alfa_ir0 = 0.65
+    tau_0 = 1000000
+    h_sd = 0.05
+    b = 2
+
+    r1 = np.exp(5000*((1/273.16)-(1/(temp_surface+273.16))))
+    r2 = np.minimum(r1**10, 1)
+    r3 = 0.03
+    d_tau = ((r1+r2+r3)/tau_0)*time_span_in_sec
+
+    # In case of new snow, the age factor becomes 0.
+    age_factor_tau = np.where(np.isnan(age_factor_tau) | (prec_snow >= 0.01), 0., age_factor_tau) + d_tau
+    F_age = age_factor_tau/(1+age_factor_tau)
+
+    alfa_vd = (1-C_v*F_age)*alfa_v0
+    alfa_ird = (1-C_ir*F_age)*alfa_ir0
+
+    cos_zenith = np.cos(zenith_angle)
+    f_omg = np.where(cos_zenith < 0.5, (1/b)*(((b+1)/(1+2*b*cos_zenith))-1), 0.)
+
+    alfa_v = alfa_vd + 0.4*f_omg*(1-alfa_vd)
+    alfa_ir = alfa_ird + 0.4*f_omg*(1-alfa_ird)
+    albedo_init = 0.5*alfa_v+0.5*alfa_ir
+
+    radiation_extinction = (1-(snow_depth/h_sd))*np.exp(-(snow_depth/(2*h_sd)))
+    albedo = np.where(snow_depth < h_sd, radiation_extinction*albedo_bare_ground + (1-radiation_extinction)*albedo_init,
+                      albedo_init)
+
+    return age_factor_tau, albedo
+
+
+def get_albedo_ueb_derivative(prec_snow, snow_depth, temp_surface, zenith_angle, time_span_in_sec, age_factor_tau):
+    """Derivative of the UEB albedo with respect to surface temperature on many lakes. See
+    energybalance.get_albedo_ueb_derivative.
+
+    :return:    [array] [K^-1] d(albedo)/d(temp_surface)
+    """
+
+    snow_depth = snow_depth + prec_snow
+
+    C_v = 0.2
+    C_ir = 0.5
+    alfa_v0 = 0.95
+    alfa_ir0 = 0.65
+    tau_0 = 1000000
+    h_sd = 0.05
+    b = 2
+
+    r1 = np.exp(5000*((1/273.16)-(1/(temp_surface+273.16))))
+    d_r1 = r1 * 5000/(temp_surface+273.16)**2
+    d_r2 = np.where(r1**10 < 1, 10*r1**9*d_r1, 0.)
+    r2 = np.minimum(r1**10, 1)
+    r3 = 0.03
+    d_tau = ((r1+r2+r3)/tau_0)*time_span_in_sec
+    d_d_tau = ((d_r1+d_r2)/tau_0)*time_span_in_sec
+
+    age_factor_tau = np.where(np.isnan(age_factor_tau) | (prec_snow >= 0.01), 0., age_factor_tau) + d_tau
+    d_F_age = d_d_tau/(1+age_factor_tau)**2
+
+    cos_zenith = np.cos(zenith_angle)
+    f_omg = np.where(cos_zenith < 0.5, (1/b)*(((b+1)/(1+2*b*cos_zenith))-1), 0.)
+
+    d_alfa_v = -C_v*alfa_v0*d_F_age * (1-0.4*f_omg)
+    d_alfa_ir = -C_ir*alfa_ir0*d_F_age * (1-0.4*f_omg)
+    d_albedo = 0.5*d_alfa_v+0.5*d_alfa_ir
+
+    radiation_extinction = (1-(snow_depth/h_sd))*np.exp(-(snow_depth/(2*h_sd)))
+    return np.where(snow_depth < h_sd, d_albedo*(1-radiation_extinction), d_albedo)
+
+
+def get_turbulent_flux(temp_atm, temp_surface, time_span_in_sec, surface_roughness, pressure_atm, wind, rel_hum,
+                       method=defaults.default_turbulent_flux_method):
+    """Latent and sensible heat fluxes on many lakes. See energybalance.get_turbulent_flux.
+
+    :param surface_roughness:   [array] [m] Surface roughness of the top layer on each lake.
+    :return:    H, LE, R_i, stability_correction    [arrays]
+    """
+
+    c_air = const.c_air
+    rho_air = const.rho_air
+    k = const.von_karmans_const
+    g = const.g
+
+    zu = 10                         # Height of wind measurements.
+    zt = 10                         # Height of temperature measurements.
+    z_0 = surface_roughness
+
+    ea = 0.611 * np.exp((17.3*temp_atm)/(temp_atm+273.3))
+    es = 0.611 * np.exp((17.3*temp_surface)/(temp_surface+273.3))
+
+    if method == "MARTIN 1998":
+        coeff_n = k**2 / (np.log(zu/z_0)*np.log(zt/z_0))
+        R_i = 2*g/(temp_atm - const.absolute_zero) * (temp_atm - temp_surface)/zt * zu/wind
+        a = 0.83*coeff_n**(-0.62)
+        with np.errstate(invalid='ignore'):
+            unstable = 1 + 7/a * np.log(1-a*R_i)
+        stable = rho_air * c_air * coeff_n * np.maximum(0.75, (1-5*R_i)**2)
+        stability_correction = np.where(R_i > 0, stable, np.where(R_i < 0, unstable, 1.))
+
+        coeff = coeff_n * stability_correction
+        H = rho_air * c_air * coeff * wind * (temp_atm - temp_surface)
+        LE = const.L_sublimation*rho_air/pressure_atm * const.molecular_weight_ratio * coeff*wind * (ea * rel_hum - es)
+
+    elif method == "YOU 2014":
+        common = k**2/(np.log(zu/z_0))**2
+        R_i = g * zu * (temp_atm-temp_surface) / (0.5 * (temp_atm + temp_surface - const.absolute_zero*2) * wind**2)
+        with np.errstate(invalid='ignore'):
+            unstable = (1-16*R_i)**0.75
+        stability_correction = np.where(R_i > 0, 1/(1+10*R_i), np.where(R_i < 0, unstable, 1.))
+        stability_correction = np.minimum(stability_correction, 3.)
+
+        common = common * stability_correction
+        H = c_air*rho_air*common*wind*(temp_atm-temp_surface)
+        latent_heat = np.where(temp_surface < 0., const.L_vapour + const.L_fusion, const.L_vapour)
+        LE = latent_heat*0.622*(rho_air/pressure_atm)*common*wind*(ea-es)
+
+    else:
+        ml.log_and_print("[warning] energybalancebatch.py -> get_turbulent_flux: No valid method given.")
+        return None, None, None, None
+
+    # J pr time span to kJ
+    return H * time_span_in_sec / 1000, LE * time_span_in_sec / 1000, R_i, stability_correction
+
+
+def get_turbulent_flux_derivative(temp_atm, temp_surface, time_span_in_sec, surface_roughness, pressure_atm, wind,
+                                  rel_hum, method=defaults.default_turbulent_flux_method):
+    """Derivative of the turbulent fluxes (H + LE) with respect to surface temperature on many lakes. See
+    energybalance.get_turbulent_flux_derivative.
+
+    :return:    [array] [kJm^(-2)K^(-1)] d(H + LE)/d(temp_surface)
+    """
+
+    c_air = const.c_air
+    rho_air = const.rho_air
+    k = const.von_karmans_const
+    g = const.g
+
+    zu = 10                         # Height of wind measurements.
+    zt = 10                         # Height of temperature measurements.
+    z_0 = surface_roughness
+
+    ea = 0.611 * np.exp((17.3*temp_atm)/(temp_atm+273.3))
+    es = 0.611 * np.exp((17.3*temp_surface)/(temp_surface+273.3))
+    d_es = es * 17.3*273.3/(temp_surface+273.3)**2
+
+    if method == "MARTIN 1998":
+        coeff_n = k**2 / (np.log(zu/z_0)*np.log(zt/z_0))
+        R_i = 2*g/(temp_atm - const.absolute_zero) * (temp_atm - temp_surface)/zt * zu/wind
+        d_R_i = -2*g/(temp_atm - const.absolute_zero) / zt * zu/wind
+        a = 0.83*coeff_n**(-0.62)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            unstable = 1 + 7/a * np.log(1-a*R_i)
+            d_unstable = -7/(1-a*R_i) * d_R_i
+        stable = rho_air * c_air * coeff_n * np.maximum(0.75, (1-5*R_i)**2)
+        d_stable = np.where((1-5*R_i)**2 > 0.75, rho_air * c_air * coeff_n * -10*(1-5*R_i) * d_R_i, 0.)
+        stability_correction = np.where(R_i > 0, stable, np.where(R_i < 0, unstable, 1.))
+        d_stability_correction = np.where(R_i > 0, d_stable, np.where(R_i < 0, d_unstable, 0.))
+
+        d_H = rho_air * c_air * coeff_n * wind * (d_stability_correction*(temp_atm - temp_surface) - stability_correction)
+        d_LE = const.L_sublimation*rho_air/pressure_atm * const.molecular_weight_ratio * coeff_n*wind \
+            * (d_stability_correction*(ea * rel_hum - es) - stability_correction*d_es)
+
+    elif method == "YOU 2014":
+        common = k**2/(np.log(zu/z_0))**2
+        denominator = 0.5 * (temp_atm + temp_surface - const.absolute_zero*2) * wind**2
+        R_i = g * zu * (temp_atm-temp_surface) / denominator
+        d_R_i = -g * zu * (temp_atm - const.absolute_zero) * wind**2 / denominator**2
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            unstable = (1-16*R_i)**0.75
+            d_unstable = -12*(1-16*R_i)**-0.25 * d_R_i
+        stability_correction = np.where(R_i > 0, 1/(1+10*R_i), np.where(R_i < 0, unstable, 1.))
+        d_stability_correction = np.where(R_i > 0, -10/(1+10*R_i)**2 * d_R_i, np.where(R_i < 0, d_unstable, 0.))
+        d_stability_correction = np.where(stability_correction > 3., 0., d_stability_correction)
+        stability_correction = np.minimum(stability_correction, 3.)
+
+        latent_heat = np.where(temp_surface < 0., const.L_vapour + const.L_fusion, const.L_vapour)
+
+        d_H = c_air*rho_air*common*wind*(d_stability_correction*(temp_atm-temp_surface) - stability_correction)
+        d_LE = latent_heat*0.622*(rho_air/pressure_atm)*common*wind \
+            * (d_stability_correction*(ea-es) - stability_correction*d_es)
+
+    else:
+        ml.log_and_print("[warning] energybalancebatch.py -> get_turbulent_flux_derivative: No valid method given.")
+        return None
+
+    # J pr time span to kJ
+    return (d_H + d_LE) * time_span_in_sec / 1000
+
+
+if __name__ == "__main__":
+
+    import datetime as dt
+    from icemodelling import icebatch as ib, icethickness as it
+
+    dates = [dt.datetime(2018, 11, 1) + dt.timedelta(days=i) for i in range(150)]
+    temps = np.array([[-6. + 9. * np.sin(i / (7. + l)) for i in range(150)] for l in range(3)])
+    snow = np.array([[0.02 if (i + l) % 9 == 0 else 0. for i in range(150)] for l in range(3)])
+    prec = snow / 3
+    first_ice = [ice.IceColumn(dates[0], []),
+                 ice.IceColumn(dates[10], [ice.IceLayer(0.1, 'black_ice')]),
+                 ice.IceColumn(dates[0], [ice.IceLayer(0.05, 'snow'), ice.IceLayer(0.2, 'black_ice')])]
+    for ice_column in first_ice:
+        ice_column.update_column_temperatures(-5.)
+
+    trajectories, energy_balance = ib.calculate_ice_cover_eb_batch(
+        260151, 6671132, dates, temps, prec, snow, None, 3., 0.8, 101.1, first_ice)
+
+    # The same as the energy balance on one lake at a time
+    for l in range(len(first_ice)):
+        calculated_ice, ebs = it.calculate_ice_cover_eb(
+            260151, 6671132, dates, temps[l], prec[l], snow[l], [None] * 150, [3.] * 150, [0.8] * 150,
+            [101.1] * 150, inn_column=first_ice[l].copy())
+        for ci, ti in zip(calculated_ice, trajectories[l]):
+            assert ci.date == ti.date and np.isclose(ci.draft_thickness, ti.draft_thickness)
+        temp_surfaces = [np.nan if eb.EB is None else eb.temp_surface for eb in ebs]
+        assert np.allclose(temp_surfaces, energy_balance['temp_surface'][l, -len(ebs):], equal_nan=True)
+
+    # Parameters differing between the lakes give the same as on one lake at a time with those parameters
+    parameter_sets = [{'alfa_black_ice': 0.4, 'eps_snow': 0.9, 'h_min_for_conductivity_black_ice': 0.2},
+                      {'alfa_slush_ice': 0.6, 'alfa_max': 0.9, 'temp_rain_snow': 1.5},
+                      {'temp_f': -0.5, 'surface_k_reduction_snow': 0.8, 'eps_ice': 0.95}]
+    trajectories, energy_balance = ib.calculate_ice_cover_eb_batch(
+        260151, 6671132, dates, temps, prec, snow, None, 3., 0.8, 101.1, first_ice, parameter_sets=parameter_sets)
+
+    for l in range(len(first_ice)):
+        calculated_ice, ebs = it.calculate_ice_cover_eb(
+            260151, 6671132, dates, temps[l], prec[l], snow[l], [None] * 150, [3.] * 150, [0.8] * 150,
+            [101.1] * 150, inn_column=first_ice[l].copy(), parameters=trajectories[l].parameters)
+        for ci, ti in zip(calculated_ice, trajectories[l]):
+            assert ci.date == ti.date and np.isclose(ci.draft_thickness, ti.draft_thickness)
+        temp_surfaces = [np.nan if eb.EB is None else eb.temp_surface for eb in ebs]
+        assert np.allclose(temp_surfaces, energy_balance['temp_surface'][l, -len(ebs):], equal_nan=True)
+
+    print(np.nanmean(energy_balance['temp_surface'], axis=1), energy_balance['iterations'].sum(axis=1))
@@ -7,7 +7,7 @@ __author__ = 'ragnarekker'
 default_cloud_cover_method = "Binary"
 
 # temp_surface_from_eb
-default_iteration_method = "Newton_Raphson"
+default_iteration_method = "Newton_bracket"
 default_iteration_error = 10.
 
 # temp_surface_from_eb --> method == "Delta_T"
@@ -20,6 +20,11 @@ num_iterations_cut_of = 50
 d_temp_max = 10.
 num_iterations_max = 20
 
+# temp_surface_from_eb --> method == "Newton_bracket". Also uses num_iterations_cut_of and d_temp_max.
+bracket_step = 1.               # [C] first step when searching for a bracket if the derivative can not be used
+num_bracket_steps_max = 20      # the step is doubled on each, so the bracket may be far from the first guess
+temp_tolerance = 10**-6         # [C] the iteration stops if the bracket is narrower
+
 # get_short_wave
 default_albedo_method = "ueb"
 
@@ -3,6 +3,7 @@ from utilities import getmisc as gm
 from utilities import getregobsdata as gro
 from icemodellingscripts import calculateandplot as cap
 from utilities import makepickle as mp
+from icemodelling import icetrajectory as itr
 import setenvironment as se
 
 import pandas as pd
@@ -138,7 +139,7 @@ def make_observation_and_calculation_on_location():
                 calculated, observed, plot_filename = cap._plot_season(
                     location_id, from_date, to_date, observed_ice, make_plots=make_plots,
                     plot_folder=se.sesong_plots_folder)
-                all_calculated[location_id] = calculated
+                all_calculated[location_id] = itr.as_ice_trajectory(calculated)
                 all_observed[location_id] = observed
 
                 mp.pickle_anything([all_calculated, all_observed], pickle_file_name_and_path)
@@ -148,16 +149,17 @@ def make_observation_and_calculation_on_location():
 
         for ln in all_observed.keys():
             skipp_first = True
+            calculated_trajectory = itr.as_ice_trajectory(all_calculated[ln])
 
             for oi in all_observed[ln]:
 
                 if skipp_first:
                     skipp_first = False     # first observation is that of the initial ice
                 else:
-                    for ci in all_calculated[ln]:
-                        if ci.date.date() == oi.date.date():
-                            data_point = ObsCalMLData(ci, oi)
-                            data.append(data_point)
+                    ci = calculated_trajectory.get_ice_column(oi.date)
+                    if ci is not None:
+                        data_point = ObsCalMLData(ci, oi)
+                        data.append(data_point)
 
     df = pd.DataFrame([d.to_dict() for d in data])
     csv_file_name = r'{0}all_observed_and_calculated_ice_{1}-{2}.csv'.format(se.data_sets_folder, years[0][:4], years[-1][5:])
@@ -2,29 +2,184 @@
 """Classes for handling ice Thickness and Ice Cover. Much of the ice model is in the methods in these classes."""
 
 import math
+import bisect
+import weakref
 import datetime as dt
+import numpy as np
 from icemodelling import parameterization as pz, constants as const
+from icemodelling import modelparameters as mpar
 from utilities import getregobsdata as gro, getfiledata as gfd, makelogs as ml
 
 __author__ = 'ragnarekker'
 
 
+# Layer types given as small integer codes. The code is the index in this list. Material properties of the
+# layer types are looked up in the tables below, which are indexed by the same code. Layer types not in the
+# list are given the code of 'undefined'.
+layer_types = ['new_snow', 'snow', 'drained_snow', 'slush', 'slush_ice', 'black_ice', 'water', 'unknown', 'undefined']
+layer_type_codes = {t: i for i, t in enumerate(layer_types)}
+
+# LayerTypes given as enums. Values 0-9 are liquids, 10-19 are ice, 20-29 are snow.
+# Unknown ice type is treated as slush_ice.
+layer_enums = (20, 21, 22, 2, 11, 10, 1, 11, -1)
+
+# The tables below are for the constants in icemodelling.constants. Columns with other model parameters use the
+# tables of their ModelParameters.
+
+# Thermal conductivities [W/m/K]
+layer_conductivities = (const.k_new_snow, const.k_snow, const.k_drained_snow, const.k_slush, const.k_slush_ice,
+                        const.k_black_ice, const.k_water, const.k_slush_ice, None)
+
+# Densities [kg m-3]
+layer_densities = (const.rho_new_snow, const.rho_snow, const.rho_drained_snow, const.rho_slush, const.rho_slush_ice,
+                   const.rho_black_ice, const.rho_water, const.rho_slush_ice, None)
+
+# Specific heat capacities [J/kg/K]
+layer_heat_capacities = (const.c_snow, const.c_snow, const.c_snow, const.c_slush, const.c_ice,
+                         const.c_ice, const.c_water, const.c_ice, -1)
+
+# Surface roughness [m] as used to calculate turbulent fluxes
+layer_surface_roughness = (const.z_new_snow, const.z_snow, const.z_drained_snow, const.z_slush, const.z_slush_ice,
+                           const.z_black_ice, const.z_water, const.z_black_ice, -1)
+
+# Conductivities used for thermal diffusivity. Unknown ice is here given as black ice.
+layer_diffusivity_conductivities = (const.k_new_snow, const.k_snow, const.k_drained_snow, const.k_slush,
+                                    const.k_slush_ice, const.k_black_ice, const.k_water, const.k_black_ice, None)
+
+# Colours used for plotting and the norwegian names used for legends in plots.
+layer_colours = ('0.9', '0.8', '0.7', 'blue', '0.4', '0.1', 'red', 'orange', 'yellow')
+layer_norwegian_names = ('Nysnø', 'Snø', 'Tørket snø', 'Sørpe', 'Sørpeis', 'Stålis', 'Vann', 'Ukjent istype',
+                         'Ukjent forespørsel')
+
+# The enums as array for the array backed ice column.
+layer_type_enums = np.array(layer_enums, dtype=np.int8)
+
+
+def get_layer_type_code(type_inn):
+    """Returns the type code of a layer type. Unknown layer types are given the code of 'undefined'.
+
+    :param type_inn:    [string] Layer type, e.g. 'black_ice'.
+    :return:            [int] Type code.
+    """
+
+    type_code = layer_type_codes.get(type_inn)
+
+    if type_code is None:
+        ml.log_and_print("[warning] ice.py -> get_layer_type_code: Unknown layer type {}".format(type_inn))
+        type_code = layer_type_codes['undefined']
+
+    return type_code
+
+
 class IceLayer:
     """Each layer in the ice column is given its own IceLayer object. The constructor takes as minimum
     height and type and sets conductivity and density from constants.
+
+    Material properties are looked up in the tables of the model parameters. These are the parameters given to
+    the method, else those of the column the layer is in, else the default parameters (icemodelling.constants).
+
+    The layer type is stored as a type code and all material properties are looked up in tables indexed by
+    the type code.
+
+    When the layer is in an IceColumn, owner_column is the column. It is kept as a weak reference so a layer kept
+    after its column is gone does not keep the column alive. Setting the type, height, density or conductivity of
+    the layer tells the column that its layers have changed (IceColumn.layers_changed).
     """
 
-    def __init__(self, height_inn, type_inn):
+    __slots__ = ('type_code', '_height', '_density', '_conductivity', '_owner_column_ref',
+                 'temperature', 'temperature_top', 'temperature_bottom', 'metadata')
 
+    def __init__(self, height_inn, type_inn, parameters=None):
+
+        self._owner_column_ref = None
         self.type = type_inn
-        self.height = height_inn
-        if height_inn: self.height = float(height_inn)  # If height_inn has value make sure it is a float
-        self.set_conductivity()
-        self.set_density()
+        self.height = float(height_inn) if height_inn else height_inn  # If height_inn has value make sure it is a float
+        self.set_conductivity(parameters)
+        self.set_density(parameters)
 
         self.temperature = None
         self.metadata = {} # Metadata given as dictionary {key:value , key:value, ... }
 
+    def __getstate__(self):
+        """The state of the layer for pickling. The owner column is not kept, since weak references can not be
+        pickled. IceColumn.__setstate__ sets it again on the layers of a column."""
+
+        return None, {name: getattr(self, name) for name in IceLayer.__slots__
+                      if name != '_owner_column_ref' and hasattr(self, name)}
+
+    def __setstate__(self, state):
+        """Sets the state of an unpickled layer. Layers pickled before IceLayer had __slots__ have their state as a
+        dictionary where the layer type is given by name (type) and not by type code.
+
+        :param state:   [dict or tuple] The dictionary of an old layer or (None, slots) of a layer with __slots__.
+        """
+
+        if isinstance(state, tuple):
+            state = dict(state[0] or {}, **(state[1] or {}))
+        else:
+            state = dict(state)
+
+        if 'type' in state:
+            state['type_code'] = get_layer_type_code(state.pop('type'))
+
+        self.owner_column = None
+        self.temperature = None
+        self.metadata = {}
+
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @property
+    def owner_column(self):
+        owner_column_ref = self._owner_column_ref
+        return None if owner_column_ref is None else owner_column_ref()
+
+    @owner_column.setter
+    def owner_column(self, owner_column_inn):
+        self._owner_column_ref = None if owner_column_inn is None else weakref.ref(owner_column_inn)
+
+    def _layer_changed(self):
+        if self._owner_column_ref is not None:
+            owner_column = self._owner_column_ref()
+            if owner_column is not None:
+                owner_column.layers_changed()
+
+    @property
+    def type(self):
+        return layer_types[self.type_code]
+
+    @type.setter
+    def type(self, type_inn):
+        self.type_code = get_layer_type_code(type_inn)
+        self._layer_changed()
+
+    @property
+    def height(self):
+        return self._height
+
+    @height.setter
+    def height(self, height_inn):
+        self._height = height_inn
+        self._layer_changed()
+
+    @property
+    def density(self):
+        return self._density
+
+    @density.setter
+    def density(self, density_inn):
+        self._density = density_inn
+        self._layer_changed()
+
+    @property
+    def conductivity(self):
+        return self._conductivity
+
+    @conductivity.setter
+    def conductivity(self, conductivity_inn):
+        self._conductivity = conductivity_inn
+        self._layer_changed()
+
     def set_temperature(self, temperature_inn):
         # Avarage temp of layer
         self.temperature = temperature_inn
@@ -35,101 +190,77 @@ class IceLayer:
     def set_temperature_bottom(self, temperature_bottom_inn):
         self.temperature_bottom = temperature_bottom_inn
 
-    def set_type(self, type_inn):
+    def get_parameters(self, parameters=None):
+        """Returns the model parameters used for this layer. See the class description."""
+        if parameters is not None:
+            return parameters
+        if self.owner_column is not None:
+            return self.owner_column.parameters
+        return mpar.default_parameters
+
+    def set_type(self, type_inn, parameters=None):
         """Set the layer material type and update material properties."""
         self.type = type_inn
-        self.set_density()
-        self.set_conductivity()
+        self.set_density(parameters)
+        self.set_conductivity(parameters)
 
-    def set_conductivity(self):
+    def set_conductivity(self, parameters=None):
         """Sets conductivity for a given snow or ice type. Method should only be used
         when initialising a new IceLayer or layer type is converted."""
-        if self.type == 'new_snow':     self.conductivity = const.k_new_snow
-        elif self.type == 'snow':       self.conductivity = const.k_snow
-        elif self.type == 'drained_snow': self.conductivity = const.k_drained_snow
-        elif self.type == 'slush':      self.conductivity = const.k_slush
-        elif self.type == 'slush_ice':  self.conductivity = const.k_slush_ice
-        elif self.type == 'black_ice':  self.conductivity = const.k_black_ice
-        elif self.type == 'water':      self.conductivity = const.k_water
-        elif self.type == 'unknown':    self.conductivity = const.k_slush_ice
-
-    def set_density(self):
+        self.conductivity = self.get_parameters(parameters).layer_conductivities[self.type_code]
+
+    def set_density(self, parameters=None):
         # Desities [kg m-3]
         # Method should only be used when initialising a new IceLayer
-        if self.type == 'new_snow':     self.density = const.rho_new_snow
-        elif self.type == 'snow':       self.density = const.rho_snow
-        elif self.type == 'drained_snow': self.density = const.rho_drained_snow
-        elif self.type == 'slush':      self.density = const.rho_slush
-        elif self.type == 'slush_ice':  self.density = const.rho_slush_ice
-        elif self.type == 'black_ice':  self.density = const.rho_black_ice
-        elif self.type == 'water':      self.density = const.rho_water
-        elif self.type == 'unknown':    self.density = const.rho_slush_ice
+        self.density = self.get_parameters(parameters).layer_densities[self.type_code]
 
     def add_metadata(self, key, value):
         self.metadata[key] = value
 
+    def copy(self):
+        """Returns a copy of the layer. The metadata dictionary is copied, but the metadata values are shared
+        with the original layer, so metadata objects are not copied.
+
+        :return:    [IceLayer]
+        """
+
+        layer = IceLayer.__new__(IceLayer)
+        layer._owner_column_ref = None
+        layer.type_code = self.type_code
+        layer._height = self.height
+        layer._density = self.density
+        layer._conductivity = self.conductivity
+        layer.temperature = self.temperature
+        if hasattr(self, 'temperature_top'):
+            layer.temperature_top = self.temperature_top
+        if hasattr(self, 'temperature_bottom'):
+            layer.temperature_bottom = self.temperature_bottom
+        layer.metadata = self.metadata.copy()
+
+        return layer
+
     def get_colour(self):
         # returns the color used for plotting a given snow or ice type
-        if self.type == 'new_snow': return "0.9"
-        elif self.type == 'snow': return "0.8"
-        elif self.type == 'drained_snow': return "0.7"
-        elif self.type == 'slush': return "blue"
-        elif self.type == 'slush_ice': return "0.4"
-        elif self.type == 'black_ice': return "0.1"
-        elif self.type == 'water': return "red"
-        elif self.type == 'unknown': return "orange"
-        else: return "yellow"
+        return layer_colours[self.type_code]
 
     def get_norwegian_name(self):
         # returns the norwegian name of the ice layer type. Used for legend in plots.
-        if self.type == 'new_snow': return 'Nysnø'
-        elif self.type == 'snow': return 'Snø'
-        elif self.type == 'drained_snow': return 'Tørket snø'
-        elif self.type == 'slush': return 'Sørpe'
-        elif self.type == 'slush_ice': return 'Sørpeis'
-        elif self.type == 'black_ice': return 'Stålis'
-        elif self.type == 'water': return 'Vann'
-        elif self.type == 'unknown': return 'Ukjent istype'
-        else: return 'Ukjent forespørsel'
+        return layer_norwegian_names[self.type_code]
 
     def get_enum(self):
         # returns the get_enum used for a given snow or ice type
         # LayerTypes given as enums. Values 0-9 are liquids, 10-19 are ice, 20-29 are snow
-        if self.type == 'new_snow': return 20
-        elif self.type == 'snow': return 21
-        elif self.type == 'drained_snow': return 22
-        elif self.type == 'slush': return 2
-        elif self.type == 'slush_ice': return 11
-        elif self.type == 'black_ice': return 10
-        elif self.type == 'water': return 1
-        elif self.type == 'unknown': return 11      # unknown icetype is treated as slush_ice
-        else: return -1
-
-    def get_heat_capacity(self):
+        return layer_enums[self.type_code]
+
+    def get_heat_capacity(self, parameters=None):
         # returns heat capacity given the type of layer
-        if self.type == 'new_snow': return const.c_snow
-        elif self.type == 'snow': return const.c_snow
-        elif self.type == 'drained_snow': return const.c_snow
-        elif self.type == 'slush': return const.c_slush
-        elif self.type == 'slush_ice': return const.c_ice
-        elif self.type == 'black_ice': return const.c_ice
-        elif self.type == 'water': return const.c_water
-        elif self.type == 'unknown': return const.c_ice
-        else: return -1
-
-    def get_surface_roughness(self):
+        return self.get_parameters(parameters).layer_heat_capacities[self.type_code]
+
+    def get_surface_roughness(self, parameters=None):
         # Surface roughness [m] as used to calculate turbulent fluxes
-        if self.type == 'new_snow': return const.z_new_snow
-        elif self.type == 'snow': return const.z_snow
-        elif self.type == 'drained_snow': return const.z_drained_snow
-        elif self.type == 'slush': return const.z_slush
-        elif self.type == 'slush_ice': return const.z_slush_ice
-        elif self.type == 'black_ice': return const.z_black_ice
-        elif self.type == 'water': return const.z_water
-        elif self.type == 'unknown': return const.z_black_ice
-        else: return -1
-
-    def get_thermal_diffusivity(self):
+        return self.get_parameters(parameters).layer_surface_roughness[self.type_code]
+
+    def get_thermal_diffusivity(self, parameters=None):
         """returns Thermal diffusivity given the type of layer
         Thermal diffusivity (alpha) [m^2/sek]
 
@@ -142,29 +273,36 @@ class IceLayer:
         From https://en.wikipedia.org/wiki/Thermal_diffusivity
         """
 
-        if self.type == 'new_snow':         return const.k_new_snow     /self.density/   const.c_snow
-        elif self.type == 'snow':           return const.k_snow         /self.density/   const.c_snow
-        elif self.type == 'drained_snow':   return const.k_drained_snow /self.density/   const.c_snow
-        elif self.type == 'slush':          return const.k_slush        /self.density/   const.c_slush
-        elif self.type == 'slush_ice':      return const.k_slush_ice    /self.density/   const.c_ice
-        elif self.type == 'black_ice':      return const.k_black_ice    /self.density/   const.c_ice
-        elif self.type == 'water':          return const.k_water        /self.density/   const.c_water
-        elif self.type == 'unknown':        return const.k_black_ice    /self.density/   const.c_ice
-        else: return -1
+        if self.type_code == layer_type_codes['undefined']:
+            return -1
+
+        parameters = self.get_parameters(parameters)
+        return parameters.layer_diffusivity_conductivities[self.type_code] / self.density / parameters.layer_heat_capacities[self.type_code]
 
 
 class IceColumn:
 
-    def __init__(self, date_inn, column_inn):
+    # Model parameters of columns made before columns had parameters (e.g. unpickled) are the defaults.
+    parameters = mpar.default_parameters
+
+    def __init__(self, date_inn, column_inn, parameters=None):
         """This initializes the object.
         An empty column is initialized as iceColumn(date as datetime, 0)
         Column_inn includes new snow layer on index 0.
 
         :param date_inn:        [datetime]
         :param column_inn:      list[IceLayers]
+        :param parameters:      [ModelParameters] Model constants used when the column is modelled. If None, the
+                                constants in icemodelling.constants are used.
         :return:
         """
 
+        self.parameters = mpar.get_parameters(parameters)
+
+        self.computed_values = frozenset()  # Names of cached values calculated from the present layers
+        self.refresh_values = frozenset()   # Names of cached values calculated from layers that have changed
+        self.depth_index = None             # [LayerDepthIndex] Cumulative depths and resistances. See get_depth_index.
+
         self.date = date_inn                # Date
         self.column = None                  # Ice column with [IceLayers].
         self.water_line = None              # Distance from bottom of ice column to the water surface. Negative number meens not initiallized
@@ -182,9 +320,85 @@ class IceColumn:
             self.column = column_inn
             self.water_line = -1
             self.draft_thickness = -1
+            for layer in column_inn:
+                layer.owner_column = self
 
         self.add_metadata('LocationName', 'Unknown lake')   # Location name needed for plotting
 
+    def __setstate__(self, state):
+        """Sets the state of an unpickled column. Columns pickled before the cached values were kept have
+        water_line, draft_thickness and total_column_height as plain attributes and no cache state or parameters.
+        These are given as in __init__.
+
+        :param state:   [dict] The dictionary of the pickled column.
+        """
+
+        state = dict(state)
+        for name in ('water_line', 'draft_thickness', 'total_column_height'):
+            if name in state:
+                state['_' + name] = state.pop(name)
+
+        state.setdefault('parameters', mpar.default_parameters)
+        state.setdefault('computed_values', frozenset())
+        state.setdefault('refresh_values', frozenset())
+        state.setdefault('depth_index', None)
+        self.__dict__.update(state)
+
+        if isinstance(self.column, list):
+            for layer in self.column:
+                if layer.owner_column is None:
+                    layer.owner_column = self
+
+    def set_cached_value(self, name, value, is_computed=False):
+        """Sets one of the cached values water_line, draft_thickness or total_column_height.
+
+        A value calculated from the layers (is_computed) is calculated again when it is used after the layers have
+        changed. Values set from outside the update methods (e.g. observed values) are kept as they are until the
+        update method of the value is called.
+
+        :param name:            [string] 'water_line', 'draft_thickness' or 'total_column_height'
+        :param value:
+        :param is_computed:     [bool] True if the value is calculated from the present layers.
+        """
+
+        setattr(self, '_' + name, value)
+        if name in self.refresh_values:
+            self.refresh_values = self.refresh_values - {name}
+        if is_computed:
+            self.computed_values = self.computed_values | {name}
+        elif name in self.computed_values:
+            self.computed_values = self.computed_values - {name}
+
+    @property
+    def water_line(self):
+        if 'water_line' in self.refresh_values:
+            self.update_water_line()
+        return self._water_line
+
+    @water_line.setter
+    def water_line(self, water_line_inn):
+        self.set_cached_value('water_line', water_line_inn)
+
+    @property
+    def draft_thickness(self):
+        if 'draft_thickness' in self.refresh_values:
+            self.update_draft_thickness()
+        return self._draft_thickness
+
+    @draft_thickness.setter
+    def draft_thickness(self, draft_thickness_inn):
+        self.set_cached_value('draft_thickness', draft_thickness_inn)
+
+    @property
+    def total_column_height(self):
+        if 'total_column_height' in self.refresh_values:
+            self.update_total_column_height()
+        return self._total_column_height
+
+    @total_column_height.setter
+    def total_column_height(self, total_column_height_inn):
+        self.set_cached_value('total_column_height', total_column_height_inn)
+
     def add_metadata(self, key, value):
         """Add metadata of any kind to the ice column. Metadata is stored as a dictionary.
 
@@ -196,6 +410,23 @@ class IceColumn:
     def remove_metadata(self):
         self.metadata.clear()
 
+    def copy(self):
+        """Returns a snapshot of the ice column. This is a cheaper alternative to copy.deepcopy. Layers are
+        copied with IceLayer.copy, and the column metadata dictionary is copied, but metadata values (e.g. the
+        OriginalObject from regObs) are shared with the original column.
+
+        :return:    [IceColumn] Copy of the ice column.
+        """
+
+        ice_column = self.__class__.__new__(self.__class__)
+        ice_column.__dict__.update(self.__dict__)
+        ice_column.column = [layer.copy() for layer in self.column]
+        for layer in ice_column.column:
+            layer.owner_column = ice_column
+        ice_column.metadata = self.metadata.copy()
+
+        return ice_column
+
     def set_water_line(self, water_line_inn):
         self.water_line = water_line_inn
 
@@ -216,10 +447,52 @@ class IceColumn:
                 self.column.append(layer)
             else:
                 self.column.insert(index, layer)
+            layer.owner_column = self
+            self.layers_changed()
 
     def remove_layer_at_index(self, index):
         """Removes a layer at a given index."""
         self.column.pop(index)
+        self.layers_changed()
+
+    def layers_changed(self):
+        """Called when layers are added, removed or changed (type, height, density or conductivity). It clears the
+        depth index and marks the cached values calculated from the layers (water line, draft thickness and total
+        column height) to be calculated again when used.
+
+        The methods of the column call it, and the layers of the column call it when their type, height, density
+        or conductivity is set. Code replacing the layer list itself (IceColumn.column) must call it as well.
+        """
+
+        self.depth_index = None
+        if self.computed_values:
+            self.refresh_values = self.refresh_values | self.computed_values
+            self.computed_values = frozenset()
+
+    def get_depth_index(self):
+        """Returns the cumulative depths and resistances of the layers. The index is made when needed and kept
+        until layers_changed is called.
+
+        :return:    [LayerDepthIndex]
+        """
+
+        depth_index = getattr(self, 'depth_index', None)
+        if depth_index is None or depth_index.number_of_layers != len(self.column):
+            depth_index = self.make_depth_index()
+            self.depth_index = depth_index
+
+        return depth_index
+
+    def make_depth_index(self):
+        """Makes the depth index from the layers.
+
+        :return:    [LayerDepthIndex]
+        """
+
+        return LayerDepthIndex([l.height for l in self.column],
+                               [l.conductivity for l in self.column],
+                               [l.get_enum() for l in self.column],
+                               k_water=self.parameters.k_water)
 
     def time_step_forward(self, time_step):
         """Step the date forward the timedelta of time_step."""
@@ -237,75 +510,68 @@ class IceColumn:
     def merge_and_remove_excess_layers(self):
         """Cleans up the icecolumn a bit.
            Removes layers of zero height if they occur and merges layers of equal type if they exist
+
+        The column is gone through once. Each layer is either skipped (zero height), merged into the layer above
+        (same type) or kept. In a merge temperature, density and conductivity are averaged weighted by height.
         """
 
         # If no column there is nothing to merge
-        if self.column is not None and len(self.column) > 0:
-
-            # Goes through the ice column to find layers of zero height and removes them
-            i = 0
-            condition = True  # The condition for looping through the column.
-            while condition:
-                if self.column[i].height == 0.:
-                    self.column.pop(i)
-                    i = i - 1  # poping one shortens the list an thus the index counter should go back with it
-                i = i + 1
-                if i >= len(self.column):
-                    condition = False
-
-        # Find neighbouring layers of equal type and merges them
-        if self.column is not None and len(self.column) > 0:
-
-            last_checked_layer_type = 'NA'
-            i = 0
-            condition = True
-            while condition:
-
-                if self.column[i].type == last_checked_layer_type:
-
-                    # average the temperatures
-                    if (self.column[i - 1].temperature != None) and (self.column[i].temperature != None):
-                        self.column[i - 1].temperature = (self.column[i - 1].height * self.column[i - 1].temperature
-                                                          + self.column[i].height * self.column[i].temperature) \
-                                                         / (self.column[i - 1].height + self.column[i].height)
-
-                    # average densities
-                    if (self.column[i - 1].density != None) and (self.column[i].density != None):
-                        self.column[i - 1].density = (self.column[i - 1].height * self.column[i - 1].density
-                                                      + self.column[i].height * self.column[i].density) \
-                                                     / (self.column[i - 1].height + self.column[i].height)
-
-                    # average thermal conductivities
-                    if (self.column[i - 1].conductivity != None) and (self.column[i].conductivity != None):
-                        self.column[i - 1].conductivity = (self.column[i - 1].height * self.column[i - 1].conductivity
-                                                           + self.column[i].height * self.column[i].conductivity) \
-                                                          / (self.column[i - 1].height + self.column[i].height)
-
-                    # merge the two metadata dictionaries
-                    z = self.column[i - 1].metadata.copy()
-                    z.update(self.column[i].metadata)
-                    self.column[i - 1].metadata = z
-
-                    # new layer is sum of the two prior layers
-                    self.column[i - 1].height = self.column[i - 1].height + self.column[i].height
-
-                    self.column.pop(i)
-
-                    # the current layer was removed so the index must be moved back one step
-                    i = i - 1
-
-                last_checked_layer_type = self.column[i].type
-                i = i + 1
-                if i >= len(self.column):
-                    condition = False
-
-    def merge_snow_layers_and_compress(self, temp_atm):
+        if self.column is None or len(self.column) == 0:
+            return
+
+        merged_column = []
+        last_layer = None
+
+        for layer in self.column:
+
+            # Layers of zero height are removed
+            if layer.height == 0.:
+                continue
+
+            # Neighbouring layers of equal type are merged into the upper layer
+            if last_layer is not None and layer.type_code == last_layer.type_code:
+                height_sum = last_layer.height + layer.height
+
+                # average the temperatures
+                if (last_layer.temperature != None) and (layer.temperature != None):
+                    last_layer.temperature = (last_layer.height * last_layer.temperature
+                                              + layer.height * layer.temperature) / height_sum
+
+                # average densities
+                if (last_layer.density != None) and (layer.density != None):
+                    last_layer.density = (last_layer.height * last_layer.density
+                                          + layer.height * layer.density) / height_sum
+
+                # average thermal conductivities
+                if (last_layer.conductivity != None) and (layer.conductivity != None):
+                    last_layer.conductivity = (last_layer.height * last_layer.conductivity
+                                               + layer.height * layer.conductivity) / height_sum
+
+                # merge the two metadata dictionaries. Only made when the lower layer has metadata.
+                if layer.metadata:
+                    merged_metadata = last_layer.metadata.copy()
+                    merged_metadata.update(layer.metadata)
+                    last_layer.metadata = merged_metadata
+
+                # new layer is sum of the two prior layers
+                last_layer.height = height_sum
+
+            else:
+                merged_column.append(layer)
+                last_layer = layer
+
+        if len(merged_column) != len(self.column):
+            self.column[:] = merged_column
+            self.layers_changed()
+
+    def merge_snow_layers_and_compress(self, temp_atm, time_step=60*60*24):
         """Merges the snow layers and compresses the snow. This method updates the snow density in the object and the
         conductivity of the snow in the object.
 
         Snow compaction may be referenced in article in literature folder or evernote.
 
-        :param temp_atm: [float] Temperature in Celsius used in the compaction routine.
+        :param temp_atm:    [float] Temperature in Celsius used in the compaction routine.
+        :param time_step:   [int] Length of the time step in seconds. The compaction formula is for 24hrs.
         """
 
         # If no layers, compaction of snow is not needed
@@ -318,8 +584,10 @@ class IceColumn:
 
             # if no snow, no compaction
             if self.column[0].type == 'snow':
+                p = self.parameters
+
                 # we use a formula for compaction only if air temperature is below freezing and there is snow on top
-                if temp_atm < const.temp_f:
+                if temp_atm < p.temp_f:
 
                     # ice & snow parameter values
                     C1 = 7.0 * 1e-3 * 12  # snow compaction coefficient #1
@@ -329,6 +597,7 @@ class IceColumn:
                     # this is one strange fromula. Would be good to change it with something more familiar..
                     delta_rho_snow = self.column[0].density ** 2 * C1 * self.column[0].height * math.exp(
                         C2 * self.column[0].density) * math.exp(C3 * temp_atm)
+                    delta_rho_snow *= time_step / (60*60*24)
 
                     rho_snow_old = self.column[0].density
                     rho_snow_new = rho_snow_old + delta_rho_snow
@@ -337,11 +606,11 @@ class IceColumn:
                 # Else we have melting conditions and the snow conductivity and density is sett to max
                 else:
                     rho_snow_old = self.column[0].density
-                    rho_snow_new = const.rho_snow_max
-                    k_snow_new = const.k_snow_max
+                    rho_snow_new = p.rho_snow_max
+                    k_snow_new = p.k_snow_max
 
-                self.column[0].density = min([rho_snow_new, const.rho_snow_max])
-                self.column[0].conductivity = min([k_snow_new, const.k_snow_max])
+                self.column[0].density = min([rho_snow_new, p.rho_snow_max])
+                self.column[0].conductivity = min([k_snow_new, p.k_snow_max])
 
                 # Assume a inverse linear correlation between density and the height (preservation og mass?)
                 h_snow_new = self.column[0].height / self.column[0].density * rho_snow_old
@@ -363,19 +632,17 @@ class IceColumn:
                 rest_height:        to the requested depth, how far is it from the top of the layer
         """
 
-        current_depth = 0.
         layer_out = None
         depth_layer_top = None
         rest_height  = None
 
-        for l in self.column:
-            if current_depth < depth_inn:
-                if current_depth + l.height > depth_inn:
-                    layer_out = l
-                    depth_layer_top = current_depth
-                    rest_height = depth_inn-current_depth
-                    break
-                current_depth += l.height
+        depth_index = self.get_depth_index()
+        index = depth_index.get_layer_index_at_z(depth_inn)
+
+        if index is not None:
+            layer_out = self.column[index]
+            depth_layer_top = depth_index.depths[index]
+            rest_height = depth_inn-depth_layer_top
 
         return layer_out, depth_layer_top, rest_height
 
@@ -397,6 +664,8 @@ class IceColumn:
 
             AA * xx = bb
 
+        AA is tridiagonal and the system is solved with the Thomas algorithm (see solve_tridiagonal).
+
         Possible extension: Effect of temp from precious days weight inn, in the end.
 
         :param temp_sfc:        Temp in atmosphere
@@ -405,8 +674,6 @@ class IceColumn:
         TODO: method need to be properly tested.
         """
 
-        import numpy as np
-
         if temp_sfc is None:
             temp_sfc = self.temp_surface
 
@@ -420,7 +687,7 @@ class IceColumn:
 
         num_boundaries = num_dry_layers - 1
         temp_top = temp_sfc
-        temp_bottom = const.temp_f      # freezing temp
+        temp_bottom = self.parameters.temp_f      # freezing temp
 
         # case surface layer is wet, we assume all is 0C
         if num_boundaries == -1:
@@ -442,32 +709,24 @@ class IceColumn:
 
         # case more dry layers, solve numerically
         elif num_boundaries > 0:
-            AA = np.zeros([num_boundaries, num_boundaries])
 
-            for i in range(num_boundaries):
-                AA[i, i] = self.column[i].conductivity * self.column[i].height \
-                        + self.column[i+1].conductivity * self.column[i+1].height
+            # conductivity times height of the dry layers
+            kh = [l.conductivity * l.height for l in self.column[:num_dry_layers]]
 
-            for i in range(num_boundaries-1):
-                AA[i, i+1] = -1 * self.column[i+1].conductivity * self.column[i+1].height
-                AA[i+1, i] = -1 * self.column[i+1].conductivity * self.column[i+1].height
+            # the diagonal and the lower and upper off diagonals of AA
+            diagonal = [kh[i] + kh[i+1] for i in range(num_boundaries)]
+            lower = [-kh[i] for i in range(num_boundaries)]
+            upper = [-kh[i+1] for i in range(num_boundaries)]
 
-            bb = np.zeros([num_boundaries])
-            bb[0] = temp_top * self.column[0].conductivity * self.column[0].height
+            bb = [0.] * num_boundaries
+            bb[0] = temp_top * kh[0]
             if num_boundaries > 1:
-                bb[num_boundaries-1] = temp_bottom * self.column[num_boundaries].conductivity \
-                                     * self.column[num_boundaries].height
+                bb[num_boundaries-1] = temp_bottom * kh[num_boundaries]
 
-            xx = np.linalg.solve(AA, bb)
-
-            #print (AA)
-            #print (xx)
-            #print (bb)
+            xx = solve_tridiagonal(lower, diagonal, upper, bb)
 
             # add the outer boundary conditions to the solution
-            boundary_temps = xx
-            boundary_temps = np.insert(boundary_temps, 0, temp_top)
-            boundary_temps = np.insert(boundary_temps, len(boundary_temps), temp_bottom)
+            boundary_temps = [temp_top] + xx + [temp_bottom]
 
             # layer temp is average of the boundary temps
             for i in range(0, len(boundary_temps)-1, 1):
@@ -493,12 +752,13 @@ class IceColumn:
         dh_slush = self.water_line - self.draft_thickness
 
         # We also have a constant regulating the minimum change before we get a slush event
-        if dh_slush > const.min_slush_change:
+        p = self.parameters
+        if dh_slush > p.min_slush_change:
             # Update the variable that tells that snow presses water up, but do not create ice in the first time step
             self.in_slush_event = True
 
             # Capillary forces pull water up past the equlibrium line
-            dh_slush = dh_slush + const.snow_pull_on_water
+            dh_slush = dh_slush + p.snow_pull_on_water
 
             # find index of deepest snow layer. Slush forms at the bottom of this layer.
             index = 0
@@ -519,7 +779,7 @@ class IceColumn:
                 # 2 gives h_slush * part_ice_in_slush = h_slush_ice
                 #
                 # Define snow_to_slush_ratio = h_slush / h_snow, we end up with:
-                snow_to_slush_ratio = self.column[index].density / (const.rho_slush_ice * const.part_ice_in_slush)
+                snow_to_slush_ratio = self.column[index].density / (p.rho_slush_ice * p.part_ice_in_slush)
                 # ml.log_and_print("[info] ice.py -> update_slush_level: Snow to slush ratio = {}".format(snow_to_slush_ratio), log_it=False, print_it=True)
 
                 if dh_slush > self.column[index].height * snow_to_slush_ratio:
@@ -530,7 +790,7 @@ class IceColumn:
                 # take a part of the layer and make a new slush layer under it.
                 else:
                     self.column[index].height = self.column[index].height - dh_slush / snow_to_slush_ratio
-                    self.add_layer_at_index(index + 1, IceLayer(dh_slush, 'slush'))
+                    self.add_layer_at_index(index + 1, IceLayer(dh_slush, 'slush', p))
                     index = -1
 
 
@@ -570,8 +830,16 @@ class IceColumn:
         """Method updates the iceColumns draft_thickness variable.
         The draft height given by summing ice, slush ice and
         slush layers. I.e. not snow layers (and not the surface slush layer)
+
+        The value is only calculated again if the layers have changed or the value was set from outside.
         """
 
+        if 'draft_thickness' not in self.computed_values:
+            self.set_cached_value('draft_thickness', self.calculate_draft_thickness(), is_computed=True)
+
+    def calculate_draft_thickness(self):
+        """Returns the draft thickness calculated from the layers. See update_draft_thickness."""
+
         draft_thickness = 0
 
         for layer in self.column:
@@ -582,32 +850,47 @@ class IceColumn:
             else:
                 draft_thickness = draft_thickness + layer.height
 
-        self.draft_thickness = draft_thickness
+        return draft_thickness
 
     def update_total_column_height(self):
-        """Sum  of all layers in column. also snow.
+        """Sum  of all layers in column. also snow. Only calculated again if the layers have changed.
         :return:
         """
+
+        if 'total_column_height' not in self.computed_values:
+            self.set_cached_value('total_column_height', self.calculate_total_column_height(), is_computed=True)
+
+    def calculate_total_column_height(self):
+        """Returns the sum of all layers in column calculated from the layers."""
+
         total_height = 0.
 
         for l in self.column:
             total_height += l.height
 
-        self.total_column_height = total_height
+        return total_height
 
     def update_water_line(self):
         """
         Method updates the iceColumns water line variable. This is the distance from the bottom of the ice to the
         waterline. The height of the draft submerged under the water line given by Arkimedes law.
 
+        The value is only calculated again if the layers have changed or the value was set from outside.
+
         :return:
         """
 
+        if 'water_line' not in self.computed_values:
+            self.set_cached_value('water_line', self.calculate_water_line(), is_computed=True)
+
+    def calculate_water_line(self):
+        """Returns the water line calculated from the layers. See update_water_line."""
+
         column_mass = 0
         for layer in self.column:
             column_mass = column_mass + layer.height * layer.density  # height*density = [kg/m2]
-        water_line = column_mass / const.rho_water  # [kg/m2]*[m3/kg]
-        self.water_line = water_line
+        water_line = column_mass / self.parameters.rho_water  # [kg/m2]*[m3/kg]
+        return water_line
 
     def update_top_layer_is_slush(self):
         """Tests if the top most ice column layer is slush. Updates the objects top_layer_is_slush prameter.
@@ -645,42 +928,37 @@ class IceColumn:
 
         where k is thermal conductivity, A is area and L is thickness.
 
+        The layer at the given depth is found by a binary search in the depth index (see get_depth_index).
+
         :param depth_inn: [m] If None total column height is used. I.e. No water conductance below
         :return:
         """
 
-        current_depth = 0.
-        U_total = 0.
-
         if depth_inn is None:
             if self.total_column_height is None:
                 self.update_total_column_height()
             depth_inn = self.total_column_height
 
-        for l in self.column:
-            if U_total == 0.:  # case for the first layer
-                if l.height > depth_inn:
-                    U_total = l.conductivity / (depth_inn-current_depth)
-                    current_depth = depth_inn
-                    break
-                U_total = l.conductivity/l.height
-                current_depth += l.height
-                continue
-            if current_depth < depth_inn:
-                if current_depth + l.height > depth_inn:
-                    U_total = 1/ (1/U_total+(depth_inn-current_depth)/l.conductivity)
-                    current_depth = depth_inn
-                    break
-                U_total = 1/ (1/U_total+l.height/l.conductivity)
-                current_depth += l.height
-            else:
-                break
+        resistance = self.get_depth_index().get_resistance_at_z(depth_inn)
 
-        # if requested depth is deeper than the column, add water conductance
-        if current_depth < depth_inn:
-            U_total = 1/ (1/U_total+(depth_inn-current_depth)/const.k_water)
+        # No layers above the depth (e.g. an empty column) gives no conductance
+        if resistance == 0.:
+            return 0.
 
-        return U_total
+        return 1 / resistance
+
+    def get_conductances_at_z(self, depths_inn):
+        """Returns conductances from surface to many depths. See get_conductance_at_z.
+
+        :param depths_inn:  [array like] [m] Depths.
+        :return:            [array] Conductances.
+        """
+
+        resistances = self.get_depth_index().get_resistances_at_z(depths_inn)
+        conductances = np.zeros(np.shape(resistances))
+        np.divide(1., resistances, out=conductances, where=resistances != 0.)
+
+        return conductances
 
     def get_depth_at_conductance(self, conductance_limit):
         """Given a desired conductance, this method returns the height from the surface to get this
@@ -690,51 +968,505 @@ class IceColumn:
         :return:
         """
 
-        current_depth = 0.
-        resistivity_limit = 1/conductance_limit
-        current_resistivity = 0.
+        current_depth = self.get_depth_index().get_depth_at_resistance(1/conductance_limit)
+        self.active_depth = current_depth
 
-        for l in self.column:
-            if current_resistivity < resistivity_limit:
-                # if were not at the limit, keep adding
-                delta_resistivity = l.height / l.conductivity
-                if current_resistivity + delta_resistivity > resistivity_limit:
-                    # if only part of the layer is added
-                    rest_depth = l.height * (resistivity_limit - current_resistivity)/delta_resistivity
-                    current_depth += rest_depth
-                    current_resistivity = resistivity_limit
-                else:
-                    current_depth += l.height
-                    current_resistivity += delta_resistivity
-            else:
-                # else stop
-                break
+        return current_depth
 
-        # if not enough heigt in the ice column make sure water contributes
-        if current_resistivity < resistivity_limit:
-            rest_depth_in_water = (resistivity_limit - current_resistivity) * const.k_water
-            current_depth += rest_depth_in_water
-            current_resistivity = resistivity_limit
+    def get_depths_at_conductance(self, conductance_limits):
+        """Returns the depths from the surface to get the given conductances. See get_depth_at_conductance.
 
-        self.active_depth = current_depth
+        :param conductance_limits:  [array like] Conductances.
+        :return:                    [array] [m] Depths.
+        """
 
-        return current_depth
+        return self.get_depth_index().get_depths_at_resistance(1 / np.asarray(conductance_limits, dtype=float))
 
     def get_conductance_between_air_and_freezing(self):
         """Find total conductance between air and water or slush."""
 
         U_total = None
+        depth_index = self.get_depth_index()
 
-        # IceLayers listed from the top and down in IceColumn.
-        for l in self.column:
-
-            # If the layer is a solid, it only adds to the total isolation.
-            if (l.get_enum()) > 9:
-                U_total = add_layer_conductance_to_total(U_total, l.conductivity, l.height, l.get_enum)
+        # The surface conductance of the top most solid layer and the resistance of the solids below it.
+        if depth_index.top_solid_index is not None:
+            i = depth_index.top_solid_index
+            U_total = add_layer_conductance_to_total(
+                None, depth_index.conductivities[i], depth_index.heights[i], depth_index.enums[i])
+            if depth_index.solid_resistance_below_top > 0.:
+                U_total = 1/(1/U_total + depth_index.solid_resistance_below_top)
 
         return U_total
 
 
+class LayerDepthIndex:
+    """Cumulative depths and thermal resistances of the layers in an ice column. Queries on depth or
+    conductance are made by binary search in the cumulative values.
+
+    depths[i] and resistances[i] are the depth and the resistance (1/U) from the surface to the top of layer i.
+    The last element is the bottom of the column. Below the column the conductivity of water is used.
+    """
+
+    def __init__(self, heights, conductivities, enums, k_water=const.k_water):
+        """
+        :param heights:         [list of floats] Layer heights from the top and down.
+        :param conductivities:  [list of floats] Layer conductivities.
+        :param enums:           [list of ints] Layer enums (see IceLayer.get_enum).
+        :param k_water:         [float] Conductivity of the water below the column.
+        """
+
+        self.number_of_layers = len(heights)
+        self.heights = heights
+        self.conductivities = conductivities
+        self.enums = enums
+
+        self.depths = [0.]
+        self.resistances = [0.]
+        for h, k in zip(heights, conductivities):
+            self.depths.append(self.depths[-1] + h)
+            self.resistances.append(self.resistances[-1] + h/k)
+
+        # Conductivity used from the top of each layer. Below the column is water.
+        self.conductivities_below = list(conductivities) + [k_water]
+
+        # The top most solid layer (enum > 9) and the sum of resistances of the solid layers below it.
+        self.top_solid_index = None
+        self.solid_resistance_below_top = 0.
+        for i in range(self.number_of_layers):
+            if enums[i] > 9:
+                if self.top_solid_index is None:
+                    self.top_solid_index = i
+                else:
+                    self.solid_resistance_below_top += heights[i]/conductivities[i]
+
+        self.depths_array = None
+        self.resistances_array = None
+        self.conductivities_below_array = None
+
+    def get_layer_index_at_z(self, depth_inn):
+        """Index of the layer at a given depth. None if the depth is on a layer boundary or outside the column."""
+
+        index = bisect.bisect_right(self.depths, depth_inn, 1) - 1
+        if index < self.number_of_layers and self.depths[index] < depth_inn:
+            return index
+        return None
+
+    def get_resistance_at_z(self, depth_inn):
+        """Resistance (1/U) from the surface to a given depth. Water is added below the column."""
+
+        index = min(bisect.bisect_right(self.depths, depth_inn, 1) - 1, self.number_of_layers)
+        return self.resistances[index] + (depth_inn - self.depths[index]) / self.conductivities_below[index]
+
+    def get_depth_at_resistance(self, resistance_inn):
+        """Depth from the surface to get a given resistance (1/U). Water is added below the column."""
+
+        index = min(bisect.bisect_right(self.resistances, resistance_inn, 1) - 1, self.number_of_layers)
+        return self.depths[index] + (resistance_inn - self.resistances[index]) * self.conductivities_below[index]
+
+    def get_resistances_at_z(self, depths_inn):
+        """Vectorised get_resistance_at_z.
+
+        :param depths_inn:      [array like] Depths.
+        :return:                [array] Resistances.
+        """
+
+        self.make_arrays()
+        depths_inn = np.asarray(depths_inn, dtype=float)
+        index = np.clip(np.searchsorted(self.depths_array, depths_inn, side='right') - 1, 0, self.number_of_layers)
+        return self.resistances_array[index] \
+            + (depths_inn - self.depths_array[index]) / self.conductivities_below_array[index]
+
+    def get_depths_at_resistance(self, resistances_inn):
+        """Vectorised get_depth_at_resistance.
+
+        :param resistances_inn: [array like] Resistances.
+        :return:                [array] Depths.
+        """
+
+        self.make_arrays()
+        resistances_inn = np.asarray(resistances_inn, dtype=float)
+        index = np.clip(np.searchsorted(self.resistances_array, resistances_inn, side='right') - 1,
+                        0, self.number_of_layers)
+        return self.depths_array[index] \
+            + (resistances_inn - self.resistances_array[index]) * self.conductivities_below_array[index]
+
+    def make_arrays(self):
+        """The cumulative values as numpy arrays for the vectorised queries. Made on the first such query."""
+
+        if self.depths_array is None:
+            self.depths_array = np.array(self.depths)
+            self.resistances_array = np.array(self.resistances)
+            self.conductivities_below_array = np.array(self.conductivities_below, dtype=float)
+
+
+class ArrayIceLayer(IceLayer):
+    """A view of a single layer in an ArrayIceColumn. It behaves as an IceLayer, but all values are read from
+    and written to the arrays of the column it belongs to.
+
+    The view is bound to the index of the layer in the column. It should not be kept while layers are added or
+    removed above it.
+    """
+
+    __slots__ = ('_owner', '_index')
+
+    # The view writes to the arrays of the column and tells it when layers change. See ArrayIceLayer._set.
+    owner_column = None
+
+    def __init__(self, owner, index):
+        self._owner = owner
+        self._index = index
+
+    def get_parameters(self, parameters=None):
+        if parameters is not None:
+            return parameters
+        return self._owner.parameters
+
+    def _layer_changed(self):
+        # The column is told of changes when the arrays are written to. See _set.
+        pass
+
+    def _get(self, name):
+        return float(getattr(self._owner, name)[self._index])
+
+    def _set(self, name, value):
+        getattr(self._owner, name)[self._index] = np.nan if value is None else value
+        if name in ('heights', 'densities', 'conductivities'):
+            self._owner.layers_changed()
+
+    def _get_temperature(self, name):
+        value = getattr(self._owner, name)[self._index]
+        if np.isnan(value):
+            return None
+        return float(value)
+
+    @property
+    def type_code(self):
+        return int(self._owner.type_codes[self._index])
+
+    @type_code.setter
+    def type_code(self, type_code_inn):
+        self._owner.type_codes[self._index] = type_code_inn
+        self._owner.layers_changed()
+
+    height = property(lambda self: self._get('heights'), lambda self, v: self._set('heights', v))
+    density = property(lambda self: self._get('densities'), lambda self, v: self._set('densities', v))
+    conductivity = property(lambda self: self._get('conductivities'), lambda self, v: self._set('conductivities', v))
+    temperature = property(lambda self: self._get_temperature('temperatures'),
+                           lambda self, v: self._set('temperatures', v))
+    temperature_top = property(lambda self: self._get_temperature('temperatures_top'),
+                               lambda self, v: self._set('temperatures_top', v))
+    temperature_bottom = property(lambda self: self._get_temperature('temperatures_bottom'),
+                                  lambda self, v: self._set('temperatures_bottom', v))
+
+    @property
+    def metadata(self):
+        return self._owner.layer_metadata[self._index]
+
+    @metadata.setter
+    def metadata(self, metadata_inn):
+        self._owner.layer_metadata[self._index] = metadata_inn
+
+
+class _ArrayLayerList:
+    """List like view of the layers in an ArrayIceColumn. Indexing gives ArrayIceLayer views and the list methods
+    used on IceColumn.column (append, insert and pop) are supported."""
+
+    def __init__(self, owner):
+        self._owner = owner
+
+    def __len__(self):
+        return len(self._owner.heights)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ArrayIceLayer(self._owner, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('layer index out of range')
+        return ArrayIceLayer(self._owner, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield ArrayIceLayer(self._owner, i)
+
+    def append(self, layer):
+        self._owner.insert_layer(len(self), layer)
+
+    def insert(self, index, layer):
+        self._owner.insert_layer(index, layer)
+
+    def pop(self, index=-1):
+        if index < 0:
+            index += len(self)
+        layer = self._owner.get_detached_layer(index)
+        self._owner.remove_layer_at_index(index)
+        return layer
+
+
+class ArrayIceColumn(IceColumn):
+    """Ice column where the layers are stored in contiguous NumPy arrays, one array pr layer property
+    (struct of arrays), rather than as a list of IceLayer objects.
+
+    The column variable is a list like view of IceLayer objects so code using ice_column.column works as before.
+    The methods summing over all layers (draft thickness, water line and total height) are done
+    as reductions on the arrays.
+
+    Layer types are stored as type codes. See layer_types and layer_type_codes. Layer temperatures not yet
+    calculated are stored as nan and are given as None in the layer view.
+    """
+
+    # Names of the arrays holding the layer properties. All have one element pr layer.
+    layer_arrays = ['type_codes', 'heights', 'densities', 'conductivities',
+                    'temperatures', 'temperatures_top', 'temperatures_bottom']
+
+    def __init__(self, date_inn, column_inn, parameters=None):
+        """An empty column is initialized as ArrayIceColumn(date as datetime, 0).
+
+        :param date_inn:        [datetime]
+        :param column_inn:      list[IceLayers]
+        :param parameters:      [ModelParameters] Optional. See IceColumn.
+        """
+
+        self.type_codes = None
+        self.heights = None
+        self.densities = None
+        self.conductivities = None
+        self.temperatures = None
+        self.temperatures_top = None
+        self.temperatures_bottom = None
+        self.layer_metadata = None
+
+        # The layers are copied to the arrays and are not owned by this column.
+        IceColumn.__init__(self, date_inn, 0, parameters)
+        if column_inn != 0:
+            self.column = column_inn
+
+    @property
+    def column(self):
+        return _ArrayLayerList(self)
+
+    @column.setter
+    def column(self, column_inn):
+        layers = column_inn if column_inn is not None else []
+
+        self.type_codes = np.array([l.type_code for l in layers], dtype=np.int8)
+        self.heights = np.array([l.height for l in layers], dtype=float)
+        self.densities = np.array([l.density for l in layers], dtype=float)
+        self.conductivities = np.array([l.conductivity for l in layers], dtype=float)
+        self.temperatures = _temperature_array(layers, 'temperature')
+        self.temperatures_top = _temperature_array(layers, 'temperature_top')
+        self.temperatures_bottom = _temperature_array(layers, 'temperature_bottom')
+        self.layer_metadata = [l.metadata for l in layers]
+        self.layers_changed()
+
+    @classmethod
+    def from_ice_column(cls, ice_column):
+        """Makes an array backed copy of an IceColumn.
+
+        :param ice_column:      [IceColumn]
+        :return:                [ArrayIceColumn]
+        """
+
+        array_column = cls(ice_column.date, [], ice_column.parameters)
+        array_column.column = ice_column.column
+        array_column.layer_metadata = [m.copy() for m in array_column.layer_metadata]
+        array_column.water_line = ice_column.water_line
+        array_column.draft_thickness = ice_column.draft_thickness
+        array_column.total_column_height = ice_column.total_column_height
+        array_column.metadata = ice_column.metadata.copy()
+        array_column.top_layer_is_slush = ice_column.top_layer_is_slush
+        array_column.in_slush_event = ice_column.in_slush_event
+        if hasattr(ice_column, 'temp_surface'):
+            array_column.temp_surface = ice_column.temp_surface
+
+        return array_column
+
+    def copy(self):
+        """Returns a snapshot of the ice column where the layer arrays are copied. Layer metadata
+        dictionaries are copied, but metadata values are shared with the original column.
+
+        :return:    [ArrayIceColumn] Copy of the ice column.
+        """
+
+        ice_column = self.__class__.__new__(self.__class__)
+        ice_column.__dict__.update(self.__dict__)
+        for name in self.layer_arrays:
+            setattr(ice_column, name, getattr(self, name).copy())
+        ice_column.layer_metadata = [m.copy() for m in self.layer_metadata]
+        ice_column.metadata = self.metadata.copy()
+
+        return ice_column
+
+    def to_ice_column(self):
+        """Makes a copy of the column as an IceColumn with a list of IceLayer objects.
+
+        :return:                [IceColumn]
+        """
+
+        ice_column = IceColumn(self.date, [self.get_detached_layer(i) for i in range(len(self.heights))],
+                               self.parameters)
+        ice_column.water_line = self.water_line
+        ice_column.draft_thickness = self.draft_thickness
+        ice_column.total_column_height = self.total_column_height
+        ice_column.metadata = self.metadata.copy()
+        ice_column.top_layer_is_slush = self.top_layer_is_slush
+        ice_column.in_slush_event = self.in_slush_event
+        if hasattr(self, 'temp_surface'):
+            ice_column.temp_surface = self.temp_surface
+
+        return ice_column
+
+    def get_detached_layer(self, index):
+        """Returns a copy of the layer at index as an IceLayer which is not connected to the arrays."""
+
+        layer = IceLayer(float(self.heights[index]), layer_types[self.type_codes[index]], self.parameters)
+        layer.density = float(self.densities[index])
+        layer.conductivity = float(self.conductivities[index])
+        view = ArrayIceLayer(self, index)
+        layer.temperature = view.temperature
+        if not np.isnan(self.temperatures_top[index]):
+            layer.temperature_top = view.temperature_top
+        if not np.isnan(self.temperatures_bottom[index]):
+            layer.temperature_bottom = view.temperature_bottom
+        layer.metadata = self.layer_metadata[index].copy()
+
+        return layer
+
+    def insert_layer(self, index, layer):
+        """Inserts the values of an IceLayer in the arrays at a given index. Index is treated as in list.insert."""
+
+        number_of_layers = len(self.heights)
+        if index < 0:
+            index = max(number_of_layers + index, 0)
+        index = min(index, number_of_layers)
+
+        values = [layer.type_code, layer.height, layer.density, layer.conductivity,
+                  layer.temperature, getattr(layer, 'temperature_top', None), getattr(layer, 'temperature_bottom', None)]
+
+        for name, value in zip(self.layer_arrays, values):
+            setattr(self, name, np.insert(getattr(self, name), index, np.nan if value is None else value))
+        self.layer_metadata.insert(index, layer.metadata)
+        self.layers_changed()
+
+    def add_layer_at_index(self, index, layer):
+        """Adds a new layer at a given index in ice column. Subsequent layers are added after the new layer.
+        If layer.height is None nothing is done.
+
+        :param index:           -1 is last index
+        :param layer:
+        :return:                no return
+        """
+
+        if layer.height is not None:
+            if index == -1:
+                index = len(self.heights)
+            self.insert_layer(index, layer)
+
+    def remove_layer_at_index(self, index):
+        """Removes a layer at a given index."""
+
+        for name in self.layer_arrays:
+            setattr(self, name, np.delete(getattr(self, name), index))
+        self.layer_metadata.pop(index)
+        self.layers_changed()
+
+    def calculate_draft_thickness(self):
+        """Returns the draft height given by summing ice, slush ice and slush layers. I.e. not snow layers on
+        top of the column."""
+
+        is_draft = (layer_type_enums[self.type_codes] < 20) & (self.heights != 0.)
+
+        if is_draft.any():
+            return float(np.sum(self.heights[np.argmax(is_draft):]))
+        else:
+            return 0.
+
+    def calculate_total_column_height(self):
+        """Sum  of all layers in column. also snow."""
+
+        return float(np.sum(self.heights))
+
+    def calculate_water_line(self):
+        """Distance from the bottom of the ice to the water line given by Arkimedes law."""
+
+        column_mass = float(np.sum(self.heights * self.densities))  # height*density = [kg/m2]
+        return column_mass / self.parameters.rho_water              # [kg/m2]*[m3/kg]
+
+    def merge_and_remove_excess_layers(self):
+        """Removes layers of zero height and merges neighbouring layers of equal type. Same as
+        IceColumn.merge_and_remove_excess_layers, but done on the arrays. Layers are grouped where the type changes
+        and the height weighted averages are sums over the groups (np.add.reduceat). The averages may differ from
+        the layer by layer merge in the last digits."""
+
+        keep = self.heights != 0.
+        if not keep.all():
+            for name in self.layer_arrays:
+                setattr(self, name, getattr(self, name)[keep])
+            self.layer_metadata = [m for m, k in zip(self.layer_metadata, keep) if k]
+
+        number_of_layers = len(self.heights)
+        if number_of_layers == 0:
+            if not keep.all():
+                self.layers_changed()
+            return
+
+        is_group_start = np.ones(number_of_layers, dtype=bool)
+        is_group_start[1:] = self.type_codes[1:] != self.type_codes[:-1]
+
+        if is_group_start.all():
+            if not keep.all():
+                self.layers_changed()
+            return
+
+        starts = np.flatnonzero(is_group_start)
+        ends = np.append(starts[1:], number_of_layers)
+        heights = self.heights
+        group_heights = np.add.reduceat(heights, starts)
+
+        for name in ('densities', 'conductivities', 'temperatures'):
+            values = getattr(self, name)
+            averages = np.add.reduceat(heights * values, starts) / group_heights
+
+            # Values not given (nan) are not averaged in. Groups with such values are merged layer by layer.
+            for g in np.flatnonzero(np.isnan(averages)):
+                average, height_sum = values[starts[g]], heights[starts[g]]
+                for i in range(starts[g] + 1, ends[g]):
+                    if not np.isnan(average) and not np.isnan(values[i]):
+                        average = (height_sum * average + heights[i] * values[i]) / (height_sum + heights[i])
+                    height_sum += heights[i]
+                averages[g] = average
+
+            setattr(self, name, averages)
+
+        # The upper layer of a group keeps its type and its top and bottom temperatures
+        self.type_codes = self.type_codes[starts]
+        self.temperatures_top = self.temperatures_top[starts]
+        self.temperatures_bottom = self.temperatures_bottom[starts]
+        self.heights = group_heights
+
+        layer_metadata = []
+        for start, end in zip(starts, ends):
+            metadata = self.layer_metadata[start]
+            for i in range(start + 1, end):
+                if self.layer_metadata[i]:
+                    metadata = metadata.copy()
+                    metadata.update(self.layer_metadata[i])
+            layer_metadata.append(metadata)
+        self.layer_metadata = layer_metadata
+
+        self.layers_changed()
+
+    def make_depth_index(self):
+        """Makes the depth index from the layer arrays.
+
+        :return:    [LayerDepthIndex]
+        """
+
+        return LayerDepthIndex(self.heights.tolist(), self.conductivities.tolist(),
+                               layer_type_enums[self.type_codes].tolist(), k_water=self.parameters.k_water)
+
+
 class IceCover:
 
     def __init__(self, date_inn, iceCoverName_inn, iceCoverBeforeName_inn, locationName_inn):
@@ -791,32 +1523,34 @@ class IceCover:
         self.metadata['OriginalObject'] = original_object_inn
 
 
-def add_layer_conductance_to_total(u_total, k, h, layer_enum):
+def add_layer_conductance_to_total(u_total, k, h, layer_enum, parameters=None):
     """Adds a layers conductance to a total conductance.
 
     Conductance is conductivity pr unit length. I.e. U = k/h where k is conductivity and h is height of ice layer
     Sum of conductance follows the rule 1/U = 1/U1 + 1/U2 + ... + 1/Un
 
     Method incorporates Ashtons (1989) method for thin ice growth, declaring that the top part of ice has a lower
-    conductivity.
+    conductivity. The model parameters are the defaults if not given.
     """
 
+    p = mpar.get_parameters(parameters)
+
     if layer_enum == 10:    # Black ice
-        surface_k_reduction = const.surface_k_reduction_black_ice
-        h_min_for_conductivity = const.h_min_for_conductivity_black_ice
+        surface_k_reduction = p.surface_k_reduction_black_ice
+        h_min_for_conductivity = p.h_min_for_conductivity_black_ice
     elif layer_enum == 11:  # slush ice
-        surface_k_reduction = const.surface_k_reduction_slush_ice
-        h_min_for_conductivity = const.h_min_for_conductivity_slush_ice
+        surface_k_reduction = p.surface_k_reduction_slush_ice
+        h_min_for_conductivity = p.h_min_for_conductivity_slush_ice
     elif layer_enum >= 20:  # Snow
-        surface_k_reduction = const.surface_k_reduction_snow
-        h_min_for_conductivity = const.h_min_for_conductivity_snow
+        surface_k_reduction = p.surface_k_reduction_snow
+        h_min_for_conductivity = p.h_min_for_conductivity_snow
     else:   # If enum is unknown (most likely slush or water layer), use black_ice conditions
         ml.log_and_print("[warning] ice.py -> add_layer_conductance_to_total: Unknown layer enum {}".format(layer_enum))
-        surface_k_reduction = const.surface_k_reduction_black_ice
-        h_min_for_conductivity = const.h_min_for_conductivity_black_ice
+        surface_k_reduction = p.surface_k_reduction_black_ice
+        h_min_for_conductivity = p.h_min_for_conductivity_black_ice
 
     # Max conductance always defined by black ice material constants.
-    u_max = const.k_black_ice * const.surface_k_reduction_black_ice / const.h_min_for_conductivity_black_ice
+    u_max = p.k_black_ice * p.surface_k_reduction_black_ice / p.h_min_for_conductivity_black_ice
 
     # No Ice? Set initial conductance to the max possible
     if h == 0 and u_total is None:
@@ -848,6 +1582,138 @@ def add_layer_conductance_to_total(u_total, k, h, layer_enum):
     return u_total
 
 
+def add_layer_conductance_to_total_batch(u_total, k, h, layer_enum, k_black_ice=const.k_black_ice, parameters=None):
+    """Adds layer conductances to total conductances for many ice columns in one go. The same as
+    add_layer_conductance_to_total, but all arguments are arrays with one element pr column and a total
+    conductance not yet given (None) is given as nan.
+
+    :param u_total:     [array] Total conductances. nan if this is the surface layer.
+    :param k:           [array] Layer conductivities.
+    :param h:           [array] Layer heights.
+    :param layer_enum:  [array] Layer enums.
+    :param k_black_ice: [float or array] Conductivity of black ice, which gives the max conductance.
+    :param parameters:  [dict] Optional. h_min_for_conductivity_* and surface_k_reduction_* of black ice, slush ice
+                        and snow as floats or arrays with one element pr column. Default is icemodelling.constants.
+    :return:            [array] The new total conductances.
+    """
+
+    if parameters is None:
+        parameters = vars(const)
+
+    u_total = np.asarray(u_total, dtype=float)
+    k = np.asarray(k, dtype=float)
+    h = np.asarray(h, dtype=float)
+    layer_enum = np.asarray(layer_enum)
+
+    is_snow = layer_enum >= 20
+    is_slush_ice = layer_enum == 11
+    is_unknown = (layer_enum != 10) & ~is_slush_ice & ~is_snow
+    if is_unknown.any():
+        ml.log_and_print("[warning] ice.py -> add_layer_conductance_to_total_batch: Unknown layer enum {}"
+                         .format(np.unique(layer_enum[is_unknown]).tolist()))
+
+    surface_k_reduction = np.where(is_snow, parameters['surface_k_reduction_snow'],
+                                   np.where(is_slush_ice, parameters['surface_k_reduction_slush_ice'],
+                                            parameters['surface_k_reduction_black_ice']))
+    h_min_for_conductivity = np.where(is_snow, parameters['h_min_for_conductivity_snow'],
+                                      np.where(is_slush_ice, parameters['h_min_for_conductivity_slush_ice'],
+                                               parameters['h_min_for_conductivity_black_ice']))
+
+    # Max conductance always defined by black ice material constants.
+    u_max = k_black_ice * parameters['surface_k_reduction_black_ice'] / parameters['h_min_for_conductivity_black_ice']
+
+    is_surface = np.isnan(u_total)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u_surface = np.where(h <= h_min_for_conductivity,
+                             k * surface_k_reduction / h,
+                             1/(1/u_max + (h-h_min_for_conductivity)/k))
+        u_deeper = 1/(1/u_total + h/k)
+
+    u_total = np.where(is_surface, np.where(h == 0, u_max, u_surface), u_deeper)
+
+    # Too large conductance. Decrease to max value
+    return np.where(u_total > u_max, u_max, u_total)
+
+
+def solve_tridiagonal(lower, diagonal, upper, rhs):
+    """Solves the tridiagonal set of equations A * x = rhs with the Thomas algorithm. This is O(n) and for the
+    few layers of an ice column it is faster to do in plain python than with numpy.
+
+    Row i of A is lower[i] * x[i-1] + diagonal[i] * x[i] + upper[i] * x[i+1]. Thus lower[0] and upper[-1] are not
+    used. The algorithm does not pivot, so A should be diagonally dominant, which it is for the heat conduction
+    in an ice column.
+
+    :param lower:       [list of floats] Lower off diagonal.
+    :param diagonal:    [list of floats] Diagonal.
+    :param upper:       [list of floats] Upper off diagonal.
+    :param rhs:         [list of floats] Right hand side.
+    :return:            [list of floats] The solution x.
+    """
+
+    n = len(diagonal)
+    upper_prime = [0.] * n
+    rhs_prime = [0.] * n
+
+    upper_prime[0] = upper[0] / diagonal[0]
+    rhs_prime[0] = rhs[0] / diagonal[0]
+    for i in range(1, n, 1):
+        denominator = diagonal[i] - lower[i] * upper_prime[i-1]
+        upper_prime[i] = upper[i] / denominator
+        rhs_prime[i] = (rhs[i] - lower[i] * rhs_prime[i-1]) / denominator
+
+    x = [0.] * n
+    x[n-1] = rhs_prime[n-1]
+    for i in range(n-2, -1, -1):
+        x[i] = rhs_prime[i] - upper_prime[i] * x[i+1]
+
+    return x
+
+
+def solve_tridiagonal_batch(lower, diagonal, upper, rhs):
+    """Solves many tridiagonal sets of equations in one go with the Thomas algorithm. The loop is over the rows
+    and each step is vectorised over the systems, e.g. ice columns on many lakes or ensemble members.
+
+    Arrays are given with shape [number of systems, n] and are as in solve_tridiagonal. Systems with fewer than n
+    unknowns may be padded with rows with diagonal 1 and lower, upper and rhs 0.
+
+    :param lower:       [2D array] Lower off diagonals.
+    :param diagonal:    [2D array] Diagonals.
+    :param upper:       [2D array] Upper off diagonals.
+    :param rhs:         [2D array] Right hand sides.
+    :return:            [2D array] The solutions x.
+    """
+
+    lower = np.asarray(lower, dtype=float)
+    diagonal = np.asarray(diagonal, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    rhs = np.asarray(rhs, dtype=float)
+
+    n = diagonal.shape[-1]
+    upper_prime = np.zeros_like(diagonal)
+    rhs_prime = np.zeros_like(diagonal)
+
+    upper_prime[..., 0] = upper[..., 0] / diagonal[..., 0]
+    rhs_prime[..., 0] = rhs[..., 0] / diagonal[..., 0]
+    for i in range(1, n, 1):
+        denominator = diagonal[..., i] - lower[..., i] * upper_prime[..., i-1]
+        upper_prime[..., i] = upper[..., i] / denominator
+        rhs_prime[..., i] = (rhs[..., i] - lower[..., i] * rhs_prime[..., i-1]) / denominator
+
+    x = np.zeros_like(diagonal)
+    x[..., n-1] = rhs_prime[..., n-1]
+    for i in range(n-2, -1, -1):
+        x[..., i] = rhs_prime[..., i] - upper_prime[..., i] * x[..., i+1]
+
+    return x
+
+
+def _temperature_array(layers, attribute):
+    """Array of layer temperatures where temperatures not given are set to nan."""
+
+    temperatures = [getattr(l, attribute, None) for l in layers]
+    return np.array([np.nan if t is None else t for t in temperatures], dtype=float)
+
+
 if __name__ == "__main__":
 
     from setenvironment import time_series_data
@@ -0,0 +1,1124 @@
+# -*- coding: utf-8 -*-
+"""Modelling of the ice cover on many lakes at the same time. The ice columns of all lakes are stored in padded
+arrays with one row pr lake and one column pr layer and all lakes are stepped forward together with NumPy. The
+model is the same as in icethickness.get_ice_thickness_from_surface_temp. Where the model branches (freezing,
+slush freezing, melting, slush events and snow compaction) the lakes are selected by masks."""
+
+import datetime as dt
+import numpy as np
+from icemodelling import parameterization as dp, constants as const
+from icemodelling import ice as ice
+from icemodelling import icetrajectory as itr
+from icemodelling import modelparameters as mpar
+from experimental import energybalancebatch as debb
+from utilities import makelogs as ml
+
+__author__ = 'raek'
+
+
+_new_snow = ice.layer_type_codes['new_snow']
+_snow = ice.layer_type_codes['snow']
+_slush = ice.layer_type_codes['slush']
+_slush_ice = ice.layer_type_codes['slush_ice']
+_black_ice = ice.layer_type_codes['black_ice']
+_water = ice.layer_type_codes['water']
+
+# Layer types with a degree day melting coefficient. Other layer types use the slush ice coefficient.
+_has_melting_coefficient = np.array([True, True, True, True, True, True, False, False, False])
+
+# Model parameters that may differ between the lakes in a batch, e.g. for the members of a parameter ensemble.
+# Other model parameters (the physical constants) are as in icemodelling.constants on all lakes.
+parameter_names = ['meltingcoeff_snow', 'meltingcoeff_slush', 'meltingcoeff_slush_ice', 'meltingcoeff_black_ice',
+                   'k_new_snow', 'k_snow', 'k_drained_snow', 'k_slush', 'k_slush_ice', 'k_black_ice', 'k_water',
+                   'k_snow_max', 'rho_new_snow', 'rho_snow', 'rho_drained_snow', 'rho_slush', 'rho_slush_ice',
+                   'rho_black_ice', 'rho_water', 'rho_snow_max', 'min_slush_change', 'snow_pull_on_water',
+                   'part_ice_in_slush', 'temp_f', 'temp_rain_snow',
+                   'h_min_for_conductivity_black_ice', 'surface_k_reduction_black_ice',
+                   'h_min_for_conductivity_slush_ice', 'surface_k_reduction_slush_ice',
+                   'h_min_for_conductivity_snow', 'surface_k_reduction_snow',
+                   'alfa_black_ice', 'alfa_slush_ice', 'alfa_max', 'alfa_bare_ground', 'eps_snow', 'eps_ice']
+
+# Parameters of the surface conductance. See ice.add_layer_conductance_to_total_batch.
+_conductance_parameter_names = ['h_min_for_conductivity_black_ice', 'surface_k_reduction_black_ice',
+                                'h_min_for_conductivity_slush_ice', 'surface_k_reduction_slush_ice',
+                                'h_min_for_conductivity_snow', 'surface_k_reduction_snow']
+
+
+class IceColumnBatch:
+    """Ice columns on many lakes stored as padded arrays of shape [lakes, layers]. Lake l has
+    number_of_layers[l] layers and the values after these are not used. The arrays are made wider when needed.
+
+    Layer types are stored as type codes, see ice.layer_types, and values not given (None) are stored as nan.
+    Metadata on columns and layers is not kept.
+
+    The model parameters of each lake are in parameter_sets. The values in parameter_names are given pr lake in the
+    dictionary parameters. Layer densities, conductivities and melting coefficients pr lake and type code are in
+    arrays of shape [lakes, types].
+    """
+
+    # Names of the arrays holding the layer properties.
+    layer_arrays = ['type_codes', 'heights', 'densities', 'conductivities',
+                    'temperatures', 'temperatures_top', 'temperatures_bottom']
+
+    def __init__(self, ice_columns, parameter_sets=None):
+        """
+        :param ice_columns:     [list of IceColumn] One pr lake.
+        :param parameter_sets:  [list of ModelParameters or dict] Optional. Model parameters pr lake, see
+                                get_parameter_sets. If None, the parameters of each ice column are used. The layers
+                                of the given ice columns are kept as they are.
+        """
+
+        number_of_lakes = len(ice_columns)
+        width = max([len(c.column) for c in ice_columns] + [1])
+
+        self.number_of_layers = np.array([len(c.column) for c in ice_columns], dtype=int)
+        self.type_codes = np.zeros((number_of_lakes, width), dtype=np.int8)
+        self.heights = np.zeros((number_of_lakes, width))
+        self.densities = np.full((number_of_lakes, width), np.nan)
+        self.conductivities = np.full((number_of_lakes, width), np.nan)
+        self.temperatures = np.full((number_of_lakes, width), np.nan)
+        self.temperatures_top = np.full((number_of_lakes, width), np.nan)
+        self.temperatures_bottom = np.full((number_of_lakes, width), np.nan)
+
+        for l, ice_column in enumerate(ice_columns):
+            for i, layer in enumerate(ice_column.column):
+                self.type_codes[l, i] = layer.type_code
+                self.heights[l, i] = layer.height
+                self.densities[l, i] = _nan_if_none(layer.density)
+                self.conductivities[l, i] = _nan_if_none(layer.conductivity)
+                self.temperatures[l, i] = _nan_if_none(layer.temperature)
+                self.temperatures_top[l, i] = _nan_if_none(getattr(layer, 'temperature_top', None))
+                self.temperatures_bottom[l, i] = _nan_if_none(getattr(layer, 'temperature_bottom', None))
+
+        self.dates = np.array([c.date for c in ice_columns], dtype='datetime64[us]')
+        self.water_lines = np.array([_nan_if_none(c.water_line) for c in ice_columns], dtype=float)
+        self.draft_thicknesses = np.array([_nan_if_none(c.draft_thickness) for c in ice_columns], dtype=float)
+        self.total_column_heights = np.array([_nan_if_none(c.total_column_height) for c in ice_columns], dtype=float)
+        self.temp_surfaces = np.array([_nan_if_none(getattr(c, 'temp_surface', None)) for c in ice_columns],
+                                      dtype=float)
+        self.top_layer_is_slush = [c.top_layer_is_slush for c in ice_columns]
+        self.in_slush_event = np.array([bool(c.in_slush_event) for c in ice_columns], dtype=bool)
+
+        if parameter_sets is None:
+            parameter_sets = [c.parameters for c in ice_columns]
+        self.parameter_sets = get_parameter_sets(parameter_sets, number_of_lakes)
+        self.parameters = {name: np.array([getattr(s, name) for s in self.parameter_sets], dtype=float).reshape(number_of_lakes)
+                           for name in parameter_names}
+
+        sets = self.parameter_sets
+        self.layer_densities = np.array([[_nan_if_none(v) for v in s.layer_densities] for s in sets], dtype=float).reshape(number_of_lakes, len(ice.layer_types))
+        self.layer_conductivities = np.array([[_nan_if_none(v) for v in s.layer_conductivities] for s in sets], dtype=float).reshape(number_of_lakes, len(ice.layer_types))
+        self.melting_coefficients = np.array(
+            [[s.meltingcoeff_snow, s.meltingcoeff_snow, s.meltingcoeff_snow, s.meltingcoeff_slush, s.meltingcoeff_slush_ice,
+              s.meltingcoeff_black_ice, np.nan, s.meltingcoeff_slush_ice, s.meltingcoeff_slush_ice] for s in sets],
+            dtype=float).reshape(number_of_lakes, len(ice.layer_types))
+
+    def __len__(self):
+        return len(self.number_of_layers)
+
+    def copy(self):
+        """Returns a copy of the batch where all arrays are copied.
+
+        :return:    [IceColumnBatch]
+        """
+
+        batch = self.__class__.__new__(self.__class__)
+        batch.__dict__.update(self.__dict__)
+        for name, value in self.__dict__.items():
+            if isinstance(value, np.ndarray):
+                setattr(batch, name, value.copy())
+        batch.top_layer_is_slush = list(self.top_layer_is_slush)
+
+        return batch
+
+    def get_ice_column(self, lake):
+        """Makes an IceColumn of the present state on one lake.
+
+        :param lake:    [int] Index of the lake in the batch.
+        :return:        [IceColumn]
+        """
+
+        layers = []
+        for i in range(self.number_of_layers[lake]):
+            layer = ice.IceLayer(float(self.heights[lake, i]), ice.layer_types[self.type_codes[lake, i]])
+            layer.density = _none_if_nan(self.densities[lake, i])
+            layer.conductivity = _none_if_nan(self.conductivities[lake, i])
+            layer.temperature = _none_if_nan(self.temperatures[lake, i])
+            if not np.isnan(self.temperatures_top[lake, i]):
+                layer.temperature_top = float(self.temperatures_top[lake, i])
+            if not np.isnan(self.temperatures_bottom[lake, i]):
+                layer.temperature_bottom = float(self.temperatures_bottom[lake, i])
+            layers.append(layer)
+
+        ice_column = ice.IceColumn(self.dates[lake].item(), layers, self.parameter_sets[lake])
+        ice_column.remove_metadata()
+        ice_column.water_line = _none_if_nan(self.water_lines[lake])
+        ice_column.draft_thickness = _none_if_nan(self.draft_thicknesses[lake])
+        ice_column.total_column_height = _none_if_nan(self.total_column_heights[lake])
+        ice_column.top_layer_is_slush = self.top_layer_is_slush[lake]
+        ice_column.in_slush_event = bool(self.in_slush_event[lake])
+        if not np.isnan(self.temp_surfaces[lake]):
+            ice_column.temp_surface = float(self.temp_surfaces[lake])
+
+        return ice_column
+
+    def to_ice_columns(self):
+        """Makes IceColumns of the present state on all lakes.
+
+        :return:    [list of IceColumn]
+        """
+
+        return [self.get_ice_column(l) for l in range(len(self))]
+
+    def get_state(self):
+        """Copy of the arrays needed to make an IceTrajectory. Used to keep the state after each time step.
+
+        :return:    [dict of arrays]
+        """
+
+        return {'dates': self.dates.copy(),
+                'number_of_layers': self.number_of_layers.copy(),
+                'type_codes': self.type_codes.copy(),
+                'heights': self.heights.copy(),
+                'densities': self.densities.copy(),
+                'conductivities': self.conductivities.copy(),
+                'temperatures': self.temperatures.copy(),
+                'water_lines': self.water_lines.copy(),
+                'draft_thicknesses': self.draft_thicknesses.copy(),
+                'total_column_heights': self.total_column_heights.copy(),
+                'temp_surfaces': self.temp_surfaces.copy(),
+                'in_slush_event': self.in_slush_event.copy()}
+
+    def step(self, time_step, dh_snow, temp, active=None, melt_energy=None):
+        """Steps all active lakes one time step forward. This is get_ice_thickness_from_surface_temp done on
+        all lakes at once.
+
+        :param time_step:   In seconds. 60*60*24 = 86400 is 24hrs
+        :param dh_snow:     [array] New snow in period of time step on each lake. [m]
+        :param temp:        [array] Average surface temperature in period of time step on each lake. [C]
+        :param active:      [array of bool] Lakes to step forward. If None, all lakes are stepped.
+        :param melt_energy: [array] Optional. Energy from the energy balance available for melting on each lake,
+                            nan where not given. Used where the surface temperature is 0C. [kJ/m2/day]
+        """
+
+        number_of_lakes = len(self)
+        dh_snow = np.broadcast_to(np.asarray(dh_snow, dtype=float), (number_of_lakes,))
+        temp = np.broadcast_to(np.asarray(temp, dtype=float), (number_of_lakes,))
+        if active is None:
+            active = np.ones(number_of_lakes, dtype=bool)
+
+        # step the date forward one time step
+        self.dates[active] += np.timedelta64(dt.timedelta(seconds=time_step))
+
+        # Open water above freezing stays open. Only the surface temperature changes.
+        temp_f = self.parameters['temp_f']
+        ice_free = active & (self.number_of_layers == 0) & (temp >= temp_f)
+        if ice_free.any():
+            self.draft_thicknesses[ice_free] = 0.
+            self.water_lines[ice_free] = 0.
+            self.total_column_heights[ice_free] = 0.
+            self.temp_surfaces[ice_free] = temp[ice_free]
+            active = active & ~ice_free
+            if not active.any():
+                return
+
+        # Add new snow on top of the column if we have ice and snow and update the slush level given new snow
+        has_ice = active & (self.number_of_layers > 0)
+        new_snow = np.flatnonzero(has_ice & (dh_snow != 0.))
+        self.insert_layers(new_snow, np.zeros(len(new_snow), dtype=int), _new_snow, dh_snow[new_snow])
+        self.update_slush_level(has_ice)
+
+        is_freezing = active & (temp < temp_f)
+        is_melting = active & ~is_freezing & (temp > 0.)
+        self.freeze(time_step, temp, is_freezing)
+        self.melt(time_step, temp, is_melting)
+
+        # In case surface temp is calculated from energy balance, the melting at 0C is given by the melt energy
+        if melt_energy is not None:
+            melt_energy = np.broadcast_to(np.asarray(melt_energy, dtype=float), (number_of_lakes,))
+            is_melting_energy = active & ~is_freezing & ~is_melting & ~np.isnan(melt_energy)
+            self.melt_with_energy(time_step, melt_energy, is_melting_energy)
+            is_melting = is_melting | is_melting_energy
+
+        if (active & ~is_freezing & ~is_melting).any():
+            ml.log_and_print("[info] icebatch.py -> IceColumnBatch.step: Need either energy or positive temperatures "
+                             "in model to melt snow and ice.")
+
+        self.merge_and_remove_excess_layers(active)
+        self.merge_snow_layers_and_compress(temp, active, time_step)
+        self.draft_thicknesses[active] = self.calculate_draft_thicknesses()[active]
+        self.water_lines[active] = self.calculate_water_lines()[active]
+        self.update_column_temperatures(temp, active)
+        self.total_column_heights[active] = self.calculate_total_column_heights()[active]
+        self.temp_surfaces[active] = temp[active]
+
+    def freeze(self, time_step, temp, is_freezing):
+        """Freezing on lakes where surface temperature is below freezing. Water freezes to black ice under the
+        column and slush layers freeze to slush ice from the top down.
+
+        :param time_step:   In seconds.
+        :param temp:        [array] Surface temperature on each lake.
+        :param is_freezing: [array of bool] Lakes where it is freezing.
+        """
+
+        p = self.parameters
+        rho_water, part_ice_in_slush, k_black_ice = p['rho_water'], p['part_ice_in_slush'], p['k_black_ice']
+        conductance_parameters = {name: p[name] for name in _conductance_parameter_names}
+
+        # Time left in the time step and total conductance (nan if not yet given) of the layers above the present
+        time_left = np.where(is_freezing & (self.number_of_layers > 0), float(time_step), 0.)
+        u_totals = np.full(len(self), np.nan)
+
+        # Conductance on open water and on slush at the surface is the max conductance given by black ice.
+        # See ice.add_layer_conductance_to_total.
+        u_max = k_black_ice * p['surface_k_reduction_black_ice'] / p['h_min_for_conductivity_black_ice']
+
+        # If no ice, freeze water to ice. The heat flux equation gives how much water will freeze.
+        no_ice = np.flatnonzero(is_freezing & (self.number_of_layers == 0))
+        if len(no_ice) > 0:
+            dh = - temp[no_ice] * u_max[no_ice] * time_step / rho_water[no_ice] / const.L_fusion
+            self.insert_layers(no_ice, np.zeros(len(no_ice), dtype=int), _black_ice, dh)
+
+        slush_expansion = (1 - part_ice_in_slush) * ((rho_water - p['rho_slush_ice']) / p['rho_slush_ice'])
+
+        i = 0
+        todo = np.flatnonzero((time_left > 0) & (i < self.number_of_layers))
+        while len(todo) > 0:
+            enums = ice.layer_type_enums[self.type_codes[todo, i]]
+
+            # Solid layers only add to the total isolation. Unless it is the last and water is frozen to ice.
+            solid = todo[enums > 9]
+            u_totals[solid] = ice.add_layer_conductance_to_total_batch(
+                u_totals[solid], self.conductivities[solid, i], self.heights[solid, i], enums[enums > 9],
+                k_black_ice=k_black_ice[solid], parameters={n: v[solid] for n, v in conductance_parameters.items()})
+
+            bottom = solid[i == self.number_of_layers[solid] - 1]
+            dh = - temp[bottom] * u_totals[bottom] * time_left[bottom] / rho_water[bottom] / const.L_fusion
+            time_left[bottom] = 0
+            self.insert_layers(bottom, np.full(len(bottom), i+1), _black_ice, dh)
+
+            # Slush layers freeze fully or partially. We do not freeze slush in the same time step it occurs.
+            slush = todo[enums <= 9]
+            is_slush_event = self.in_slush_event[slush]
+            slush_event, slush = slush[is_slush_event], slush[~is_slush_event]
+            self.in_slush_event[slush_event] = False
+            time_left[slush_event] = 0
+
+            # If the total conductance is not given, this is the top layer and a surface conductance is used.
+            u_totals[slush] = np.where(np.isnan(u_totals[slush]), u_max[slush], u_totals[slush])
+
+            # Only the water part in the slush freezes
+            dh = - temp[slush] * u_totals[slush] * time_left[slush] / rho_water[slush] / const.L_fusion / (1 - part_ice_in_slush[slush])
+            is_frozen = self.heights[slush, i] < dh
+
+            # Layers that freeze totally. The rest of the time is used to freeze a layer further down.
+            frozen = slush[is_frozen]
+            height = self.heights[frozen, i]
+            self.set_layer_types(frozen, i, _slush_ice)
+            time_step_used = height * rho_water[frozen] * const.L_fusion * (1 - part_ice_in_slush[frozen]) / -temp[frozen] / u_totals[frozen]
+            time_left[frozen] = time_left[frozen] - time_step_used
+            self.heights[frozen, i] = height + height * slush_expansion[frozen]
+            u_totals[frozen] = ice.add_layer_conductance_to_total_batch(
+                u_totals[frozen], self.conductivities[frozen, i], self.heights[frozen, i], ice.layer_enums[_slush_ice],
+                k_black_ice=k_black_ice[frozen], parameters={n: v[frozen] for n, v in conductance_parameters.items()})
+
+            # Layers that freeze partially. dh freezes to slush ice on top of the remaining slush.
+            part_frozen = slush[~is_frozen]
+            dh = dh[~is_frozen]
+            self.heights[part_frozen, i] -= dh
+            time_left[part_frozen] = 0
+            self.insert_layers(part_frozen, np.full(len(part_frozen), i), _slush_ice, dh + dh * slush_expansion[part_frozen])
+
+            i += 1
+            todo = np.flatnonzero((time_left > 0) & (i < self.number_of_layers))
+
+    def melt(self, time_step, temp, is_melting):
+        """Degree day melting from the top on lakes where the temperature is above freezing. Layers melted away are
+        removed and the rest of the time step melts the layer below.
+
+        :param time_step:   In seconds.
+        :param temp:        [array] Temperature on each lake.
+        :param is_melting:  [array of bool] Lakes where it is melting.
+        """
+
+        time_left = np.where(is_melting, float(time_step), 0.)
+
+        todo = np.flatnonzero((time_left > 0) & (self.number_of_layers > 0))
+        while len(todo) > 0:
+            top_types = self.type_codes[todo, 0]
+            is_water = top_types == _water
+            lakes = todo[~is_water]
+            top_types = top_types[~is_water]
+
+            unknown_types = top_types[~_has_melting_coefficient[top_types]]
+            for type_code in np.unique(unknown_types):
+                ml.log_and_print("[info] icebatch.py -> IceColumnBatch.melt: Melting on unknown layer type: {0}. "
+                                 "Using slush_ice coeff.".format(ice.layer_types[type_code]))
+
+            # degree day melting. The time factor is separated from the melting coefficient.
+            dh = self.melting_coefficients[lakes, top_types] * time_left[lakes] * (temp[lakes] - self.parameters['temp_f'][lakes])
+            height = self.heights[lakes, 0]
+            is_melted = height < -dh
+
+            melted = lakes[is_melted]
+            time_step_used = height[is_melted] / -dh[is_melted] * time_left[melted]
+            time_left[melted] = time_left[melted] - time_step_used
+
+            part_melted = lakes[~is_melted]
+            self.heights[part_melted, 0] = height[~is_melted] + dh[~is_melted]
+            time_left[part_melted] = 0
+
+            self.remove_top_layers(np.concatenate((todo[is_water], melted)))
+            todo = np.flatnonzero((time_left > 0) & (self.number_of_layers > 0))
+
+    def melt_with_energy(self, time_step, melt_energy, is_melting):
+        """Melting from the top by the energy available from the energy balance on lakes where the surface
+        temperature is 0C. Layers melted away are removed and the rest of the time step melts the layer below.
+
+        :param time_step:   In seconds.
+        :param melt_energy: [array] Energy available for melting on each lake. [kJ/m2/day]
+        :param is_melting:  [array of bool] Lakes where it is melting.
+        """
+
+        # energy available to melt used with latent heat of fusion (delta_h = Q/L/rho)
+        L_ice = const.L_fusion/1000.    # Joule to Kilo Joule
+        time_left = np.where(is_melting, float(time_step), 0.)
+
+        todo = np.flatnonzero((time_left > 0) & (self.number_of_layers > 0))
+        while len(todo) > 0:
+            is_water = self.type_codes[todo, 0] == _water
+            lakes = todo[~is_water]
+
+            dh = melt_energy[lakes] / L_ice / self.densities[lakes, 0] * time_left[lakes]/24/60/60
+            height = self.heights[lakes, 0]
+            is_melted = height < -dh
+
+            melted = lakes[is_melted]
+            time_step_used = height[is_melted] / -dh[is_melted] * time_left[melted]
+            time_left[melted] = time_left[melted] - time_step_used
+
+            part_melted = lakes[~is_melted]
+            self.heights[part_melted, 0] = height[~is_melted] + dh[~is_melted]
+            time_left[part_melted] = 0
+
+            self.remove_top_layers(np.concatenate((todo[is_water], melted)))
+            todo = np.flatnonzero((time_left > 0) & (self.number_of_layers > 0))
+
+    def update_slush_level(self, lakes_mask):
+        """Updates slush level by balancing buoyancy of ice layers with weight of snow. See
+        IceColumn.update_slush_level.
+
+        :param lakes_mask:  [array of bool] Lakes to update.
+        """
+
+        draft_thicknesses = self.calculate_draft_thicknesses()
+        water_lines = self.calculate_water_lines()
+
+        # We get more slush if pressure from snow is great enough to push all ice below the water.
+        dh_slush = water_lines - draft_thicknesses
+        is_slush_event = lakes_mask & (dh_slush > self.parameters['min_slush_change'])
+        self.in_slush_event[is_slush_event] = True
+
+        # Capillary forces pull water up past the equlibrium line
+        dh_slush = dh_slush + self.parameters['snow_pull_on_water']
+
+        # Index of deepest snow layer. Slush forms at the bottom of this layer.
+        is_snow = (ice.layer_type_enums[self.type_codes] >= 20) & self._is_layer()
+        index = np.where(is_snow.any(axis=1), is_snow.shape[1] - 1 - np.argmax(is_snow[:, ::-1], axis=1), 0)
+
+        todo = np.flatnonzero(is_slush_event & (dh_slush > 0) & (index >= 0))
+        while len(todo) > 0:
+            layer_index = index[todo]
+            height = self.heights[todo, layer_index]
+            snow_to_slush_ratio = self.densities[todo, layer_index] / (
+                self.parameters['rho_slush_ice'][todo] * self.parameters['part_ice_in_slush'][todo])
+            is_flooded = dh_slush[todo] > height * snow_to_slush_ratio
+
+            # Layers too shallow are flooded with water and made to slush.
+            flooded, flooded_index = todo[is_flooded], layer_index[is_flooded]
+            self.set_layer_types(flooded, flooded_index, _slush)
+            self.heights[flooded, flooded_index] = height[is_flooded] * snow_to_slush_ratio[is_flooded]
+            dh_slush[flooded] = dh_slush[flooded] - self.heights[flooded, flooded_index]
+            index[flooded] -= 1
+
+            # Else take a part of the layer and make a new slush layer under it.
+            part, part_index = todo[~is_flooded], layer_index[~is_flooded]
+            self.heights[part, part_index] = height[~is_flooded] - dh_slush[part] / snow_to_slush_ratio[~is_flooded]
+            self.insert_layers(part, part_index + 1, _slush, dh_slush[part])
+            index[part] = -1
+
+            todo = np.flatnonzero(is_slush_event & (dh_slush > 0) & (index >= 0))
+
+        # Remove layers of height = 0 and merge neighbouring layers of equal type
+        self.merge_and_remove_excess_layers(lakes_mask)
+        self.water_lines[lakes_mask] = self.calculate_water_lines()[lakes_mask]
+
+    def merge_and_remove_excess_layers(self, lakes_mask):
+        """Removes layers of zero height and merges neighbouring layers of equal type. Layers are merged as in
+        IceColumn.merge_and_remove_excess_layers, one layer index at a time for all lakes.
+
+        :param lakes_mask:  [array of bool] Lakes to clean up.
+        """
+
+        # Only lakes with layers of zero height or neighbouring layers of equal type are changed
+        is_layer = self._is_layer()
+        has_zero_height = (is_layer & (self.heights == 0.)).any(axis=1)
+        has_equal_types = (is_layer[:, 1:] & (self.type_codes[:, 1:] == self.type_codes[:, :-1])).any(axis=1)
+
+        lakes = np.flatnonzero(lakes_mask & (has_zero_height | has_equal_types))
+        if len(lakes) == 0:
+            return
+
+        number_of_layers = self.number_of_layers[lakes]
+        values = {name: getattr(self, name)[lakes] for name in self.layer_arrays}
+        merged = {name: v.copy() for name, v in values.items()}
+        merged_count = np.zeros(len(lakes), dtype=int)
+        rows = np.arange(len(lakes))
+
+        for i in range(number_of_layers.max()):
+            is_layer = (i < number_of_layers) & (values['heights'][:, i] != 0.)
+            last = np.maximum(merged_count - 1, 0)
+            is_merged = is_layer & (merged_count > 0) & (merged['type_codes'][rows, last] == values['type_codes'][:, i])
+
+            # Neighbouring layers of equal type are merged into the upper layer with height weighted averages
+            m, lm = rows[is_merged], last[is_merged]
+            height_last, height = merged['heights'][m, lm], values['heights'][m, i]
+            height_sum = height_last + height
+            for name in ('temperatures', 'densities', 'conductivities'):
+                value_last, value = merged[name][m, lm], values[name][m, i]
+                is_given = ~np.isnan(value_last) & ~np.isnan(value)
+                merged[name][m, lm] = np.where(is_given, (height_last * value_last + height * value) / height_sum, value_last)
+            merged['heights'][m, lm] = height_sum
+
+            # Other layers are kept
+            k = rows[is_layer & ~is_merged]
+            for name in self.layer_arrays:
+                merged[name][k, merged_count[k]] = values[name][k, i]
+            merged_count[k] += 1
+
+        for name in self.layer_arrays:
+            getattr(self, name)[lakes] = merged[name]
+        self.number_of_layers[lakes] = merged_count
+
+    def merge_snow_layers_and_compress(self, temp_atm, lakes_mask, time_step=60*60*24):
+        """Merges the snow layers and compresses the snow on top. See IceColumn.merge_snow_layers_and_compress.
+
+        :param temp_atm:    [array] Temperature in Celsius used in the compaction routine.
+        :param lakes_mask:  [array of bool] Lakes to update.
+        :param time_step:   [int] Length of the time step in seconds. The compaction formula is for 24hrs.
+        """
+
+        lakes_mask = lakes_mask & (self.number_of_layers > 0)
+
+        # declare the new snow layer (index = 0) as normal snow layer
+        self.type_codes[lakes_mask & (self.type_codes[:, 0] == _new_snow), 0] = _snow
+        self.merge_and_remove_excess_layers(lakes_mask)
+
+        lakes = np.flatnonzero(lakes_mask & (self.number_of_layers > 0) & (self.type_codes[:, 0] == _snow))
+        if len(lakes) == 0:
+            return
+
+        temp_atm = temp_atm[lakes]
+        rho_snow_max = self.parameters['rho_snow_max'][lakes]
+        k_snow_max = self.parameters['k_snow_max'][lakes]
+        height = self.heights[lakes, 0]
+        rho_snow_old = self.densities[lakes, 0]
+
+        # ice & snow parameter values
+        C1 = 7.0 * 1e-3 * 12  # snow compaction coefficient #1
+        C2 = -21.0 * 1e-3  # snow compaction coefficient #2
+        C3 = -0.04  # snow compaction coefficient #3
+
+        # compaction below freezing, else snow conductivity and density is set to max
+        is_freezing = temp_atm < self.parameters['temp_f'][lakes]
+        delta_rho_snow = rho_snow_old ** 2 * C1 * height * np.exp(C2 * rho_snow_old) * np.exp(C3 * temp_atm)
+        delta_rho_snow *= time_step / (60*60*24)
+        rho_snow_new = np.where(is_freezing, rho_snow_old + delta_rho_snow, rho_snow_max)
+        k_snow_new = np.where(is_freezing, [dp.k_snow_from_rho_snow(rho) for rho in rho_snow_new], k_snow_max)
+
+        density = np.minimum(rho_snow_new, rho_snow_max)
+        self.densities[lakes, 0] = density
+        self.conductivities[lakes, 0] = np.minimum(k_snow_new, k_snow_max)
+
+        # Assume a inverse linear correlation between density and the height
+        self.heights[lakes, 0] = height / density * rho_snow_old
+
+    def update_column_temperatures(self, temp_sfc, lakes_mask):
+        """Column temperatures in steady state with the surface temperature on top and 0C at the bottom. See
+        IceColumn.update_column_temperatures. The tridiagonal systems of all lakes are solved together.
+
+        :param temp_sfc:    [array] Surface temperature on each lake.
+        :param lakes_mask:  [array of bool] Lakes to update.
+        """
+
+        lakes = np.flatnonzero(lakes_mask & (self.number_of_layers > 0))
+        if len(lakes) == 0:
+            return
+
+        is_layer = self._is_layer()[lakes]
+        temperatures, temperatures_top, temperatures_bottom = self.get_column_temperatures(temp_sfc[lakes], lakes)
+
+        self.temperatures[lakes] = np.where(is_layer, temperatures, self.temperatures[lakes])
+        self.temperatures_top[lakes] = np.where(is_layer, temperatures_top, self.temperatures_top[lakes])
+        self.temperatures_bottom[lakes] = np.where(is_layer, temperatures_bottom, self.temperatures_bottom[lakes])
+
+    def get_column_temperatures(self, temp_top, lakes):
+        """The layer temperatures update_column_temperatures would give, without changing the layers.
+
+        :param temp_top:    [array] Surface temperature on each of the lakes.
+        :param lakes:       [array of int] Lakes with ice.
+        :return:            [2D arrays] temperatures, temperatures_top and temperatures_bottom of shape
+                            [lakes, layers]. Wet layers are 0C. Values after the layers of a lake are not used.
+        """
+
+        width = self.heights.shape[1]
+        rows = np.arange(len(lakes))
+        is_layer = self._is_layer()[lakes]
+
+        # only continuous dry layers from surface can be below freezing (0C)
+        is_dry = (ice.layer_type_enums[self.type_codes[lakes]] > 9) & is_layer
+        num_dry_layers = np.cumprod(is_dry, axis=1).sum(axis=1)
+        num_boundaries = num_dry_layers - 1
+        temp_bottom = self.parameters['temp_f'][lakes]
+
+        boundary_temps = np.zeros((len(lakes), width + 1))
+        boundary_temps[:, 0] = temp_top
+
+        # case more dry layers, solve numerically
+        size = num_boundaries.max()
+        if size > 0:
+            kh = self.conductivities[lakes] * self.heights[lakes]
+            j = np.arange(size)
+            in_system = j < num_boundaries[:, None]
+
+            # systems with fewer boundaries are padded with rows with diagonal 1
+            diagonal = np.where(in_system, kh[:, :size] + kh[:, 1:size+1], 1.)
+            lower = np.where(in_system, -kh[:, :size], 0.)
+            upper = np.where(j < num_boundaries[:, None] - 1, -kh[:, 1:size+1], 0.)
+
+            bb = np.zeros((len(lakes), size))
+            bb[:, 0] = np.where(num_boundaries > 0, temp_top * kh[:, 0], 0.)
+            several = rows[num_boundaries > 1]
+            bb[several, num_boundaries[several]-1] = temp_bottom[several] * kh[several, num_boundaries[several]]
+
+            xx = ice.solve_tridiagonal_batch(lower, diagonal, upper, bb)
+            boundary_temps[:, 1:size+1] = np.where(in_system, xx, 0.)
+
+        has_dry = rows[num_dry_layers > 0]
+        boundary_temps[has_dry, num_dry_layers[has_dry]] = temp_bottom[has_dry]
+
+        # layer temp is average of the boundary temps. Wet layers are 0C.
+        is_dry_layer = np.arange(width) < num_dry_layers[:, None]
+        temperatures_top = np.where(is_dry_layer, boundary_temps[:, :-1], 0.)
+        temperatures_bottom = np.where(is_dry_layer, boundary_temps[:, 1:], 0.)
+        temperatures = np.where(is_dry_layer, (boundary_temps[:, :-1] + boundary_temps[:, 1:]) / 2, 0.)
+
+        return temperatures, temperatures_top, temperatures_bottom
+
+    def calculate_draft_thicknesses(self):
+        """Draft thickness on all lakes. Snow on top of the column is not counted.
+
+        :return:    [array]
+        """
+
+        enums = ice.layer_type_enums[self.type_codes]
+        draft_thicknesses = np.zeros(len(self))
+        for i in range(self.number_of_layers.max(initial=0)):
+            is_counted = (i < self.number_of_layers) & ~((draft_thicknesses == 0) & (enums[:, i] >= 20))
+            draft_thicknesses = np.where(is_counted, draft_thicknesses + self.heights[:, i], draft_thicknesses)
+
+        return draft_thicknesses
+
+    def calculate_water_lines(self):
+        """Distance from the bottom of the ice to the water line given by Arkimedes law on all lakes.
+
+        :return:    [array]
+        """
+
+        column_masses = np.zeros(len(self))
+        for i in range(self.number_of_layers.max(initial=0)):
+            is_layer = i < self.number_of_layers
+            column_masses = np.where(is_layer, column_masses + self.heights[:, i] * self.densities[:, i], column_masses)
+
+        return column_masses / self.parameters['rho_water']
+
+    def calculate_total_column_heights(self):
+        """Sum of all layers in the column, also snow, on all lakes.
+
+        :return:    [array]
+        """
+
+        total_heights = np.zeros(len(self))
+        for i in range(self.number_of_layers.max(initial=0)):
+            total_heights = np.where(i < self.number_of_layers, total_heights + self.heights[:, i], total_heights)
+
+        return total_heights
+
+    def set_layer_types(self, lakes, index, type_code):
+        """Sets the type of a layer and the density and conductivity of the type. As IceLayer.set_type.
+
+        :param lakes:       [array of int] Lakes to change.
+        :param index:       [int or array of int] Index of the layer in each lake.
+        :param type_code:   [int] Type code of the new type.
+        """
+
+        self.type_codes[lakes, index] = type_code
+        self.densities[lakes, index] = self.layer_densities[lakes, type_code]
+        self.conductivities[lakes, index] = self.layer_conductivities[lakes, type_code]
+
+    def insert_layers(self, lakes, index, type_code, heights):
+        """Inserts a new layer in each of the given lakes. The density and conductivity are given by the
+        layer type and temperatures are not given.
+
+        :param lakes:       [array of int] Lakes to add a layer to.
+        :param index:       [array of int] Index of the new layer in each lake. Layers below are moved down.
+        :param type_code:   [int] Type code of the new layers.
+        :param heights:     [array] Height of the new layers.
+        """
+
+        if len(lakes) == 0:
+            return
+
+        self._make_wider(self.number_of_layers[lakes].max() + 1)
+
+        j = np.arange(self.heights.shape[1])
+        is_above = j < index[:, None]
+        is_new = j == index[:, None]
+        new_values = {'type_codes': type_code, 'heights': heights[:, None],
+                      'densities': self.layer_densities[lakes, type_code][:, None],
+                      'conductivities': self.layer_conductivities[lakes, type_code][:, None],
+                      'temperatures': np.nan, 'temperatures_top': np.nan, 'temperatures_bottom': np.nan}
+
+        for name in self.layer_arrays:
+            array = getattr(self, name)
+            values = array[lakes]
+            moved = np.empty_like(values)
+            moved[:, 1:] = values[:, :-1]
+            moved[:, 0] = values[:, 0]
+            array[lakes] = np.where(is_above, values, np.where(is_new, new_values[name], moved))
+
+        self.number_of_layers[lakes] += 1
+
+    def remove_top_layers(self, lakes):
+        """Removes the top layer in each of the given lakes.
+
+        :param lakes:       [array of int]
+        """
+
+        for name in self.layer_arrays:
+            array = getattr(self, name)
+            array[lakes, :-1] = array[lakes, 1:]
+        self.number_of_layers[lakes] -= 1
+
+    def _is_layer(self):
+        return np.arange(self.heights.shape[1]) < self.number_of_layers[:, None]
+
+    def _make_wider(self, width):
+        extra = width - self.heights.shape[1]
+        if extra > 0:
+            for name in self.layer_arrays:
+                array = getattr(self, name)
+                padding = np.zeros((array.shape[0], extra), dtype=array.dtype)
+                if array.dtype.kind == 'f':
+                    padding[:] = np.nan
+                setattr(self, name, np.concatenate((array, padding), axis=1))
+
+
+def calculate_ice_cover_air_temp_batch(inn_columns_inn, date, temp, dh_sno, cloud_cover=None, time_step=60*60*24,
+                                       end_dates=None, parameter_sets=None, output_dates=None, output_every=None,
+                                       summaries=None):
+    """Models the ice cover on many lakes with air temperature as surface temperature. This is
+    icethickness.calculate_ice_cover_air_temp done on all lakes at once. All lakes have the same dates, but the
+    initial ice columns may be on different dates. Lakes are stepped forward from the date of the initial column.
+
+    :param inn_columns_inn: [list of IceColumn] Initial ice column on each lake.
+    :param date:            [list of datetime] Dates of the forcing.
+    :param temp:            [2D array] Temperature on each lake, shape [lakes, days].
+    :param dh_sno:          [2D array] New snow on each lake, shape [lakes, days].
+    :param cloud_cover:     [2D array] Cloud cover on each lake, shape [lakes, days]. Optional and nan where not given.
+    :param time_step:       [int] fixed time step of 24hrs given in seconds
+    :param end_dates:       [list of datetime] Optional. Each lake is not stepped on dates from its end date.
+    :param parameter_sets:  [list of ModelParameters or dict] Optional. Model parameters on each lake, see
+                            get_parameter_sets. If None, the parameters of the initial ice columns are used.
+    :param output_dates:    [list of date] Optional. Only states on these days are kept in the trajectories.
+    :param output_every:    [int] Optional. Only every n-th state on each lake is kept, counted from the initial.
+                            See icetrajectory.make_output_selection.
+    :param summaries:       [list of IceCoverSummary] Optional. One pr lake. All modelled states are added to them.
+    :return:                [list of IceTrajectory] The modelled ice cover on each lake.
+    """
+
+    inn_columns = []
+    for inn_column_inn in inn_columns_inn:
+        inn_column = inn_column_inn.copy()
+        inn_column.update_water_line()
+        inn_column.remove_metadata()
+        inn_column.remove_time()
+        inn_columns.append(inn_column)
+
+    batch = IceColumnBatch(inn_columns, parameter_sets)
+    temp = np.asarray(temp, dtype=float)
+    dh_sno = np.asarray(dh_sno, dtype=float)
+
+    # Cloudless sky gives a lower surface temperature
+    if cloud_cover is None:
+        temp_surf = temp
+    else:
+        cloud_cover = np.asarray(cloud_cover, dtype=float)
+        temp_surf = np.where(np.isnan(cloud_cover), temp, dp.temperature_from_temperature_and_clouds(temp, cloud_cover))
+
+    states = [batch.get_state()]
+    stepped = [np.ones(len(batch), dtype=bool)]
+    steps_taken = np.zeros(len(batch), dtype=int)
+    output_days = None if output_dates is None else np.array(output_dates, dtype='datetime64[D]')
+    if summaries is not None:
+        for l, summary in enumerate(summaries):
+            summary.add(*_get_summary_values(batch, l))
+    dates = np.array(date, dtype='datetime64[us]')
+    if end_dates is not None:
+        end_dates = np.array([np.datetime64('NaT') if d is None else d for d in end_dates], dtype='datetime64[us]')
+
+    # Dates before all initial ice columns are not modelled
+    first_day = np.searchsorted(dates, batch.dates.min()) if len(batch) > 0 else len(date)
+
+    for i in range(first_day, len(date), 1):
+
+        # lakes where the date is before the initial ice column or after the end date are not stepped
+        active = batch.dates <= dates[i]
+        if end_dates is not None:
+            active &= ~(dates[i] >= end_dates)
+        if active.any():
+            batch.step(time_step, dh_sno[:, i], temp_surf[:, i], active)
+            steps_taken += active
+
+            if summaries is not None:
+                for l in np.flatnonzero(active):
+                    summaries[l].add(*_get_summary_values(batch, l))
+
+            # only states selected as output are kept
+            selected = active & _is_output(batch, steps_taken, output_days, output_every)
+            if selected.any():
+                states.append(batch.get_state())
+                stepped.append(selected)
+
+    return make_ice_trajectories(states, stepped, batch.top_layer_is_slush, batch.parameter_sets)
+
+
+def calculate_ice_cover_eb_batch(utm33_x, utm33_y, date, temp_atm, prec, prec_snow, cloud_cover, wind, rel_hum,
+                                 pressure_atm, inn_columns_inn, age_factor_tau=0., albedo_prim=None,
+                                 parameter_sets=None, output_dates=None, output_every=None):
+    """Models the ice cover on many lakes with surface temperature from the energy balance. This is
+    icethickness.calculate_ice_cover_eb done on all lakes at once. The surface temperatures of all lakes with ice
+    are solved together each day, see experimental.energybalancebatch. Lakes are stepped forward from the date of
+    the initial column.
+
+    :param utm33_x, utm33_y:    [array or int] Coordinates of each lake in UTM 33.
+    :param date:            [list of datetime] Dates of the forcing.
+    :param temp_atm:        [2D array] Air temperature on each lake, shape [lakes, days].
+    :param prec:            [2D array] Precipitation on each lake, shape [lakes, days].
+    :param prec_snow:       [2D array] Precipitation as snow on each lake, shape [lakes, days].
+    :param cloud_cover:     [2D array] Cloud cover on each lake, shape [lakes, days]. nan where not given, then it
+                            is estimated from precipitation. May be None.
+    :param wind:            [2D array] Wind on each lake, shape [lakes, days].
+    :param rel_hum:         [2D array] Relative humidity on each lake, shape [lakes, days].
+    :param pressure_atm:    [2D array] Air pressure on each lake, shape [lakes, days].
+    :param inn_columns_inn: [list of IceColumn] Initial ice column on each lake.
+    :param age_factor_tau:  [float or array] Snow age factor at the start on each lake.
+    :param albedo_prim:     [float or array] Albedo at the start on each lake. Default is the albedo of black ice.
+    :param parameter_sets:  [list of ModelParameters or dict] Optional. Model parameters on each lake, see
+                            get_parameter_sets. If None, the parameters of the initial ice columns are used.
+    :param output_dates:    [list of date] Optional. Only states on these days are kept in the trajectories.
+    :param output_every:    [int] Optional. Only every n-th state on each lake is kept, counted from the initial.
+                            See icetrajectory.make_output_selection.
+    :return:                [list of IceTrajectory], [dict of 2D arrays] The modelled ice cover on each lake and the
+                            energy balance on each lake and day, shape [lakes, days]. The energy balance has the terms
+                            in energybalancebatch.term_names and 'temp_surface', 'SM', 'iterations' and 'converged'.
+                            Terms are nan and iterations 0 on days without energy balance (no ice or not modelled).
+    """
+
+    inn_columns = []
+    for inn_column_inn in inn_columns_inn:
+        inn_column = inn_column_inn.copy()
+        inn_column.remove_metadata()
+        inn_column.remove_time()
+        inn_columns.append(inn_column)
+
+    batch = IceColumnBatch(inn_columns, parameter_sets)
+    number_of_lakes, number_of_days = len(batch), len(date)
+    time_span_in_sec = 60*60*24     # fixed timestep of 24hrs given in seconds
+
+    temp_atm, prec, prec_snow, wind, rel_hum, pressure_atm = [
+        np.broadcast_to(np.asarray(a, dtype=float), (number_of_lakes, number_of_days))
+        for a in (temp_atm, prec, prec_snow, wind, rel_hum, pressure_atm)]
+    if cloud_cover is None:
+        cloud_cover = np.full((number_of_lakes, number_of_days), np.nan)
+    cloud_cover = np.broadcast_to(np.asarray(cloud_cover, dtype=float), (number_of_lakes, number_of_days))
+
+    if albedo_prim is None:
+        albedo_prim = batch.parameters['alfa_black_ice']
+    albedo_prim = np.array(np.broadcast_to(np.asarray(albedo_prim, dtype=float), (number_of_lakes,)))
+    age_factor_tau = np.array(np.broadcast_to(np.asarray(age_factor_tau, dtype=float), (number_of_lakes,)))
+    temp_surface = np.full(number_of_lakes, np.nan)     # the surface temperature of the day before is the first guess
+
+    energy_balance = {name: np.full((number_of_lakes, number_of_days), np.nan)
+                      for name in debb.term_names + ['temp_surface', 'SM']}
+    energy_balance['iterations'] = np.zeros((number_of_lakes, number_of_days), dtype=int)
+    energy_balance['converged'] = np.zeros((number_of_lakes, number_of_days), dtype=bool)
+    energy_balance_batch = debb.EnergyBalanceBatch(batch, utm33_x, utm33_y)
+
+    states = [batch.get_state()]
+    stepped = [np.ones(number_of_lakes, dtype=bool)]
+    steps_taken = np.zeros(number_of_lakes, dtype=int)
+    output_days = None if output_dates is None else np.array(output_dates, dtype='datetime64[D]')
+    dates = np.array(date, dtype='datetime64[us]')
+
+    for i in range(0, number_of_days, 1):
+
+        # lakes where the date is before the initial ice column are not stepped
+        active = batch.dates <= dates[i]
+        if not active.any():
+            continue
+
+        # No ice, dont do EB and use air temp as surface temp
+        has_ice = active & (batch.number_of_layers > 0)
+        surface_temp = temp_atm[:, i].copy()
+        melt_energy = np.full(number_of_lakes, np.nan)
+
+        lakes = np.flatnonzero(has_ice)
+        if len(lakes) > 0:
+            energy_balance_batch.set_day(
+                lakes, temp_atm[lakes, i], prec[lakes, i], prec_snow[lakes, i], albedo_prim[lakes],
+                age_factor_tau[lakes], cloud_cover[lakes, i], wind[lakes, i], rel_hum[lakes, i],
+                pressure_atm[lakes, i], time_span_in_sec)
+            eb = debb.temp_surface_from_eb(energy_balance_batch, temp_surface[lakes])
+
+            for name, values in eb.items():
+                energy_balance[name][lakes, i] = values
+
+            surface_temp[lakes] = eb['temp_surface']
+            melt_energy[lakes] = np.where(eb['temp_surface'] == 0., eb['SM'], np.nan)
+
+        batch.step(time_span_in_sec, prec_snow[:, i], surface_temp, active, melt_energy)
+        steps_taken += active
+
+        no_ice = active & ~has_ice
+        age_factor_tau[no_ice] = 0.
+        albedo_prim[no_ice] = batch.parameters['alfa_black_ice'][no_ice]
+        temp_surface[no_ice] = np.nan
+        if len(lakes) > 0:
+            age_factor_tau[lakes] = eb['age_factor_tau']
+            albedo_prim[lakes] = eb['albedo_prim']
+            temp_surface[lakes] = eb['temp_surface']
+
+        # only states selected as output are kept
+        selected = active & _is_output(batch, steps_taken, output_days, output_every)
+        if selected.any():
+            states.append(batch.get_state())
+            stepped.append(selected)
+
+    return make_ice_trajectories(states, stepped, batch.top_layer_is_slush, batch.parameter_sets), energy_balance
+
+
+def calculate_forked_forecasts(date, temp, dh_sno, cloud_cover=None, observed_ice=(), base_trajectory=None,
+                               fork_dates=(), forecast_days=None, time_step=60*60*24):
+    """Many short forecasts on one lake run as one batch. The forecasts are forked from observed ice columns and
+    from the modelled ice in a base trajectory (e.g. a season kept in an IceCheckpoint) on given dates. All forks
+    use the same forcing, which is not copied for each fork.
+
+    :param date:            [list of datetime] Dates of the forcing on the lake.
+    :param temp:            [list or array] Temperature pr day.
+    :param dh_sno:          [list or array] New snow pr day.
+    :param cloud_cover:     [list or array] Cloud cover pr day. Optional.
+    :param observed_ice:    [list of IceColumn] Forks start from these.
+    :param base_trajectory: [IceTrajectory] Forks start from the columns of this trajectory on fork_dates.
+    :param fork_dates:      [list of datetime] Dates in the base trajectory to fork from.
+    :param forecast_days:   [int] Optional. Each fork is stepped over this many days after its start date and the day
+                            it starts, e.g. 9 gives 10 days. If None, forks run to the end of the forcing.
+    :param time_step:       [int] fixed time step of 24hrs given in seconds
+    :return:                [list of IceTrajectory] One pr fork. First the observed and then the fork dates.
+    """
+
+    inn_columns = list(observed_ice)
+    for fork_date in fork_dates:
+        ice_column = base_trajectory.get_ice_column(fork_date)
+        if ice_column is None:
+            ml.log_and_print("[warning] icebatch.py -> calculate_forked_forecasts: No ice column on {} in the base trajectory.".format(fork_date))
+            ice_column = ice.IceColumn(fork_date, [])
+        inn_columns.append(ice_column)
+
+    if len(inn_columns) == 0:
+        return []
+
+    end_dates = None
+    if forecast_days is not None:
+        end_dates = [c.date.replace(hour=00, minute=0) + dt.timedelta(days=forecast_days + 1) for c in inn_columns]
+
+    # The forcing is broadcast to all forks without copying
+    number_of_forks = len(inn_columns)
+    temp = np.broadcast_to(np.asarray(temp, dtype=float), (number_of_forks, len(date)))
+    dh_sno = np.broadcast_to(np.asarray(dh_sno, dtype=float), (number_of_forks, len(date)))
+    if cloud_cover is not None:
+        cloud_cover = np.asarray([np.nan if c is None else c for c in cloud_cover], dtype=float)
+        cloud_cover = np.broadcast_to(cloud_cover, (number_of_forks, len(date)))
+
+    return calculate_ice_cover_air_temp_batch(
+        inn_columns, date, temp, dh_sno, cloud_cover=cloud_cover, time_step=time_step, end_dates=end_dates)
+
+
+def get_parameter_sets(parameter_sets, number_of_lakes):
+    """Model parameters pr lake as ModelParameters. Only the parameters in parameter_names may differ from
+    icemodelling.constants and a warning is given if others do.
+
+    :param parameter_sets:  [list of ModelParameters or dict] Parameters pr lake. A dict {name: value} is given to
+                            ModelParameters. If None, the default parameters are used on all lakes.
+    :param number_of_lakes: [int]
+    :return:                [list of ModelParameters]
+    """
+
+    if parameter_sets is None:
+        return [mpar.default_parameters] * number_of_lakes
+
+    parameter_sets = [s if isinstance(s, mpar.ModelParameters) else mpar.ModelParameters(**s) for s in parameter_sets]
+
+    default = mpar.default_parameters
+    not_used = set(n for s in set(parameter_sets) if s != default for n in mpar.parameter_names
+                   if n not in parameter_names and getattr(s, n) != getattr(default, n))
+    if not_used:
+        ml.log_and_print("[warning] icebatch.py -> get_parameter_sets: Parameters {} are not used pr lake in the batch."
+                         .format(sorted(not_used)))
+
+    return parameter_sets
+
+
+def make_ice_trajectories(states, stepped, top_layer_is_slush, parameter_sets=None):
+    """Makes an IceTrajectory on each lake from the states kept after each time step.
+
+    :param states:              [list of dict] IceColumnBatch.get_state after each time step.
+    :param stepped:             [list of array of bool] Lakes that were stepped in each time step.
+    :param top_layer_is_slush:  [list] top_layer_is_slush of each lake.
+    :param parameter_sets:      [list of ModelParameters] Optional. Model parameters of each lake.
+    :return:                    [list of IceTrajectory]
+    """
+
+    width = max(s['heights'].shape[1] for s in states)
+    stepped = np.array(stepped)
+
+    # The states are stacked to arrays of shape [lakes, time steps] or [lakes, time steps, layers]
+    def stack(name):
+        arrays = [s[name] for s in states]
+        if arrays[0].ndim == 2:
+            arrays = [np.pad(a, ((0, 0), (0, width - a.shape[1])), constant_values=np.nan if a.dtype.kind == 'f' else 0)
+                      for a in arrays]
+        return np.stack(arrays, axis=1)
+
+    layer_names = ['type_codes', 'heights', 'densities', 'conductivities', 'temperatures']
+    column_names = ['water_lines', 'draft_thicknesses', 'total_column_heights', 'temp_surfaces', 'in_slush_event']
+    layer_values = {name: stack(name) for name in layer_names}
+    column_values = {name: stack(name) for name in column_names}
+    dates = stack('dates')
+    number_of_layers = stack('number_of_layers')
+
+    trajectories = []
+    for l in range(stepped.shape[1]):
+        steps = np.flatnonzero(stepped[:, l])
+        layer_counts = number_of_layers[l, steps]
+        is_layer = np.arange(width) < layer_counts[:, None]
+
+        trajectory_column_values = {name: values[l, steps] for name, values in column_values.items()}
+        trajectory_column_values['top_layer_is_slush'] = [top_layer_is_slush[l]] * len(steps)
+
+        trajectories.append(itr.IceTrajectory.from_arrays(
+            dates[l, steps], layer_counts,
+            {name: values[l, steps][is_layer] for name, values in layer_values.items()},
+            trajectory_column_values, None if parameter_sets is None else parameter_sets[l]))
+
+    return trajectories
+
+
+def _is_output(batch, steps_taken, output_days, output_every):
+    """Lakes where the present state is selected as output. All lakes if no selection is given. The selection is
+    as in icetrajectory.make_output_selection, with the steps taken on a lake as the column number.
+
+    :param output_days:     [array of datetime64[D]] or None.
+    :param output_every:    [int] or None.
+    """
+
+    if output_days is None and output_every is None:
+        return np.ones(len(batch), dtype=bool)
+
+    is_output = steps_taken == 0
+    if output_every is not None:
+        is_output |= steps_taken % output_every == 0
+    if output_days is not None:
+        is_output |= np.isin(batch.dates.astype('datetime64[D]'), output_days)
+
+    return is_output
+
+
+def _get_summary_values(batch, l):
+    """Date, draft thickness and total column height of one lake, as added to an IceCoverSummary. Values not given
+    are nan and are not counted by the summary."""
+
+    return (batch.dates[l].astype(dt.datetime), float(batch.draft_thicknesses[l]),
+            float(batch.total_column_heights[l]))
+
+
+def _nan_if_none(value):
+    if value is None:
+        return np.nan
+    return value
+
+
+def _none_if_nan(value):
+    if np.isnan(value):
+        return None
+    return float(value)
+
+
+if __name__ == "__main__":
+
+    from icemodelling import icethickness as it
+
+    dates = [dt.datetime(2018, 11, 1) + dt.timedelta(days=i) for i in range(150)]
+    temps = np.array([[-5. + 8. * np.sin(i / (7. + l)) for i in range(150)] for l in range(4)])
+    snow = np.array([[0.03 if (i + l) % 9 == 0 else 0. for i in range(150)] for l in range(4)])
+    clouds = np.where(snow > 0, 1., 0.2)
+    first_ice = [ice.IceColumn(dates[0], []),
+                 ice.IceColumn(dates[10], [ice.IceLayer(0.1, 'black_ice')]),
+                 ice.IceColumn(dates[20], [ice.IceLayer(0.05, 'snow'), ice.IceLayer(0.2, 'black_ice')]),
+                 ice.IceColumn(dates[0], [])]
+
+    trajectories = calculate_ice_cover_air_temp_batch(first_ice, dates, temps, snow, clouds)
+
+    for l in range(len(first_ice)):
+        calculated_ice = it.calculate_ice_cover_air_temp(first_ice[l], dates, temps[l], snow[l], clouds[l])
+        assert len(calculated_ice) == len(trajectories[l])
+        for ci, ti in zip(calculated_ice, trajectories[l]):
+            assert ci.date == ti.date and np.isclose(ci.draft_thickness, ti.draft_thickness)
+            assert [l.type for l in ci.column] == [l.type for l in ti.column]
+
+    # Parameters differing between the lakes give the same as on one lake at a time with those parameters
+    parameter_sets = [{'temp_f': -0.5}, {'h_min_for_conductivity_black_ice': 0.2},
+                      {'surface_k_reduction_snow': 0.5, 'h_min_for_conductivity_snow': 0.1},
+                      {'surface_k_reduction_black_ice': 0.5, 'h_min_for_conductivity_slush_ice': 0.1}]
+    trajectories = calculate_ice_cover_air_temp_batch(first_ice, dates, temps, snow, clouds,
+                                                      parameter_sets=parameter_sets)
+
+    for l in range(len(first_ice)):
+        calculated_ice = it.calculate_ice_cover_air_temp(first_ice[l], dates, temps[l], snow[l], clouds[l],
+                                                         parameters=trajectories[l].parameters)
+        assert len(calculated_ice) == len(trajectories[l])
+        for ci, ti in zip(calculated_ice, trajectories[l]):
+            assert ci.date == ti.date and np.isclose(ci.draft_thickness, ti.draft_thickness)
+            assert [l.type for l in ci.column] == [l.type for l in ti.column]
+
+    # The same columns are kept as output as in the scalar driver
+    output_dates = [dates[30], dates[90]]
+    selected = calculate_ice_cover_air_temp_batch(first_ice, dates, temps, snow, clouds,
+                                                  output_dates=output_dates, output_every=50)
+
+    for l in range(len(first_ice)):
+        calculated_ice = it.calculate_ice_cover_air_temp(first_ice[l], dates, temps[l], snow[l], clouds[l],
+                                                         output_dates=output_dates, output_every=50)
+        assert [ci.date for ci in calculated_ice] == [ti.date for ti in selected[l]]
+
+    print([t.get_draft_thickness(dt.date(2019, 2, 1)) for t in trajectories])
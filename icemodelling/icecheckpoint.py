@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""Checkpoints of modelled ice cover so that daily runs only model the days with new forcing.
+
+The modelled ice cover on a lake is kept together with a hash chain of the forcing it was modelled with. The
+first hash is made from the initial ice column and each following hash from the previous hash and the forcing
+of one more day. When a lake is modelled again, the columns where the hashes are still equal are reused and
+the model continues from the last of these. Forcing that has changed (e.g. yesterdays forecast replaced by
+observations) or a new initial column makes the hashes differ from that day on.
+"""
+
+import os
+import hashlib
+import datetime as dt
+from icemodelling import icethickness as it
+from icemodelling import icetrajectory as itr
+from icemodelling import modelparameters as mpar
+from utilities import makepickle as mp, makelogs as ml
+
+__author__ = 'raek'
+
+
+# Version of the model code in the checkpoints. Increase it when a change in the code stepping the ice columns
+# gives other ice, so that checkpoints made with the old code are modelled again.
+model_version = 1
+
+
+class IceCheckpoint:
+    """Modelled ice cover on a lake and the hashes of the forcing it was modelled with. Each column in the
+    trajectory is the state at the end of a day and a run may continue from it.
+
+    forcing_hashes[i] is the hash of the initial column and the forcing of the days up to column i.
+    eb_states[i] is (age_factor_tau, albedo_prim, temp_surface) after column i when modelled with the energy
+    balance, where temp_surface is the first guess of the surface temperature the next day. It is None when
+    modelled with air temperature.
+    """
+
+    def __init__(self, trajectory, forcing_hashes, eb_states=None):
+        """
+        :param trajectory:      [IceTrajectory] The modelled ice cover.
+        :param forcing_hashes:  [list of str] One pr column in the trajectory.
+        :param eb_states:       [list of tuples] (age_factor_tau, albedo_prim, temp_surface) pr column. Optional.
+        """
+
+        self.trajectory = trajectory
+        self.forcing_hashes = forcing_hashes
+        self.eb_states = eb_states
+        self.date_saved = dt.datetime.now()
+
+    def get_valid_length(self, forcing_hashes):
+        """Number of columns in the trajectory that are still valid given the hashes of new forcing.
+
+        :param forcing_hashes:  [list of str] Hashes of the new initial column and forcing.
+        :return:                [int] 0 if none are valid.
+        """
+
+        valid_length = 0
+        for old_hash, new_hash in zip(self.forcing_hashes, forcing_hashes):
+            if old_hash != new_hash:
+                break
+            valid_length += 1
+
+        return valid_length
+
+
+class IceCheckpointStore:
+    """Checkpoints pr lake and forcing source, e.g. (location id, 'gts'), kept in a pickle between runs."""
+
+    def __init__(self, file_name_and_path):
+        """
+        :param file_name_and_path:  [string] Pickle with the checkpoints. If it does not exist a new store is made.
+        """
+
+        self.file_name_and_path = file_name_and_path
+        self.checkpoints = {}
+
+        if os.path.exists(file_name_and_path):
+            try:
+                self.checkpoints = mp.unpickle_anything(file_name_and_path, print_message=False)
+            except:
+                ml.log_and_print("[warning] icecheckpoint.py -> IceCheckpointStore: Could not read {}. Starting with no checkpoints."
+                                 .format(file_name_and_path))
+
+    def get_checkpoint(self, lake_id, forcing_source):
+        """
+        :param lake_id:         E.g. the regObs location id.
+        :param forcing_source:  [string] E.g. 'gts'.
+        :return:                [IceCheckpoint] or None if there is none.
+        """
+
+        return self.checkpoints.get((lake_id, forcing_source))
+
+    def set_checkpoint(self, lake_id, forcing_source, checkpoint):
+        self.checkpoints[(lake_id, forcing_source)] = checkpoint
+
+    def save(self):
+        mp.pickle_anything(self.checkpoints, self.file_name_and_path, print_message=False)
+
+
+def make_forcing_hashes(inn_column, forcing_days, *constants):
+    """Hash chain of an initial column and the forcing on the days it is stepped.
+
+    The model constants of the column (also the defaults in icemodelling.constants) and model_version are part of
+    the first hash, so a change in either makes all hashes differ.
+
+    :param inn_column:      [IceColumn] Initial ice column.
+    :param forcing_days:    [list of tuples] The forcing (date, temp, etc.) of each day the column is stepped.
+    :param constants:       Values that apply to all days, e.g. time step and position.
+    :return:                [list of str] One more hash than forcing days. The first is for the initial column.
+    """
+
+    layers = [(l.type_code, l.height, l.density, l.conductivity, l.temperature) for l in inn_column.column]
+
+    # Other model constants or model code give other ice
+    parameters = inn_column.parameters.to_dict()
+    initial_values = (model_version, inn_column.date, constants, layers, inn_column.in_slush_event,
+                      tuple((name, parameters[name]) for name in mpar.parameter_names))
+    forcing_hashes = [hashlib.sha1(_hash_key(initial_values).encode()).hexdigest()]
+
+    for forcing_day in forcing_days:
+        forcing_hash = forcing_hashes[-1] + _hash_key(forcing_day)
+        forcing_hashes.append(hashlib.sha1(forcing_hash.encode()).hexdigest())
+
+    return forcing_hashes
+
+
+def get_stepped_days(start_date, date, time_step=60*60*24):
+    """Indexes of the dates the models step forward on. As in the drivers in icethickness, dates before the
+    date of the ice column are skipped and the column date is stepped one time step each time.
+
+    :param start_date:      [datetime] Date of the initial ice column.
+    :param date:            [list of datetime] Dates of the forcing.
+    :param time_step:       [int] In seconds.
+    :return:                [list of int]
+    """
+
+    column_date = start_date
+    stepped_days = []
+    for i, d in enumerate(date):
+        if d < column_date:
+            continue
+        stepped_days.append(i)
+        column_date = column_date + dt.timedelta(seconds=time_step)
+
+    return stepped_days
+
+
+def calculate_ice_cover_air_temp_incremental(store, lake_id, forcing_source, inn_column_inn, date, temp, dh_sno,
+                                             cloud_cover=None, time_step=60*60*24):
+    """As icethickness.calculate_ice_cover_air_temp, but continues from the checkpoint of the lake where the
+    forcing is unchanged. Only the days after are modelled. The checkpoint is updated with the new result,
+    but the store is not saved.
+
+    :param store:           [IceCheckpointStore]
+    :param lake_id:         E.g. the regObs location id.
+    :param forcing_source:  [string] E.g. 'gts'.
+    :param inn_column_inn:  [IceColumn] Initial ice column for modelling.
+    :param date:            [] dates of the forcing
+    :param temp:
+    :param dh_sno:          [] new snow over the period (day)
+    :param cloud_cover:
+    :param time_step:       [int] fixed time step of 24hrs given in seconds
+    :return:                [IceTrajectory] The same as IceTrajectory(calculate_ice_cover_air_temp(...)).
+    """
+
+    if cloud_cover is None:
+        cloud_cover = [None] * len(date)
+
+    start_date = inn_column_inn.date.replace(hour=00, minute=0)
+    stepped_days = get_stepped_days(start_date, date, time_step)
+    forcing_hashes = make_forcing_hashes(
+        inn_column_inn, [(date[i], temp[i], dh_sno[i], cloud_cover[i]) for i in stepped_days], time_step)
+
+    checkpoint = store.get_checkpoint(lake_id, forcing_source)
+    valid_length = checkpoint.get_valid_length(forcing_hashes) if checkpoint is not None else 0
+
+    if valid_length == 0:
+        trajectory = itr.IceTrajectory(it.calculate_ice_cover_air_temp(
+            inn_column_inn, date, temp, dh_sno, cloud_cover=cloud_cover, time_step=time_step))
+
+    else:
+        trajectory = checkpoint.trajectory.head(valid_length)
+
+        # Continue from the last valid column with the days not yet modelled.
+        days = stepped_days[valid_length-1:]
+        if len(days) > 0:
+            ice_cover = it.calculate_ice_cover_air_temp(
+                trajectory.get_ice_column_at_index(valid_length-1),
+                [date[i] for i in days], [temp[i] for i in days], [dh_sno[i] for i in days],
+                cloud_cover=[cloud_cover[i] for i in days], time_step=time_step)
+            trajectory.extend(ice_cover[1:])
+
+    store.set_checkpoint(lake_id, forcing_source, IceCheckpoint(trajectory, forcing_hashes))
+
+    return trajectory
+
+
+def calculate_ice_cover_eb_incremental(
+        store, lake_id, forcing_source, utm33_x, utm33_y, date, temp_atm, prec, prec_snow, cloud_cover, wind,
+        rel_hum, pressure_atm, inn_column):
+    """As icethickness.calculate_ice_cover_eb, but continues from the checkpoint of the lake where the forcing is
+    unchanged. Snow age factor, albedo and surface temperature are kept in the checkpoint. The checkpoint is updated with the new
+    result, but the store is not saved.
+
+    :return icecover, energy_balance:   [IceTrajectory] The modelled ice cover for all days and
+                                        [list of EnergyBalanceElement] for the days modelled in this run only.
+    """
+
+    time_step = 60*60*24
+    start_date = inn_column.date.replace(hour=00, minute=0)
+    stepped_days = get_stepped_days(start_date, date, time_step)
+    forcing_hashes = make_forcing_hashes(
+        inn_column,
+        [(date[i], temp_atm[i], prec[i], prec_snow[i], cloud_cover[i], wind[i], rel_hum[i], pressure_atm[i])
+         for i in stepped_days],
+        utm33_x, utm33_y)
+
+    checkpoint = store.get_checkpoint(lake_id, forcing_source)
+    valid_length = 0
+    # Checkpoints saved without the surface temperature are modelled again
+    if checkpoint is not None and checkpoint.eb_states is not None and len(checkpoint.eb_states[0]) == 3:
+        valid_length = checkpoint.get_valid_length(forcing_hashes)
+
+    initial_eb_state = (0., inn_column.parameters.alfa_black_ice, None)
+    if valid_length == 0:
+        trajectory = itr.IceTrajectory()
+        eb_states = []
+        days = stepped_days
+        first_column, (age_factor_tau, albedo_prim, temp_surface) = inn_column, initial_eb_state
+    else:
+        trajectory = checkpoint.trajectory.head(valid_length-1)
+        eb_states = checkpoint.eb_states[:valid_length-1]
+        days = stepped_days[valid_length-1:]
+        first_column = checkpoint.trajectory.get_ice_column_at_index(valid_length-1)
+        age_factor_tau, albedo_prim, temp_surface = checkpoint.eb_states[valid_length-1]
+
+    icecover, energy_balance = it.calculate_ice_cover_eb(
+        utm33_x, utm33_y, [date[i] for i in days], [temp_atm[i] for i in days], [prec[i] for i in days],
+        [prec_snow[i] for i in days], [cloud_cover[i] for i in days], [wind[i] for i in days],
+        [rel_hum[i] for i in days], [pressure_atm[i] for i in days], inn_column=first_column,
+        age_factor_tau=age_factor_tau, albedo_prim=albedo_prim, temp_surface=temp_surface)
+
+    # The state after each day is the state the driver uses the next day
+    eb_states.append((age_factor_tau, albedo_prim, temp_surface))
+    for eb in energy_balance:
+        if eb.EB is None:
+            eb_states.append(initial_eb_state)
+        else:
+            eb_states.append((eb.age_factor_tau, eb.albedo_prim, eb.temp_surface))
+
+    trajectory.extend(icecover)
+    store.set_checkpoint(lake_id, forcing_source, IceCheckpoint(trajectory, forcing_hashes, eb_states))
+
+    return trajectory, energy_balance
+
+
+def _hash_key(values):
+    """A string of the values where floats are given exactly, so equal forcing gives equal hashes."""
+
+    if isinstance(values, (list, tuple)):
+        return '(' + ','.join(_hash_key(v) for v in values) + ')'
+    if isinstance(values, bool) or values is None:
+        return repr(values)
+    if isinstance(values, (dt.datetime, dt.date)):
+        return values.isoformat()
+    try:
+        return float(values).hex()
+    except (TypeError, ValueError):
+        return repr(values)
+
+
+if __name__ == "__main__":
+
+    import tempfile
+    from icemodelling import ice as ice
+
+    dates = [dt.datetime(2018, 11, 1) + dt.timedelta(days=i) for i in range(120)]
+    temps = [-5. + 6. * ((i * 7) % 11 - 5) / 5 for i in range(120)]
+    snow = [0.02 if i % 10 == 0 else 0. for i in range(120)]
+    first_ice = ice.IceColumn(dates[5], [ice.IceLayer(0.1, 'black_ice')])
+
+    store = IceCheckpointStore(os.path.join(tempfile.mkdtemp(), 'checkpoints.pickle'))
+    calculate_ice_cover_air_temp_incremental(store, 1, 'test', first_ice, dates[:100], temps[:100], snow[:100])
+
+    # The forecast of the last days is changed and more days are added
+    temps[95:100] = [t + 1. for t in temps[95:100]]
+    trajectory = calculate_ice_cover_air_temp_incremental(store, 1, 'test', first_ice, dates, temps, snow)
+    calculated_ice = it.calculate_ice_cover_air_temp(first_ice, dates, temps, snow)
+
+    assert len(trajectory) == len(calculated_ice)
+    for ci, ti in zip(calculated_ice, trajectory):
+        assert ci.date == ti.date and ci.draft_thickness == ti.draft_thickness
+
+    store.save()
+    print(len(trajectory), IceCheckpointStore(store.file_name_and_path).get_checkpoint(1, 'test').get_valid_length(
+        store.get_checkpoint(1, 'test').forcing_hashes))
+
+    # A run resumed from a checkpoint keeps the parameters of the first run
+    parameters = mpar.ModelParameters(h_min_for_conductivity_black_ice=0.2)
+    first_ice = ice.IceColumn(dates[5], [ice.IceLayer(0.1, 'black_ice')], parameters)
+    calculate_ice_cover_air_temp_incremental(store, 2, 'test', first_ice, dates[:100], temps[:100], snow[:100])
+    temps[95:100] = [t - 1. for t in temps[95:100]]
+    trajectory = calculate_ice_cover_air_temp_incremental(store, 2, 'test', first_ice, dates, temps, snow)
+    calculated_ice = it.calculate_ice_cover_air_temp(first_ice, dates, temps, snow)
+
+    assert trajectory.parameters == parameters
+    for ci, ti in zip(calculated_ice, trajectory):
+        assert ci.date == ti.date and ci.draft_thickness == ti.draft_thickness
+
+    # The energy balance run resumed from a checkpoint is the same as a full run, also with other parameters
+    parameters = mpar.ModelParameters(alfa_black_ice=0.4)
+    first_ice = ice.IceColumn(dates[5], [ice.IceLayer(0.02, 'snow'), ice.IceLayer(0.1, 'black_ice')], parameters)
+    first_ice.update_column_temperatures(-5.)
+    prec = [s / 3 for s in snow]
+    forcing = [[None] * 120, [3.] * 120, [0.8] * 120, [101.1] * 120]
+    calculate_ice_cover_eb_incremental(store, 3, 'test', 260151, 6671132, dates[:100], temps[:100], prec[:100],
+                                       snow[:100], *[f[:100] for f in forcing], first_ice.copy())
+    trajectory, energy_balance = calculate_ice_cover_eb_incremental(
+        store, 3, 'test', 260151, 6671132, dates, temps, prec, snow, *forcing, first_ice.copy())
+    calculated_ice, energy_balance = it.calculate_ice_cover_eb(
+        260151, 6671132, dates, temps, prec, snow, *forcing, inn_column=first_ice.copy())
+
+    assert len(trajectory) == len(calculated_ice)
+    for ci, ti in zip(calculated_ice, trajectory):
+        assert ci.date == ti.date and ci.draft_thickness == ti.draft_thickness
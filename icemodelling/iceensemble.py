@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Parameter ensembles for calibration. The members of an ensemble are the same lake with the same forcing and
+initial ice, but with different model constants (see icebatch.parameter_names). All members are stepped
+together as one batch, and the modelled draft thickness of each member may be scored against observations."""
+
+import csv
+import itertools
+import datetime as dt
+import numpy as np
+from icemodelling import icebatch as ib
+from utilities import makelogs as ml
+
+__author__ = 'raek'
+
+
+def calculate_ice_cover_ensemble(inn_column_inn, date, temp, dh_sno, parameter_sets, cloud_cover=None,
+                                 time_step=60*60*24, output_dates=None):
+    """Models the ice cover on a lake once for each parameter set. This is icethickness.calculate_ice_cover_air_temp
+    with other model constants, done for all members at once. The forcing is not copied for each member.
+
+    :param inn_column_inn:  [IceColumn] Initial ice column for modelling.
+    :param date:            [list of datetime] Dates of the forcing.
+    :param temp:            [list or array] Temperature pr day.
+    :param dh_sno:          [list or array] New snow pr day.
+    :param parameter_sets:  [list of ModelParameters or dict] One pr member. See icebatch.get_parameter_sets.
+    :param cloud_cover:     [list or array] Cloud cover pr day. Optional.
+    :param time_step:       [int] fixed time step of 24hrs given in seconds
+    :param output_dates:    [list of date] Optional. Only the ice cover on these days (e.g. the dates of the
+                            observations to score against) is kept. See icetrajectory.make_output_selection.
+    :return:                [list of IceTrajectory] The modelled ice cover of each member.
+    """
+
+    number_of_members = len(parameter_sets)
+    if number_of_members == 0:
+        return []
+
+    temp = np.broadcast_to(np.asarray(temp, dtype=float), (number_of_members, len(date)))
+    dh_sno = np.broadcast_to(np.asarray(dh_sno, dtype=float), (number_of_members, len(date)))
+    if cloud_cover is not None:
+        cloud_cover = np.asarray([np.nan if c is None else c for c in cloud_cover], dtype=float)
+        cloud_cover = np.broadcast_to(cloud_cover, (number_of_members, len(date)))
+
+    return ib.calculate_ice_cover_air_temp_batch(
+        [inn_column_inn] * number_of_members, date, temp, dh_sno, cloud_cover=cloud_cover, time_step=time_step,
+        parameter_sets=parameter_sets, output_dates=output_dates)
+
+
+def make_parameter_grid(parameter_values):
+    """Parameter sets for all combinations of the given values.
+
+    :param parameter_values:    [dict] {name: list of values}, e.g. {'snow_pull_on_water': [0.01, 0.02, 0.04]}
+    :return:                    [list of dict] One parameter set pr combination.
+    """
+
+    names = list(parameter_values.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*[parameter_values[n] for n in names])]
+
+
+def get_modelled_and_observed(trajectories, observations):
+    """Pairs the modelled draft thickness of each member with observed draft thickness on the same dates.
+    Observations on dates not modelled are left out.
+
+    :param trajectories:    [list of IceTrajectory] One pr member, e.g. from calculate_ice_cover_ensemble.
+    :param observations:    [list of tuples] (date, observed draft thickness)
+    :return modelled, observed: [2D array] shape [members, observations] and [array] shape [observations]
+    """
+
+    if len(trajectories) == 0:
+        return np.zeros((0, 0)), np.zeros(0)
+
+    modelled = np.array([[t.get_draft_thickness(d) for d, o in observations] for t in trajectories], dtype=float)
+    observed = np.array([o for d, o in observations], dtype=float)
+
+    # All members have the same dates
+    is_modelled = ~np.isnan(modelled).any(axis=0) & ~np.isnan(observed)
+
+    return modelled[:, is_modelled], observed[is_modelled]
+
+
+def calculate_skill_scores(modelled, observed):
+    """Skill scores of each member given pairs of modelled and observed draft thickness.
+
+    Nash-Sutcliffe efficiency is 1 - sum((modelled - observed)^2) / sum((observed - mean(observed))^2). It is 1 for
+    a perfect model and 0 for a model as good as the mean of the observations.
+
+    :param modelled:        [2D array] shape [members, observations]
+    :param observed:        [array] shape [observations]
+    :return:                [dict of arrays] 'nash_sutcliffe', 'rmse', 'bias' and 'mae' with one value pr member.
+                            nan if there are no observations.
+    """
+
+    modelled = np.asarray(modelled, dtype=float)
+    observed = np.asarray(observed, dtype=float)
+    number_of_members = modelled.shape[0]
+
+    if len(observed) == 0:
+        nans = np.full(number_of_members, np.nan)
+        return {'nash_sutcliffe': nans, 'rmse': nans.copy(), 'bias': nans.copy(), 'mae': nans.copy()}
+
+    errors = modelled - observed
+    squared_errors = (errors ** 2).sum(axis=1)
+    variance = ((observed - observed.mean()) ** 2).sum()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nash_sutcliffe = np.where(variance > 0, 1 - squared_errors / variance, np.nan)
+
+    return {'nash_sutcliffe': nash_sutcliffe,
+            'rmse': np.sqrt(squared_errors / len(observed)),
+            'bias': errors.mean(axis=1),
+            'mae': np.abs(errors).mean(axis=1)}
+
+
+def read_observed_drafts(file_name_and_path):
+    """Reads the observed draft thickness on each regObs location from a data set as made by
+    experimental.machinelearning, e.g. resources/datasets/all_observed_and_calculated_ice_2014-19.csv.
+
+    :param file_name_and_path:  [string] Semicolon separated file with the columns regobs_id, date and observed_draft.
+    :return:                    [dict] {regobs location id: [(date, observed draft thickness)]} sorted on date.
+    """
+
+    observed_drafts = {}
+
+    with open(file_name_and_path, encoding='utf-8') as f:
+        for row in csv.DictReader(f, delimiter=';'):
+            try:
+                location_id = int(row['regobs_id'])
+                date = dt.datetime.strptime(row['date'], '%Y-%m-%d')
+                observed_draft = float(row['observed_draft'])
+            except (KeyError, ValueError):
+                ml.log_and_print("[warning] iceensemble.py -> read_observed_drafts: Skipping row {}.".format(row))
+                continue
+            observed_drafts.setdefault(location_id, []).append((date, observed_draft))
+
+    for observations in observed_drafts.values():
+        observations.sort(key=lambda o: o[0])
+
+    return observed_drafts
+
+
+if __name__ == "__main__":
+
+    from icemodelling import ice as ice, icethickness as it, constants as const
+
+    dates = [dt.datetime(2018, 11, 1) + dt.timedelta(days=i) for i in range(150)]
+    temps = [-5. + 8. * np.sin(i / 9.) for i in range(150)]
+    snow = [0.03 if i % 9 == 0 else 0. for i in range(150)]
+    first_ice = ice.IceColumn(dates[0], [ice.IceLayer(0.1, 'black_ice')])
+
+    # The first member has the default constants and is the same as the ordinary model
+    parameter_sets = [{}] + [{'meltingcoeff_black_ice': f * const.meltingcoeff_black_ice} for f in (0.5, 2.)] + \
+                     [{'part_ice_in_slush': 0.6, 'snow_pull_on_water': 0.04}]
+    trajectories = calculate_ice_cover_ensemble(first_ice, dates, temps, snow, parameter_sets)
+
+    calculated_ice = it.calculate_ice_cover_air_temp(first_ice, dates, temps, snow)
+    for ci, ti in zip(calculated_ice, trajectories[0]):
+        assert ci.date == ti.date and np.isclose(ci.draft_thickness, ti.draft_thickness)
+
+    observations = [(c.date, c.draft_thickness + 0.01) for c in calculated_ice[10::20]]
+    scores = calculate_skill_scores(*get_modelled_and_observed(trajectories, observations))
+    print(scores['nash_sutcliffe'], scores['rmse'])
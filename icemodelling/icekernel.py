@@ -0,0 +1,558 @@
+# -*- coding: utf-8 -*-
+"""Kernel for stepping an ArrayIceColumn one time step. It is the model in
+icethickness.get_ice_thickness_from_surface_temp written as loops over plain arrays so that it can be compiled
+with Numba. If Numba is installed the kernel is compiled and get_ice_thickness_from_surface_temp uses it for
+ArrayIceColumns. Without Numba the kernel runs as ordinary python and is only used when called directly."""
+
+import math
+import numpy as np
+from icemodelling import constants as const
+from icemodelling import ice as ice
+from icemodelling import modelparameters as mpar
+from utilities import makelogs as ml
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+__author__ = 'raek'
+
+
+# True if the kernel is compiled and used by get_ice_thickness_from_surface_temp
+is_compiled = numba is not None
+
+
+def _jit(function):
+    if numba is None:
+        return function
+    return numba.njit(cache=True)(function)
+
+
+# Type codes used in the kernel
+_new_snow = ice.layer_type_codes['new_snow']
+_snow = ice.layer_type_codes['snow']
+_slush = ice.layer_type_codes['slush']
+_slush_ice = ice.layer_type_codes['slush_ice']
+_black_ice = ice.layer_type_codes['black_ice']
+_water = ice.layer_type_codes['water']
+
+# Layer tables pr type code as arrays. Values not given (None) are nan.
+_enums = np.array(ice.layer_enums, dtype=np.int64)
+_densities = np.array([np.nan if d is None else d for d in ice.layer_densities], dtype=np.float64)
+_conductivities = np.array([np.nan if k is None else k for k in ice.layer_conductivities], dtype=np.float64)
+
+# Flags returned by the kernel for the messages logged by the python model
+UNKNOWN_MELT_LAYER = 1
+UNKNOWN_CONDUCTANCE_ENUM = 2
+NO_MELT_ENERGY = 4
+
+# The kernel may add up to three layers in a time step (new snow, slush and ice)
+_extra_capacity = 4
+
+
+@_jit
+def _set_type(types, densities, conductivities, i, type_code):
+    types[i] = type_code
+    densities[i] = _densities[type_code]
+    conductivities[i] = _conductivities[type_code]
+
+
+@_jit
+def _insert_layer(types, heights, densities, conductivities, temps, temps_top, temps_bottom, n, index, type_code, height):
+    for j in range(n, index, -1):
+        types[j] = types[j-1]
+        heights[j] = heights[j-1]
+        densities[j] = densities[j-1]
+        conductivities[j] = conductivities[j-1]
+        temps[j] = temps[j-1]
+        temps_top[j] = temps_top[j-1]
+        temps_bottom[j] = temps_bottom[j-1]
+    _set_type(types, densities, conductivities, index, type_code)
+    heights[index] = height
+    temps[index] = np.nan
+    temps_top[index] = np.nan
+    temps_bottom[index] = np.nan
+    return n + 1
+
+
+@_jit
+def _remove_layer(types, heights, densities, conductivities, temps, temps_top, temps_bottom, n, index):
+    for j in range(index, n-1):
+        types[j] = types[j+1]
+        heights[j] = heights[j+1]
+        densities[j] = densities[j+1]
+        conductivities[j] = conductivities[j+1]
+        temps[j] = temps[j+1]
+        temps_top[j] = temps_top[j+1]
+        temps_bottom[j] = temps_bottom[j+1]
+    return n - 1
+
+
+@_jit
+def _add_layer_conductance_to_total(u_total, k, h, layer_enum):
+    """As ice.add_layer_conductance_to_total, but with nan for u_total not given. Returns the total and a flag."""
+
+    flags = 0
+    if layer_enum == 10:
+        surface_k_reduction = const.surface_k_reduction_black_ice
+        h_min_for_conductivity = const.h_min_for_conductivity_black_ice
+    elif layer_enum == 11:
+        surface_k_reduction = const.surface_k_reduction_slush_ice
+        h_min_for_conductivity = const.h_min_for_conductivity_slush_ice
+    elif layer_enum >= 20:
+        surface_k_reduction = const.surface_k_reduction_snow
+        h_min_for_conductivity = const.h_min_for_conductivity_snow
+    else:
+        flags = UNKNOWN_CONDUCTANCE_ENUM
+        surface_k_reduction = const.surface_k_reduction_black_ice
+        h_min_for_conductivity = const.h_min_for_conductivity_black_ice
+
+    u_max = const.k_black_ice * const.surface_k_reduction_black_ice / const.h_min_for_conductivity_black_ice
+
+    if h == 0 and math.isnan(u_total):
+        u_total = u_max
+    else:
+        if math.isnan(u_total):
+            if h <= h_min_for_conductivity:
+                u_total = k * surface_k_reduction / h
+            else:
+                u_total = u_max
+                u_total = 1/(1/u_total+(h-h_min_for_conductivity)/k)
+        else:
+            u_total = 1/(1/u_total + h/k)
+
+    if u_total > u_max:
+        u_total = u_max
+
+    return u_total, flags
+
+
+@_jit
+def _draft_thickness(types, heights, n):
+    draft_thickness = 0.
+    for i in range(n):
+        if draft_thickness == 0 and _enums[types[i]] >= 20:
+            continue
+        draft_thickness = draft_thickness + heights[i]
+    return draft_thickness
+
+
+@_jit
+def _water_line(heights, densities, n):
+    column_mass = 0.
+    for i in range(n):
+        column_mass = column_mass + heights[i] * densities[i]
+    return column_mass / const.rho_water
+
+
+@_jit
+def _total_column_height(heights, n):
+    total_height = 0.
+    for i in range(n):
+        total_height += heights[i]
+    return total_height
+
+
+@_jit
+def _merge_and_remove_excess_layers(types, heights, densities, conductivities, temps, temps_top, temps_bottom, n):
+    """As IceColumn.merge_and_remove_excess_layers. Returns the new number of layers."""
+
+    kept = 0
+    for i in range(n):
+        if heights[i] == 0.:
+            continue
+        last = kept - 1
+        if kept > 0 and types[i] == types[last]:
+            height_sum = heights[last] + heights[i]
+            if not math.isnan(temps[last]) and not math.isnan(temps[i]):
+                temps[last] = (heights[last] * temps[last] + heights[i] * temps[i]) / height_sum
+            if not math.isnan(densities[last]) and not math.isnan(densities[i]):
+                densities[last] = (heights[last] * densities[last] + heights[i] * densities[i]) / height_sum
+            if not math.isnan(conductivities[last]) and not math.isnan(conductivities[i]):
+                conductivities[last] = (heights[last] * conductivities[last] + heights[i] * conductivities[i]) / height_sum
+            heights[last] = height_sum
+        else:
+            types[kept] = types[i]
+            heights[kept] = heights[i]
+            densities[kept] = densities[i]
+            conductivities[kept] = conductivities[i]
+            temps[kept] = temps[i]
+            temps_top[kept] = temps_top[i]
+            temps_bottom[kept] = temps_bottom[i]
+            kept += 1
+
+    return kept
+
+
+@_jit
+def _update_slush_level(types, heights, densities, conductivities, temps, temps_top, temps_bottom, n, in_slush_event):
+    """As IceColumn.update_slush_level. Returns the number of layers and in_slush_event."""
+
+    dh_slush = _water_line(heights, densities, n) - _draft_thickness(types, heights, n)
+
+    if dh_slush > const.min_slush_change:
+        in_slush_event = True
+        dh_slush = dh_slush + const.snow_pull_on_water
+
+        index = 0
+        for i in range(n):
+            if _enums[types[i]] >= 20:
+                index = i
+
+        while dh_slush > 0 and index >= 0:
+            snow_to_slush_ratio = densities[index] / (const.rho_slush_ice * const.part_ice_in_slush)
+
+            if dh_slush > heights[index] * snow_to_slush_ratio:
+                _set_type(types, densities, conductivities, index, _slush)
+                heights[index] = heights[index] * snow_to_slush_ratio
+                dh_slush = dh_slush - heights[index]
+                index = index - 1
+            else:
+                heights[index] = heights[index] - dh_slush / snow_to_slush_ratio
+                n = _insert_layer(types, heights, densities, conductivities, temps, temps_top, temps_bottom,
+                                  n, index + 1, _slush, dh_slush)
+                index = -1
+
+    n = _merge_and_remove_excess_layers(types, heights, densities, conductivities, temps, temps_top, temps_bottom, n)
+    return n, in_slush_event
+
+
+@_jit
+def _merge_snow_layers_and_compress(types, heights, densities, conductivities, temps, temps_top, temps_bottom, n, temp_atm,
+                                    time_step):
+    """As IceColumn.merge_snow_layers_and_compress. Returns the number of layers."""
+
+    if n > 0:
+        if types[0] == _new_snow:
+            types[0] = _snow
+
+        n = _merge_and_remove_excess_layers(types, heights, densities, conductivities, temps, temps_top, temps_bottom, n)
+
+        if n > 0 and types[0] == _snow:
+            if temp_atm < const.temp_f:
+                C1 = 7.0 * 1e-3 * 12
+                C2 = -21.0 * 1e-3
+                C3 = -0.04
+                delta_rho_snow = densities[0] ** 2 * C1 * heights[0] * math.exp(C2 * densities[0]) * math.exp(C3 * temp_atm)
+                delta_rho_snow *= time_step / (60*60*24)
+                rho_snow_old = densities[0]
+                rho_snow_new = rho_snow_old + delta_rho_snow
+
+                # as parameterization.k_snow_from_rho_snow
+                rho_snow = max(100., rho_snow_new)
+                k_snow_new = 2.85*10**-6 * rho_snow * rho_snow
+            else:
+                rho_snow_old = densities[0]
+                rho_snow_new = const.rho_snow_max
+                k_snow_new = const.k_snow_max
+
+            densities[0] = min(rho_snow_new, const.rho_snow_max)
+            conductivities[0] = min(k_snow_new, const.k_snow_max)
+            heights[0] = heights[0] / densities[0] * rho_snow_old
+
+    return n
+
+
+@_jit
+def _update_column_temperatures(types, heights, conductivities, temps, temps_top, temps_bottom, n, temp_sfc):
+    """As IceColumn.update_column_temperatures with the tridiagonal system solved as in ice.solve_tridiagonal."""
+
+    num_dry_layers = 0
+    for i in range(n):
+        if _enums[types[i]] > 9:
+            num_dry_layers += 1
+        else:
+            break
+
+    num_boundaries = num_dry_layers - 1
+    temp_top = temp_sfc
+    temp_bottom = const.temp_f
+
+    for i in range(n):
+        temps[i] = 0.
+        temps_top[i] = 0.
+        temps_bottom[i] = 0.
+
+    if num_boundaries == 0:
+        temps[0] = (temp_top + temp_bottom) / 2
+        temps_top[0] = temp_top
+        temps_bottom[0] = temp_bottom
+
+    elif num_boundaries > 0:
+        kh = np.empty(num_dry_layers)
+        for i in range(num_dry_layers):
+            kh[i] = conductivities[i] * heights[i]
+
+        bb = np.zeros(num_boundaries)
+        bb[0] = temp_top * kh[0]
+        if num_boundaries > 1:
+            bb[num_boundaries-1] = temp_bottom * kh[num_boundaries]
+
+        # Thomas algorithm. Diagonal is kh[i] + kh[i+1], lower -kh[i] and upper -kh[i+1].
+        upper_prime = np.zeros(num_boundaries)
+        rhs_prime = np.zeros(num_boundaries)
+        upper_prime[0] = -kh[1] / (kh[0] + kh[1])
+        rhs_prime[0] = bb[0] / (kh[0] + kh[1])
+        for i in range(1, num_boundaries):
+            denominator = (kh[i] + kh[i+1]) - -kh[i] * upper_prime[i-1]
+            upper_prime[i] = -kh[i+1] / denominator
+            rhs_prime[i] = (bb[i] - -kh[i] * rhs_prime[i-1]) / denominator
+
+        boundary_temps = np.empty(num_boundaries + 2)
+        boundary_temps[0] = temp_top
+        boundary_temps[num_boundaries+1] = temp_bottom
+        boundary_temps[num_boundaries] = rhs_prime[num_boundaries-1]
+        for i in range(num_boundaries-2, -1, -1):
+            boundary_temps[i+1] = rhs_prime[i] - upper_prime[i] * boundary_temps[i+2]
+
+        for i in range(num_boundaries + 1):
+            temps[i] = (boundary_temps[i] + boundary_temps[i+1]) / 2
+            temps_top[i] = boundary_temps[i]
+            temps_bottom[i] = boundary_temps[i+1]
+
+
+@_jit
+def step_kernel(types, heights, densities, conductivities, temps, temps_top, temps_bottom, n, in_slush_event,
+                time_step, dh_snow, temp, melt_energy):
+    """One time step of get_ice_thickness_from_surface_temp on layer arrays. The arrays must have room for
+    n + 4 layers. Temperatures and melt energy not given are nan.
+
+    :return:    (number of layers, in_slush_event, draft thickness, water line, total column height, flags,
+                type code of a layer melted with unknown melting coefficient or -1)
+    """
+
+    flags = 0
+    unknown_melt_type = -1
+    step_length = time_step
+
+    # Add new snow on top of the column if we have ice and snow and update the slush level given new snow
+    if n != 0:
+        if dh_snow != 0.:
+            n = _insert_layer(types, heights, densities, conductivities, temps, temps_top, temps_bottom,
+                              n, 0, _new_snow, dh_snow)
+        n, in_slush_event = _update_slush_level(types, heights, densities, conductivities, temps, temps_top,
+                                                temps_bottom, n, in_slush_event)
+
+    # if surface or air temperature is FREEZING
+    if temp < const.temp_f:
+
+        # If no ice, freeze water to ice
+        if n == 0:
+            u_total, f = _add_layer_conductance_to_total(np.nan, const.k_black_ice, 0., 10)
+            dh = - temp * u_total * time_step / const.rho_water / const.L_fusion
+            n = _insert_layer(types, heights, densities, conductivities, temps, temps_top, temps_bottom,
+                              n, 0, _black_ice, dh)
+
+        else:
+            u_total = np.nan
+            i = 0
+            while time_step > 0 and i <= n-1:
+
+                # Solids add to the total isolation. At the bottom, water freezes to ice.
+                if _enums[types[i]] > 9:
+                    u_total, f = _add_layer_conductance_to_total(u_total, conductivities[i], heights[i], _enums[types[i]])
+                    flags |= f
+
+                    if i == n-1:
+                        dh = - temp * u_total * time_step / const.rho_water / const.L_fusion
+                        n = _insert_layer(types, heights, densities, conductivities, temps, temps_top, temps_bottom,
+                                          n, i+1, _black_ice, dh)
+                        time_step = 0.
+
+                # Slush freezes fully or partially. Not in the same time step as the slush event.
+                elif not in_slush_event:
+
+                    if math.isnan(u_total):
+                        u_total, f = _add_layer_conductance_to_total(np.nan, const.k_slush_ice, 0., 11)
+
+                    dh = - temp * u_total * time_step / const.rho_water / const.L_fusion / (1 - const.part_ice_in_slush)
+
+                    if heights[i] < dh:
+                        _set_type(types, densities, conductivities, i, _slush_ice)
+                        time_step_used = heights[i] * const.rho_water * const.L_fusion * (1 - const.part_ice_in_slush) / -temp / u_total
+                        time_step = time_step - time_step_used
+                        heights[i] += heights[i] * (1 - const.part_ice_in_slush) * ((const.rho_water - const.rho_slush_ice) / const.rho_slush_ice)
+                        u_total, f = _add_layer_conductance_to_total(u_total, conductivities[i], heights[i], _enums[types[i]])
+                        flags |= f
+
+                    else:
+                        heights[i] -= dh
+                        dh += dh * (1 - const.part_ice_in_slush) * ((const.rho_water - const.rho_slush_ice) / const.rho_slush_ice)
+                        n = _insert_layer(types, heights, densities, conductivities, temps, temps_top, temps_bottom,
+                                          n, i, _slush_ice, dh)
+                        time_step = 0.
+
+                else:
+                    in_slush_event = False
+                    time_step = 0.
+
+                i += 1
+
+    # if surface or air temperature is MELTING
+    else:
+        if temp > 0.:
+            while time_step > 0 and n > 0:
+                if types[0] == _water:
+                    n = _remove_layer(types, heights, densities, conductivities, temps, temps_top, temps_bottom, n, 0)
+                else:
+                    if _enums[types[0]] >= 20:
+                        meltingcoeff = const.meltingcoeff_snow
+                    elif types[0] == _slush_ice:
+                        meltingcoeff = const.meltingcoeff_slush_ice
+                    elif types[0] == _slush:
+                        meltingcoeff = const.meltingcoeff_slush
+                    elif types[0] == _black_ice:
+                        meltingcoeff = const.meltingcoeff_black_ice
+                    else:
+                        flags |= UNKNOWN_MELT_LAYER
+                        unknown_melt_type = types[0]
+                        meltingcoeff = const.meltingcoeff_slush_ice
+
+                    dh = meltingcoeff * time_step * (temp - const.temp_f)
+
+                    if heights[0] < -dh:
+                        time_step_used = heights[0] / -dh * time_step
+                        n = _remove_layer(types, heights, densities, conductivities, temps, temps_top, temps_bottom, n, 0)
+                        time_step = time_step - time_step_used
+                    else:
+                        heights[0] = heights[0] + dh
+                        time_step = 0.
+
+        elif not math.isnan(melt_energy):
+            while time_step > 0 and n > 0:
+                if types[0] == _water:
+                    n = _remove_layer(types, heights, densities, conductivities, temps, temps_top, temps_bottom, n, 0)
+                else:
+                    L_ice = const.L_fusion/1000.
+                    dh = melt_energy / L_ice / densities[0] * time_step/24/60/60
+
+                    if heights[0] < -dh:
+                        time_step_used = heights[0] / -dh * time_step
+                        n = _remove_layer(types, heights, densities, conductivities, temps, temps_top, temps_bottom, n, 0)
+                        time_step = time_step - time_step_used
+                    else:
+                        heights[0] = heights[0] + dh
+                        time_step = 0.
+
+        else:
+            flags |= NO_MELT_ENERGY
+
+    n = _merge_and_remove_excess_layers(types, heights, densities, conductivities, temps, temps_top, temps_bottom, n)
+    n = _merge_snow_layers_and_compress(types, heights, densities, conductivities, temps, temps_top, temps_bottom, n, temp,
+                                        step_length)
+    draft_thickness = _draft_thickness(types, heights, n)
+    water_line = _water_line(heights, densities, n)
+    _update_column_temperatures(types, heights, conductivities, temps, temps_top, temps_bottom, n, temp)
+    total_column_height = _total_column_height(heights, n)
+
+    return n, in_slush_event, draft_thickness, water_line, total_column_height, flags, unknown_melt_type
+
+
+def can_step(ice_column):
+    """The kernel steps ArrayIceColumns without layer metadata, which is not kept by the kernel. The constants
+    are compiled into the kernel, so only columns with the default parameters are stepped."""
+
+    return isinstance(ice_column, ice.ArrayIceColumn) and not any(ice_column.layer_metadata) and \
+        ice_column.parameters == mpar.default_parameters
+
+
+def step_array_ice_column(ic, time_step, dh_snow, temp, melt_energy=None):
+    """get_ice_thickness_from_surface_temp on an ArrayIceColumn done by the kernel. See can_step.
+
+    :param ic:          [ArrayIceColumn] Ice column at the beginning of the time step.
+    :param time_step:   In seconds. 60*60*24 = 86400 is 24hrs
+    :param dh_snow:     New snow in period of time step. Given as float in SI units [m]
+    :param temp:        Average temperature in period of time step. Given i C as float.
+    :param melt_energy: Energy for melting when the surface temperature is 0C (energy balance).
+    :return:            Ice column at end of time step
+    """
+
+    ic.time_step_forward(time_step)
+
+    n = len(ic.heights)
+    capacity = n + _extra_capacity
+    arrays = []
+    for name in ic.layer_arrays:
+        array = np.empty(capacity, dtype=np.int64 if name == 'type_codes' else np.float64)
+        array[:n] = getattr(ic, name)
+        arrays.append(array)
+
+    n, in_slush_event, draft_thickness, water_line, total_column_height, flags, unknown_melt_type = step_kernel(
+        *arrays, n, bool(ic.in_slush_event), float(time_step), float(dh_snow), float(temp),
+        np.nan if melt_energy is None else float(melt_energy))
+
+    if flags & UNKNOWN_CONDUCTANCE_ENUM:
+        ml.log_and_print("[warning] icekernel.py -> step_array_ice_column: Unknown layer enum in conductance.")
+    if flags & UNKNOWN_MELT_LAYER:
+        ml.log_and_print("[info] icekernel.py -> step_array_ice_column: Melting on unknown layer type: {0}. Using slush_ice coeff."
+                         .format(ice.layer_types[unknown_melt_type]))
+    if flags & NO_MELT_ENERGY:
+        ml.log_and_print("[info] icekernel.py -> step_array_ice_column: Need either energy or positive temperatures in model to melt snow and ice.")
+
+    for name, array in zip(ic.layer_arrays, arrays):
+        setattr(ic, name, array[:n].astype(getattr(ic, name).dtype))
+    ic.layer_metadata = [{} for i in range(n)]
+    ic.in_slush_event = bool(in_slush_event)
+    ic.layers_changed()
+
+    ic.set_cached_value('draft_thickness', draft_thickness, is_computed=True)
+    ic.set_cached_value('water_line', water_line, is_computed=True)
+    ic.set_cached_value('total_column_height', total_column_height, is_computed=True)
+    ic.set_surface_temperature(temp)
+
+    return ic
+
+
+if __name__ == "__main__":
+
+    import datetime as dt
+    from icemodelling import icekernel as ik
+    from icemodelling import icethickness as it
+
+    def layer_values(ice_column):
+        return [(l.type, l.height, l.density, l.conductivity, l.temperature) for l in ice_column.column]
+
+    # The kernel is checked against the python model on a season with freezing, slush events and melt.
+    # Without Numba the kernel runs as python.
+    dates = [dt.datetime(2018, 11, 1) + dt.timedelta(days=i) for i in range(200)]
+    temps = [-4. + 7. * math.sin(i / 9.) for i in range(200)]
+    snow = [0.04 if i % 6 == 0 else 0. for i in range(200)]
+    snow[20] = 0.4
+
+    first_ice = ice.IceColumn(dates[0], [ice.IceLayer(0.05, 'snow'), ice.IceLayer(0.04, 'slush'),
+                                         ice.IceLayer(0.1, 'slush_ice'), ice.IceLayer(0.1, 'black_ice')])
+    python_column = first_ice.copy()
+    kernel_column = ice.ArrayIceColumn.from_ice_column(first_ice)
+    python_ice_cover = [first_ice.copy()]
+    slush_events = freezing_days = melting_days = 0
+
+    for i in range(len(dates)):
+        draft_thickness = python_column.draft_thickness
+        it.get_ice_thickness_from_surface_temp(python_column, 60*60*24, snow[i], temps[i])
+        step_array_ice_column(kernel_column, 60*60*24, snow[i], temps[i])
+        python_ice_cover.append(python_column.copy())
+
+        slush_events += python_column.in_slush_event
+        freezing_days += python_column.draft_thickness > draft_thickness
+        melting_days += python_column.draft_thickness < draft_thickness
+
+        assert python_column.date == kernel_column.date
+        assert python_column.in_slush_event == kernel_column.in_slush_event
+        assert python_column.draft_thickness == kernel_column.draft_thickness
+        assert layer_values(python_column) == layer_values(kernel_column)
+
+    assert slush_events > 0 and freezing_days > 0 and melting_days > 0
+
+    # The air temperature driver steps array columns by the kernel when it is compiled. It is checked both ways,
+    # and without Numba the kernel runs as python when is_compiled is set.
+    numba_is_compiled = ik.is_compiled
+    for ik.is_compiled in (False, True):
+        ice_cover = it.calculate_ice_cover_air_temp(first_ice, dates, temps, snow)
+        assert isinstance(ice_cover[-1], ice.ArrayIceColumn) == ik.is_compiled
+        assert [(c.date, c.draft_thickness, layer_values(c)) for c in ice_cover] == \
+               [(c.date, c.draft_thickness, layer_values(c)) for c in python_ice_cover]
+    ik.is_compiled = numba_is_compiled
+
+    print('Kernel is compiled: {}. Draft thickness {}. Slush events {}, freezing days {}, melting days {}.'.format(
+        is_compiled, kernel_column.draft_thickness, slush_events, freezing_days, melting_days))
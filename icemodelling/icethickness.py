@@ -3,19 +3,25 @@
 weather affect an ice column. The inner workings of the ice column is part of the IceColumn class fount in ice.py."""
 
 import math
-import copy
+import bisect
+import itertools
 import numpy as np
-from icemodelling import parameterization as dp, constants as const
+from icemodelling import parameterization as dp
 from experimental import energybalance as deb
 from icemodelling import ice as ice
+from icemodelling import icekernel as ik
+from icemodelling import icetrajectory as itr
 from utilities import makelogs as ml
 
 
 __author__ = 'raek'
 
 
-def calculate_ice_cover_air_temp(inn_column_inn, date, temp, dh_sno, cloud_cover=None, time_step=60*60*24):
-    """
+def calculate_ice_cover_air_temp(inn_column_inn, date, temp, dh_sno, cloud_cover=None, time_step=60*60*24,
+                                 parameters=None, output_dates=None, output_every=None, summary=None):
+    """Models the ice cover with air temperature as surface temperature. Forcing before the date of the initial
+    ice column is skipped, and on open water only the date and surface temperature are stepped forward until the
+    first day with freezing temperatures.
 
     :param inn_column_inn:  [IceThickness] Initial ice column for modelling.
     :param date:            [] dates for plotting
@@ -23,45 +29,397 @@ def calculate_ice_cover_air_temp(inn_column_inn, date, temp, dh_sno, cloud_cover
     :param dh_sno:          [] new snow over the period (day)
     :param cloud_cover:
     :param time_step:       [int] fixed time step of 24hrs given in seconds
-    :return:
+    :param parameters:      [ModelParameters] Model constants. Default is the parameters of the initial ice column.
+    :param output_dates:    [list of date] Optional. Only columns on these days are kept.
+    :param output_every:    [int] Optional. Only every n-th column is kept, counted from the initial column.
+                            See icetrajectory.make_output_selection.
+    :param summary:         [IceCoverSummary] Optional. All modelled columns are added to it, also those not kept.
+    :return:                [list of IceColumn] The initial ice column and the ice column after each day, or those
+                            selected by output_dates and output_every.
+    """
+
+    return list(iterate_ice_cover_air_temp(inn_column_inn, date, temp, dh_sno, cloud_cover=cloud_cover,
+                                           time_step=time_step, parameters=parameters, output_dates=output_dates,
+                                           output_every=output_every, summary=summary))
+
+
+def iterate_ice_cover_air_temp(inn_column_inn, date, temp, dh_sno, cloud_cover=None, time_step=60*60*24,
+                               parameters=None, copy_columns=True, output_dates=None, output_every=None,
+                               summary=None):
+    """Generator version of calculate_ice_cover_air_temp. The initial ice column and the ice column after each day
+    are yielded as they are modelled, so a long run may be plotted, exported or validated day by day without
+    keeping all days in memory.
+
+    :param copy_columns:    [bool] If True, each column yielded is a snapshot. If False, the modelled column itself
+                            is yielded and it changes when the next day is modelled. This saves the copy when
+                            the column is used before the next is requested.
+    See calculate_ice_cover_air_temp for the other parameters.
     """
 
-    inn_column = copy.deepcopy(inn_column_inn)
+    inn_column = inn_column_inn.copy()
+    if parameters is not None:
+        inn_column.parameters = parameters
     inn_column.update_water_line()
     inn_column.remove_metadata()
     inn_column.remove_time()
 
-    ice_cover = []
+    # With Numba installed, the column is modelled as an ArrayIceColumn so it is stepped by the compiled kernel
+    if ik.is_compiled and not isinstance(inn_column, ice.ArrayIceColumn):
+        array_column = ice.ArrayIceColumn.from_ice_column(inn_column)
+        if ik.can_step(array_column):
+            inn_column = array_column
+
+    is_output = itr.make_output_selection(output_dates, output_every)
+    number = 0
+    yield from _select_output(inn_column, number, is_output, summary, copy_columns)
 
     if cloud_cover is None:
         cloud_cover = [None] * len(date)
 
-    ice_cover.append(copy.deepcopy(inn_column))
+    # Cloudless sky gives a lower surface temperature
+    temp_surf = [dp.temperature_from_temperature_and_clouds(t, c) if c is not None else t
+                 for t, c in zip(temp, cloud_cover)]
 
-    for i in range(0, len(date), 1):
+    # Days that may freeze open water
+    freezing_days = np.flatnonzero(np.asarray(temp_surf, dtype=float) < inn_column.parameters.temp_f)
 
-        # if date is before the initial ice column, step forward
+    # Dates before the initial ice column are not modelled
+    i = bisect.bisect_left(date, inn_column.date)
+
+    while i < len(date):
+
+        # if date is before the ice column, step forward
         if date[i] < inn_column.date:
             i += 1
+            continue
+
+        # The ice column is stepped forward in place and the state is yielded for each day
+        inn_column = get_ice_thickness_from_surface_temp(inn_column, time_step, dh_sno[i], temp_surf[i])
+        number += 1
+        yield from _select_output(inn_column, number, is_output, summary, copy_columns)
+        i += 1
+
+        # Open water stays open until the first freezing day. Only the date and surface temperature change.
+        if len(inn_column.column) == 0:
+            next_freezing_day = freezing_days[np.searchsorted(freezing_days, i):][:1]
+            ice_free_end = next_freezing_day[0] if len(next_freezing_day) > 0 else len(date)
+            while i < ice_free_end:
+                if date[i] >= inn_column.date:
+                    inn_column.time_step_forward(time_step)
+                    inn_column.set_surface_temperature(temp_surf[i])
+                    number += 1
+                    yield from _select_output(inn_column, number, is_output, summary, copy_columns)
+                i += 1
+
+
+def calculate_ice_cover_air_temp_adaptive(inn_column_inn, date, temp, dh_sno, cloud_cover=None,
+                                          max_time_step=60*60*24, freeze_up_thickness=0.05, fast_forward_error=None,
+                                          parameters=None, output_dates=None, output_every=None, summary=None):
+    """Models the ice cover from forcing of any resolution, e.g. hourly or 3-hourly, with a time step that adapts
+    to the state of the ice. Stable spells take long time steps where the forcing over several intervals is
+    averaged. Freeze-up, new snow, slush and shifts between freezing and melting are stepped once pr forcing
+    interval.
+
+    Note that the model is made for daily time steps. The melting and freezing scale with the time step, but
+    e.g. a slush event holds back freezing one time step whatever its length.
+
+    An interval may be part of a long time step if
+        - there is no new snow in it,
+        - it is not the first interval after a shift between freezing and melting,
+        - the surface temperature is on the same side of freezing as the first interval in the time step,
+        - the ice column has no slush and is not in a slush event, and
+        - the lake is ice free and the temperature is above freezing, or the ice is thicker than freeze_up_thickness.
+
+    If fast_forward_error is given, cold spells where only the ice at the bottom grows are integrated in one
+    time step of any length, see get_freezing_spell_length and get_ice_thickness_from_freezing_spell.
+
+    Long time steps and fast forwarded spells end on the days in output_dates, so each of these days has a column
+    if the forcing has an interval starting on it.
+
+    :param inn_column_inn:      [IceColumn] Initial ice column for modelling.
+    :param date:                [list of datetime] Start of each forcing interval. The intervals are given by
+                                the dates and the last interval is as long as the one before.
+    :param temp:                [list] Temperature pr interval.
+    :param dh_sno:              [list] New snow pr interval [m].
+    :param cloud_cover:         [list] Cloud cover pr interval. Optional.
+    :param max_time_step:       [int] Longest time step in seconds.
+    :param freeze_up_thickness: [float] Below this draft thickness [m] the ice is stepped once pr interval.
+    :param fast_forward_error:  [float] Largest error [m] in the ice growth of a fast forwarded cold spell compared
+                                to stepping the spell once pr interval. Default None does not fast forward.
+    :param parameters:          [ModelParameters] Model constants. Default is the parameters of the initial ice column.
+    :param output_dates:        [list of date] Optional. Only columns on these days are kept.
+    :param output_every:        [int] Optional. Only every n-th column is kept, counted from the initial column.
+                                See icetrajectory.make_output_selection.
+    :param summary:             [IceCoverSummary] Optional. All modelled columns are added to it.
+    :return:                    [list of IceColumn] The initial column and the column after each time step, or those
+                                selected by output_dates and output_every.
+    """
+
+    return list(iterate_ice_cover_air_temp_adaptive(
+        inn_column_inn, date, temp, dh_sno, cloud_cover=cloud_cover, max_time_step=max_time_step,
+        freeze_up_thickness=freeze_up_thickness, fast_forward_error=fast_forward_error, parameters=parameters,
+        output_dates=output_dates, output_every=output_every, summary=summary))
+
+
+def iterate_ice_cover_air_temp_adaptive(inn_column_inn, date, temp, dh_sno, cloud_cover=None,
+                                        max_time_step=60*60*24, freeze_up_thickness=0.05, fast_forward_error=None,
+                                        parameters=None, copy_columns=True, output_dates=None, output_every=None,
+                                        summary=None):
+    """Generator version of calculate_ice_cover_air_temp_adaptive. The initial ice column and the ice column after
+    each time step are yielded as they are modelled.
+
+    :param copy_columns:    [bool] If True, each column yielded is a snapshot. If False, the modelled column itself
+                            is yielded and it changes when the next time step is modelled.
+    See calculate_ice_cover_air_temp_adaptive for the other parameters.
+    """
+
+    inn_column = inn_column_inn.copy()
+    if parameters is not None:
+        inn_column.parameters = parameters
+    inn_column.update_water_line()
+    inn_column.remove_metadata()
+    inn_column.remove_time()
+
+    temp_f = inn_column.parameters.temp_f
+    time_steps = get_forcing_time_steps(date)
 
-        # else calculate ice evolution
+    if cloud_cover is None:
+        cloud_cover = [None] * len(date)
+
+    # Cloudless sky gives a lower surface temperature
+    temp_surf = [dp.temperature_from_temperature_and_clouds(t, c) if c is not None else t
+                 for t, c in zip(temp, cloud_cover)]
+
+    is_output = itr.make_output_selection(output_dates, output_every)
+    output_days = itr.get_output_days(output_dates)
+    number = 0
+    yield from _select_output(inn_column, number, is_output, summary, copy_columns)
+
+    i = 0
+    while i < len(date):
+
+        # if date is before the initial ice column, step forward
+        if date[i] < inn_column.date:
+            i += 1
+            continue
+
+        is_freezing = temp_surf[i] < temp_f
+        is_shift = i > 0 and (temp_surf[i-1] < temp_f) != is_freezing
+        j = i + 1
+
+        # Cold spells with constant conductance have a closed form solution
+        if fast_forward_error is not None and is_freezing:
+            spell_length = get_freezing_spell_length(
+                inn_column, itertools.islice(time_steps, i, None), itertools.islice(temp_surf, i, None),
+                itertools.islice(dh_sno, i, None), fast_forward_error)
+            if spell_length > 1:
+                j = _end_on_output_day(date, i, i + spell_length, output_days, inn_column.date)
+                inn_column = get_ice_thickness_from_freezing_spell(inn_column, time_steps[i:j], temp_surf[i:j])
+                number += 1
+                yield from _select_output(inn_column, number, is_output, summary, copy_columns)
+                i = j
+                continue
+
+        if dh_sno[i] == 0. and not is_shift and _is_stable_ice_column(inn_column, is_freezing, freeze_up_thickness):
+            step_length = time_steps[i]
+            while j < len(date) and dh_sno[j] == 0. and (temp_surf[j] < temp_f) == is_freezing \
+                    and step_length + time_steps[j] <= max_time_step:
+                step_length += time_steps[j]
+                j += 1
+            j = _end_on_output_day(date, i, j, output_days, inn_column.date)
+
+        # Mean temperature over the intervals in the time step
+        if j == i + 1:
+            time_step, temp_step = time_steps[i], temp_surf[i]
         else:
+            time_step = sum(time_steps[i:j])
+            temp_step = sum(t * s for t, s in zip(temp_surf[i:j], time_steps[i:j])) / time_step
+
+        # The ice column is stepped forward in place and the state is yielded for each time step
+        inn_column = get_ice_thickness_from_surface_temp(inn_column, time_step, dh_sno[i], temp_step)
+        number += 1
+        yield from _select_output(inn_column, number, is_output, summary, copy_columns)
+        i = j
+
+
+def _end_on_output_day(date, i, j, output_days, column_date):
+    """The end of a time step over the forcing intervals i to j (not included) in the adaptive driver. The time step
+    is shortened to end at the first interval starting on an output day after the day of the ice column, so that
+    the output day is not passed without a column.
+
+    :param date:            [list of datetime] Start of each forcing interval.
+    :param i, j:            [int] First interval in the time step and the interval after the last.
+    :param output_days:     [set of date] See icetrajectory.get_output_days.
+    :param column_date:     [datetime] Date of the ice column at the start of the time step.
+    :return:                [int] The interval after the last in the time step.
+    """
+
+    if output_days:
+        column_day = column_date.date()
+        for k in range(i + 1, j):
+            day = date[k].date()
+            if day > column_day and day in output_days:
+                return k
+
+    return j
 
-            # Cloudless sky gives a lower surface temperature
-            if cloud_cover[i] is not None:
-                temp_surf = dp.temperature_from_temperature_and_clouds(temp[i], cloud_cover[i])
-            else:
-                temp_surf = temp[i]
 
-            out_column = get_ice_thickness_from_surface_temp(inn_column, time_step, dh_sno[i], temp_surf)
-            inn_column = copy.deepcopy(out_column)
-            ice_cover.append(out_column)
+def _select_output(ice_column, number, is_output, summary, copy_columns):
+    """A modelled column as output of the drivers. The column is added to the summary, if any, and is returned in
+    a tuple if it is selected as output, else an empty tuple is returned."""
 
-    return ice_cover
+    if summary is not None:
+        summary.add_ice_column(ice_column)
+    if not is_output(ice_column.date, number):
+        return ()
+    return (ice_column.copy() if copy_columns else ice_column),
+
+
+def get_forcing_time_steps(date, default_time_step=60*60*24):
+    """Length of the forcing intervals starting at the given dates. The last interval is as long as the one
+    before, or the default if there is only one date.
+
+    :param date:                [list of datetime] Start of each forcing interval.
+    :param default_time_step:   [int] In seconds.
+    :return:                    [list of float] Seconds pr interval.
+    """
+
+    time_steps = [(d2 - d1).total_seconds() for d1, d2 in zip(date[:-1], date[1:])]
+    if len(date) > 0:
+        time_steps.append(time_steps[-1] if time_steps else float(default_time_step))
+
+    return time_steps
+
+
+def get_freezing_spell_length(ic, time_steps, temps, dh_snow, max_error=0.001):
+    """Number of time steps from now that may be integrated in one go by get_ice_thickness_from_freezing_spell.
+
+    In a cold spell without new snow, the ice grows at the bottom and all else in the ice column is as before if
+    there is no slush or water, the snow on top is fully compacted and the ice is not thin. The conductance
+    U = 1/(R + dh/k) then only depends on the growth dh of black ice, and the growth is given by the Stefan law.
+
+    Stepping the spell one time step at a time is the explicit Euler method on the Stefan law, which gives more
+    growth than the closed form. The difference is at most sum(F**2) / (2*k*R**3), where F = -temp * time_step /
+    rho_water / L_fusion pr time step. The spell is made so the difference is less than max_error.
+
+    :param ic:          [IceColumn] Ice column at the start of the spell.
+    :param time_steps:  [iterable] Seconds pr time step from now.
+    :param temps:       [iterable] Surface temperature pr time step.
+    :param dh_snow:     [iterable] New snow pr time step.
+    :param max_error:   [float] Largest difference [m] to stepping one time step at a time.
+    :return:            [int] Number of time steps in the spell. 0 if the ice column may change in other ways.
+    """
+
+    u_total = _get_conductance_in_freezing_spell(ic)
+    if u_total is None:
+        return 0
+
+    p = ic.parameters
+    resistance = 1 / u_total
+    error = 0.
+    spell_length = 0
+
+    for time_step, temp, dh in zip(time_steps, temps, dh_snow):
+        if temp >= p.temp_f or dh != 0.:
+            break
+        freezing = - temp * time_step / p.rho_water / p.L_fusion
+        error += freezing ** 2 / (2 * p.k_black_ice * resistance ** 3)
+        if error > max_error:
+            break
+        spell_length += 1
+
+    return spell_length
+
+
+def get_ice_thickness_from_freezing_spell(ic, time_steps, temps):
+    """Steps the ice column through a cold spell found by get_freezing_spell_length in one go.
+
+    With R the resistance (1/U) of the column at the start and F the sum of -temp * time_step / rho_water /
+    L_fusion over the spell, the growth dh of black ice at the bottom solves R*dh + dh**2/(2*k_black_ice) = F.
+
+    :param ic:          [IceColumn] Ice column at the beginning of the spell.
+    :param time_steps:  [list] Seconds pr time step.
+    :param temps:       [list] Surface temperature pr time step.
+    :return:            Ice column at the end of the spell.
+    """
+
+    p = ic.parameters
+    u_total = _get_conductance_in_freezing_spell(ic)
+    k_resistance = p.k_black_ice / u_total
+    freezing = sum(- t * s for t, s in zip(temps, time_steps)) / p.rho_water / p.L_fusion
+
+    # The root of the Stefan law, written so there is no loss of precision when the growth is small
+    dh = 2 * p.k_black_ice * freezing / (k_resistance + math.sqrt(k_resistance ** 2 + 2 * p.k_black_ice * freezing))
+
+    ic.time_step_forward(sum(time_steps))
+    ic.add_layer_at_index(len(ic.column), ice.IceLayer(dh, 'black_ice', p))
+
+    ic.merge_and_remove_excess_layers()
+    ic.merge_snow_layers_and_compress(temps[-1], time_steps[-1])
+    ic.update_draft_thickness()
+    ic.update_water_line()
+    ic.update_column_temperatures(temps[-1])
+    ic.update_total_column_height()
+    ic.set_surface_temperature(temps[-1])
+
+    return ic
+
+
+def _get_conductance_in_freezing_spell(ic):
+    """Total conductance of an ice column that stays the same through a cold spell but for the ice growth at the
+    bottom. None if the column may change in other ways, i.e. if there is slush or water, a slush event, new snow,
+    snow that is still compacting, thin ice at the surface or if the conductance is at its max."""
+
+    p = ic.parameters
+    if len(ic.column) == 0 or ic.in_slush_event:
+        return None
+
+    top, bottom = ic.column[0], ic.column[-1]
+    if top.type == 'new_snow':
+        return None
+    if top.type == 'snow' and (top.density < p.rho_snow_max or top.conductivity != p.k_snow_max):
+        return None
+    if bottom.type == 'black_ice' and bottom.conductivity != p.k_black_ice:
+        return None
+    if len(ic.column) == 1 and bottom.type == 'black_ice' and bottom.height <= p.h_min_for_conductivity_black_ice:
+        return None
+
+    u_total = None
+    for layer in ic.column:
+        if layer.get_enum() <= 9:   # slush or water
+            return None
+        u_total = ice.add_layer_conductance_to_total(u_total, layer.conductivity, layer.height, layer.get_enum(),
+                                                     parameters=p)
+
+    u_max = p.k_black_ice * p.surface_k_reduction_black_ice / p.h_min_for_conductivity_black_ice
+    if u_total >= u_max:
+        return None
+
+    # Snow that may press the ice under water gives a slush event
+    ic.update_draft_thickness()
+    ic.update_water_line()
+    if ic.water_line - ic.draft_thickness > p.min_slush_change:
+        return None
+
+    return u_total
+
+
+def _is_stable_ice_column(ice_column, is_freezing, freeze_up_thickness):
+    """An ice column may take long time steps if there is no slush and it is either ice free on a warm
+    spell or has ice thicker than freeze up."""
+
+    if ice_column.in_slush_event or any(layer.type == 'slush' for layer in ice_column.column):
+        return False
+    if len(ice_column.column) == 0:
+        return not is_freezing
+
+    ice_column.update_draft_thickness()
+    return ice_column.draft_thickness >= freeze_up_thickness
 
 
 def calculate_ice_cover_eb(
-        utm33_x, utm33_y, date, temp_atm, prec, prec_snow, cloud_cover, wind, rel_hum, pressure_atm, inn_column=None):
+        utm33_x, utm33_y, date, temp_atm, prec, prec_snow, cloud_cover, wind, rel_hum, pressure_atm, inn_column=None,
+        age_factor_tau=0., albedo_prim=None, parameters=None, temp_surface=None):
     """
 
     :param utm33_x:
@@ -73,21 +431,54 @@ def calculate_ice_cover_eb(
     :param cloud_cover:
     :param wind:
     :param inn_column:
-    :return:
+    :param age_factor_tau:  [float] Snow age factor at the start. Given when continuing an earlier run.
+    :param albedo_prim:     [float] Albedo at the start. Given when continuing an earlier run. Default is the
+                            albedo of black ice.
+    :param parameters:      [ModelParameters] Model constants. Default is the parameters of the initial ice column.
+    :param temp_surface:    [float] Surface temperature the day before the start, the first guess of surface
+                            temperature on the first day. Given when continuing an earlier run.
+    :return:                [list of IceColumn], [list of EnergyBalanceElement] The initial ice column and the ice
+                            column after each day, and the energy balance of each day.
+    """
+
+    icecover = []
+    energy_balance = []
+
+    for ice_column, eb in iterate_ice_cover_eb(
+            utm33_x, utm33_y, date, temp_atm, prec, prec_snow, cloud_cover, wind, rel_hum, pressure_atm,
+            inn_column=inn_column, age_factor_tau=age_factor_tau, albedo_prim=albedo_prim, parameters=parameters,
+            temp_surface=temp_surface):
+        icecover.append(ice_column)
+        if eb is not None:
+            energy_balance.append(eb)
+
+    return icecover, energy_balance
+
+
+def iterate_ice_cover_eb(
+        utm33_x, utm33_y, date, temp_atm, prec, prec_snow, cloud_cover, wind, rel_hum, pressure_atm, inn_column=None,
+        age_factor_tau=0., albedo_prim=None, parameters=None, copy_columns=True, temp_surface=None):
+    """Generator version of calculate_ice_cover_eb. Yields the ice column and the energy balance of each day as
+    they are modelled. The first is the initial ice column with None as energy balance.
+
+    :param copy_columns:    [bool] If True, each column yielded is a snapshot. If False, the modelled column itself
+                            is yielded and it changes when the next day is modelled.
+    See calculate_ice_cover_eb for the other parameters.
     """
 
     if inn_column is None:
-        inn_column = ice.IceColumn(date[0], [])
+        inn_column = ice.IceColumn(date[0], [], parameters)
+    elif parameters is not None:
+        inn_column.parameters = parameters
+
+    p = inn_column.parameters
+    if albedo_prim is None:
+        albedo_prim = p.alfa_black_ice
 
-    icecover = []
     time_span_in_sec = 60*60*24     # fixed timestep of 24hrs given in seconds
     inn_column.remove_metadata()
     inn_column.remove_time()
-    icecover.append(copy.deepcopy(inn_column))
-    energy_balance = []
-
-    age_factor_tau = 0.
-    albedo_prim = const.alfa_black_ice
+    yield (inn_column.copy() if copy_columns else inn_column), None
 
     for i in range(0, len(date), 1):
         print("{0}".format(date[i]))
@@ -98,20 +489,21 @@ def calculate_ice_cover_eb(
                 utm33_x=utm33_x, utm33_y=utm33_y, ice_column=inn_column, temp_atm=temp_atm[i],
                 prec=prec[i], prec_snow=prec_snow[i], time_span_in_sec=time_span_in_sec,
                 albedo_prim=albedo_prim, age_factor_tau=age_factor_tau, wind=wind[i], cloud_cover=cloud_cover[i],
-                rel_hum=rel_hum[i], pressure_atm=pressure_atm[i])
+                rel_hum=rel_hum[i], pressure_atm=pressure_atm[i], temp_surface_start=temp_surface)
 
-            icecover.append(out_column)
-            energy_balance.append(eb)
-            inn_column = copy.deepcopy(out_column)
+            # The ice column is stepped forward in place and the state is yielded for each day
+            inn_column = out_column
+            yield (inn_column.copy() if copy_columns and inn_column is not None else inn_column), eb
 
             if eb.EB is None:
                 age_factor_tau = 0.
-                albedo_prim = const.alfa_black_ice
+                albedo_prim = p.alfa_black_ice
+                temp_surface = None
             else:
                 age_factor_tau = eb.age_factor_tau
                 albedo_prim = eb.albedo_prim
-
-    return icecover, energy_balance
+                # the surface temperature of the day before is the first guess of the next
+                temp_surface = eb.temp_surface
 
 
 def get_ice_thickness_from_surface_temp(ic, time_step, dh_snow, temp, melt_energy=None):
@@ -128,6 +520,14 @@ def get_ice_thickness_from_surface_temp(ic, time_step, dh_snow, temp, melt_energ
 
     dh_snow = float(dh_snow)
 
+    # With Numba installed, array columns are stepped by the compiled kernel.
+    if ik.is_compiled and ik.can_step(ic):
+        return ik.step_array_ice_column(ic, time_step, dh_snow, temp, melt_energy)
+
+    # Model constants of this ice column
+    p = ic.parameters
+    step_length = time_step
+
     # step the date forward one time step. We do it initially because the variable is also used and subtracted in the following calculations.
     ic.time_step_forward(time_step)
 
@@ -135,18 +535,18 @@ def get_ice_thickness_from_surface_temp(ic, time_step, dh_snow, temp, melt_energ
     # and update the slush level/buoyancy given new snow
     if len(ic.column) != 0:
         if dh_snow != 0.:
-            ic.add_layer_at_index(0, ice.IceLayer(dh_snow, 'new_snow'))
+            ic.add_layer_at_index(0, ice.IceLayer(dh_snow, 'new_snow', p))
         ic.update_slush_level()
 
     # if surface or air temperature is FREEZING
-    if temp < const.temp_f:
+    if temp < p.temp_f:
 
         # If no ice, freeze water to ice
         if len(ic.column) == 0:
             # The heat flux equation gives how much water will freeze. U_total for the equation is estimated.
-            U_total = ice.add_layer_conductance_to_total(None, const.k_black_ice, 0, 10)
-            dh = - temp * U_total * time_step / const.rho_water / const.L_fusion
-            ic.add_layer_at_index(0, ice.IceLayer(dh, 'black_ice'))
+            U_total = ice.add_layer_conductance_to_total(None, p.k_black_ice, 0, 10, parameters=p)
+            dh = - temp * U_total * time_step / p.rho_water / p.L_fusion
+            ic.add_layer_at_index(0, ice.IceLayer(dh, 'black_ice', p))
             pass
 
         else:
@@ -157,14 +557,14 @@ def get_ice_thickness_from_surface_temp(ic, time_step, dh_snow, temp, melt_energ
 
                 # If the layer is a solid, it only adds to the total isolation. Unless it is the last and water is frozen to ice.
                 if (ic.column[i].get_enum()) > 9:
-                    U_total = ice.add_layer_conductance_to_total(U_total, ic.column[i].conductivity, ic.column[i].height, ic.column[i].get_enum())
+                    U_total = ice.add_layer_conductance_to_total(U_total, ic.column[i].conductivity, ic.column[i].height, ic.column[i].get_enum(), parameters=p)
 
                     # If the layer is the last layer of solids and thus at the bottom, we get freezing at the bottom
                     if i == len(ic.column)-1:
 
                         # The heat flux equation gives how much water will freeze.
-                        dh = - temp * U_total * time_step / const.rho_water / const.L_fusion
-                        ic.add_layer_at_index(i+1, ice.IceLayer(dh, 'black_ice'))
+                        dh = - temp * U_total * time_step / p.rho_water / p.L_fusion
+                        ic.add_layer_at_index(i+1, ice.IceLayer(dh, 'black_ice', p))
                         time_step = 0
 
                 # Else the layer is a slush layer above or in the ice column and it will freeze fully or partially.
@@ -173,10 +573,10 @@ def get_ice_thickness_from_surface_temp(ic, time_step, dh_snow, temp, melt_energ
 
                     # If the total conductance is None, we are dealing with the top layer and a surface/thin ice conductance mut be defined.
                     if U_total is None:
-                        U_total = ice.add_layer_conductance_to_total(None, const.k_slush_ice, 0, 11)
+                        U_total = ice.add_layer_conductance_to_total(None, p.k_slush_ice, 0, 11, parameters=p)
 
                     # Only the water part in the slush freezes
-                    dh = - temp * U_total * time_step / const.rho_water / const.L_fusion / (1 - const.part_ice_in_slush)
+                    dh = - temp * U_total * time_step / p.rho_water / p.L_fusion / (1 - p.part_ice_in_slush)
 
                     # If a layer totaly freezes during the tieme period, the rest of the time will be used to freeze a layer further down.
                     if ic.column[i].height < dh:
@@ -184,14 +584,14 @@ def get_ice_thickness_from_surface_temp(ic, time_step, dh_snow, temp, melt_energ
                         ic.column[i].set_type('slush_ice')
 
                         # The heat flux equation sorted for time
-                        time_step_used = ic.column[i].height * const.rho_water * const.L_fusion * (1 - const.part_ice_in_slush) / -temp / U_total
+                        time_step_used = ic.column[i].height * p.rho_water * p.L_fusion * (1 - p.part_ice_in_slush) / -temp / U_total
                         time_step = time_step - time_step_used
 
                         # Layer height increases when water in the layer freezes
-                        ic.column[i].height += ic.column[i].height * (1 - const.part_ice_in_slush) * ((const.rho_water - const.rho_slush_ice) / const.rho_slush_ice)
+                        ic.column[i].height += ic.column[i].height * (1 - p.part_ice_in_slush) * ((p.rho_water - p.rho_slush_ice) / p.rho_slush_ice)
 
                         # Update conductance
-                        U_total = ice.add_layer_conductance_to_total(U_total, ic.column[i].conductivity, ic.column[i].height, ic.column[i].get_enum())
+                        U_total = ice.add_layer_conductance_to_total(U_total, ic.column[i].conductivity, ic.column[i].height, ic.column[i].get_enum(), parameters=p)
 
                     # Else all energy is used to freeze the layer only partially
                     else:
@@ -199,8 +599,8 @@ def get_ice_thickness_from_surface_temp(ic, time_step, dh_snow, temp, melt_energ
                         ic.column[i].height -= dh
 
                         # dh has frozen to slush ice. Layer height increases when water in the layer freezes.
-                        dh += dh * (1 - const.part_ice_in_slush) * ((const.rho_water - const.rho_slush_ice) / const.rho_slush_ice)
-                        ic.add_layer_at_index(i, ice.IceLayer(dh, 'slush_ice'))
+                        dh += dh * (1 - p.part_ice_in_slush) * ((p.rho_water - p.rho_slush_ice) / p.rho_slush_ice)
+                        ic.add_layer_at_index(i, ice.IceLayer(dh, 'slush_ice', p))
 
                         # Nothing more to freeze
                         time_step = 0
@@ -227,19 +627,19 @@ def get_ice_thickness_from_surface_temp(ic, time_step, dh_snow, temp, melt_energ
                     ic.remove_layer_at_index(0)
                 else:
                     if ic.column[0].get_enum() >= 20: # snow
-                        meltingcoeff = const.meltingcoeff_snow
+                        meltingcoeff = p.meltingcoeff_snow
                     elif ic.column[0].type == 'slush_ice':
-                        meltingcoeff = const.meltingcoeff_slush_ice
+                        meltingcoeff = p.meltingcoeff_slush_ice
                     elif ic.column[0].type == 'slush':
-                        meltingcoeff = const.meltingcoeff_slush
+                        meltingcoeff = p.meltingcoeff_slush
                     elif ic.column[0].type == 'black_ice':
-                        meltingcoeff = const.meltingcoeff_black_ice
+                        meltingcoeff = p.meltingcoeff_black_ice
                     else:
                         ml.log_and_print("[info] icethickness.py -> get_ice_thickness_from_surface_temp: Melting on unknown layer type: {0}. Using slush_ice coeff.".format(ic.column[0].type))
-                        meltingcoeff = const.meltingcoeff_slush_ice
+                        meltingcoeff = p.meltingcoeff_slush_ice
 
                     # degree day melting. I have separated the time factor from the melting coefficiant.
-                    dh = meltingcoeff * time_step * (temp - const.temp_f)
+                    dh = meltingcoeff * time_step * (temp - p.temp_f)
 
                     # if layer is thinner than total melting the layer is removed and the rest of melting occurs
                     # in the layer below for the reminder of time. melting (dh) and time are proportional in the degreeday equation
@@ -261,7 +661,7 @@ def get_ice_thickness_from_surface_temp(ic, time_step, dh_snow, temp, melt_energ
                     ic.remove_layer_at_index(0)
                 else:
                     # energy available to melt used with latent heat of fusion (delta_h = Q/L/rho)
-                    L_ice = const.L_fusion/1000.    # Joule to Kilo Joule
+                    L_ice = p.L_fusion/1000.    # Joule to Kilo Joule
                     dh = melt_energy / L_ice / ic.column[0].density * time_step/24/60/60
 
                     # if layer is thinner than total melting the layer is removed and the rest of melting occurs
@@ -280,7 +680,7 @@ def get_ice_thickness_from_surface_temp(ic, time_step, dh_snow, temp, melt_energ
             ml.log_and_print("[info] icethickness.py -> get_ice_thickness_from_surface_temp: Need either energy or positive temperatures in model to melt snow and ice.")
 
     ic.merge_and_remove_excess_layers()
-    ic.merge_snow_layers_and_compress(temp)
+    ic.merge_snow_layers_and_compress(temp, step_length)
     ic.update_draft_thickness()
     ic.update_water_line()
     ic.update_column_temperatures(temp)
@@ -292,7 +692,8 @@ def get_ice_thickness_from_surface_temp(ic, time_step, dh_snow, temp, melt_energ
 
 def get_ice_thickness_from_energy_balance(
         utm33_x, utm33_y, ice_column, temp_atm, prec, prec_snow, time_span_in_sec,
-        albedo_prim=None, age_factor_tau=None, cloud_cover=None, wind=None, rel_hum=None, pressure_atm=None):
+        albedo_prim=None, age_factor_tau=None, cloud_cover=None, wind=None, rel_hum=None, pressure_atm=None,
+        temp_surface_start=None):
     """
 
     :param utm33_x:
@@ -307,6 +708,7 @@ def get_ice_thickness_from_energy_balance(
     :param cloud_cover:
     :param wind:
     :param pressure_atm:
+    :param temp_surface_start:  [C] First guess when solving for surface temperature, e.g. that of the day before.
     :return:
     """
 
@@ -322,7 +724,8 @@ def get_ice_thickness_from_energy_balance(
         energy_balance = deb.temp_surface_from_eb(
             utm33_x, utm33_y, ice_column, temp_atm, prec, prec_snow, albedo_prim, time_span_in_sec,
             age_factor_tau=age_factor_tau,
-            cloud_cover=cloud_cover, wind=wind, rel_hum=rel_hum, pressure_atm=pressure_atm)
+            cloud_cover=cloud_cover, wind=wind, rel_hum=rel_hum, pressure_atm=pressure_atm,
+            temp_surface_start=temp_surface_start)
 
         surface_temp = energy_balance.temp_surface
         out_column = None
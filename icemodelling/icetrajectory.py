@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""Compact storage of modelled ice cover. The models return a list of IceColumns, one pr day. For a season this
+is some hundred objects with layer objects and dictionaries, and finding the column on a given date needs a
+scan of the list. The IceTrajectory stores the same data as ragged arrays and has a dictionary lookup on date."""
+
+import datetime as dt
+import numpy as np
+from icemodelling import ice as ice
+from utilities import makelogs as ml
+
+__author__ = 'raek'
+
+
+class IceTrajectory:
+    """Ice cover over a period (e.g. a season) stored as ragged arrays.
+
+    Column values (date, water line, draft thickness, etc.) have one element pr day. Layer values (type code,
+    height, density, conductivity and temperature) for all days are stored in flat arrays and the layers of day i
+    are found in the range layer_offsets[i]:layer_offsets[i+1]. Layer types are stored as type codes, see
+    ice.layer_types. Values not given (None) are stored as nan.
+
+    IceColumns are only made when asked for (get_ice_column, indexing or iterating) and each call makes a new
+    IceColumn, so changing a returned column does not change the trajectory. Metadata is kept only for columns and
+    layers where it is given. Layer temperatures at top and bottom are not kept.
+
+    The model parameters of the run are kept and given to the columns made, so a run may continue from any column
+    with the same parameters.
+    """
+
+    # Model parameters of trajectories made before trajectories had parameters (e.g. unpickled) are the defaults.
+    parameters = None
+
+    # Names of the arrays with one element pr column and with one element pr layer
+    column_arrays = ['water_lines', 'draft_thicknesses', 'total_column_heights', 'temp_surfaces', 'in_slush_event']
+    layer_arrays = ['type_codes', 'heights', 'densities', 'conductivities', 'temperatures']
+
+    def __init__(self, ice_cover=None, parameters=None):
+        """
+        :param ice_cover:       [list of IceColumn] E.g. the output of icethickness.calculate_ice_cover_air_temp.
+        :param parameters:      [ModelParameters] Optional. If None, the parameters of the first column are used.
+        """
+
+        if ice_cover is None:
+            ice_cover = []
+
+        if parameters is None and len(ice_cover) > 0:
+            parameters = ice_cover[0].parameters
+        self.parameters = parameters
+
+        self.dates = [c.date for c in ice_cover]
+        self.date_index = _make_date_index(self.dates)  # {date: index of last column on this date}
+
+        self.water_lines = _float_array([c.water_line for c in ice_cover])
+        self.draft_thicknesses = _float_array([c.draft_thickness for c in ice_cover])
+        self.total_column_heights = _float_array([c.total_column_height for c in ice_cover])
+        self.temp_surfaces = _float_array([getattr(c, 'temp_surface', None) for c in ice_cover])
+        self.top_layer_is_slush = [c.top_layer_is_slush for c in ice_cover]
+        self.in_slush_event = np.array([bool(c.in_slush_event) for c in ice_cover], dtype=bool)
+        self.column_metadata = {i: c.metadata.copy() for i, c in enumerate(ice_cover) if c.metadata}
+
+        layers = [l for c in ice_cover for l in c.column]
+        self.layer_offsets = np.zeros(len(ice_cover) + 1, dtype=int)
+        self.layer_offsets[1:] = np.cumsum([len(c.column) for c in ice_cover])
+
+        self.type_codes = np.array([l.type_code for l in layers], dtype=np.int8)
+        self.heights = _float_array([l.height for l in layers])
+        self.densities = _float_array([l.density for l in layers])
+        self.conductivities = _float_array([l.conductivity for l in layers])
+        self.temperatures = _float_array([l.temperature for l in layers])
+        self.layer_metadata = {j: l.metadata.copy() for j, l in enumerate(layers) if l.metadata}
+
+    @classmethod
+    def from_arrays(cls, dates, layer_counts, layer_values, column_values, parameters=None):
+        """Makes a trajectory directly from arrays, e.g. from the batch engine in icebatch, without making
+        the IceColumns first. Metadata is not given.
+
+        :param dates:           [list of datetime or array of datetime64] One pr column.
+        :param layer_counts:    [array of int] Number of layers in each column.
+        :param layer_values:    [dict of arrays] 'type_codes', 'heights', 'densities', 'conductivities' and
+                                'temperatures' for the layers of all columns after each other.
+        :param column_values:   [dict] 'water_lines', 'draft_thicknesses', 'total_column_heights',
+                                'temp_surfaces' and 'in_slush_event' as arrays and 'top_layer_is_slush' as list.
+        :param parameters:      [ModelParameters] Optional. Model parameters of the run.
+        :return:                [IceTrajectory]
+        """
+
+        trajectory = cls(parameters=parameters)
+        dates = np.asarray(dates, dtype='datetime64[us]')
+        trajectory.dates = dates.astype(dt.datetime).tolist()
+
+        # {date: index of last column on this date}. The last index is written last.
+        days = dates.astype('datetime64[D]').tolist()
+        trajectory.date_index = dict(zip(days, range(len(days))))
+
+        trajectory.water_lines = np.asarray(column_values['water_lines'], dtype=float)
+        trajectory.draft_thicknesses = np.asarray(column_values['draft_thicknesses'], dtype=float)
+        trajectory.total_column_heights = np.asarray(column_values['total_column_heights'], dtype=float)
+        trajectory.temp_surfaces = np.asarray(column_values['temp_surfaces'], dtype=float)
+        trajectory.top_layer_is_slush = list(column_values['top_layer_is_slush'])
+        trajectory.in_slush_event = np.asarray(column_values['in_slush_event'], dtype=bool)
+
+        trajectory.layer_offsets = np.zeros(len(trajectory.dates) + 1, dtype=int)
+        trajectory.layer_offsets[1:] = np.cumsum(layer_counts)
+
+        trajectory.type_codes = np.asarray(layer_values['type_codes'], dtype=np.int8)
+        trajectory.heights = np.asarray(layer_values['heights'], dtype=float)
+        trajectory.densities = np.asarray(layer_values['densities'], dtype=float)
+        trajectory.conductivities = np.asarray(layer_values['conductivities'], dtype=float)
+        trajectory.temperatures = np.asarray(layer_values['temperatures'], dtype=float)
+
+        return trajectory
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.get_ice_column_at_index(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('IceTrajectory index out of range')
+        return self.get_ice_column_at_index(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.get_ice_column_at_index(i)
+
+    def get_index(self, date):
+        """Index of the column on a given date. If there are several columns on the date (sub-daily time steps),
+        the last is used.
+
+        :param date:        [datetime or date] Only the date part is used.
+        :return:            [int] Index of the column or None if the date is not in the trajectory.
+        """
+
+        return self.date_index.get(_as_date(date))
+
+    def get_ice_column(self, date):
+        """Makes the IceColumn on a given date.
+
+        :param date:        [datetime or date] Only the date part is used.
+        :return:            [IceColumn] or None if the date is not in the trajectory.
+        """
+
+        index = self.get_index(date)
+        if index is None:
+            return None
+        return self.get_ice_column_at_index(index)
+
+    def get_draft_thickness(self, date):
+        """Draft thickness on a given date without making the IceColumn.
+
+        :param date:        [datetime or date] Only the date part is used.
+        :return:            [float] Draft thickness or None if the date is not in the trajectory.
+        """
+
+        index = self.get_index(date)
+        if index is None:
+            return None
+        return _float_or_none(self.draft_thicknesses[index])
+
+    def get_ice_column_at_index(self, index):
+        """Makes the IceColumn at a given index in the trajectory.
+
+        :param index:       [int]
+        :return:            [IceColumn]
+        """
+
+        layers = []
+        for j in range(self.layer_offsets[index], self.layer_offsets[index+1]):
+            layer = ice.IceLayer(float(self.heights[j]), ice.layer_types[self.type_codes[j]])
+            layer.density = _float_or_none(self.densities[j])
+            layer.conductivity = _float_or_none(self.conductivities[j])
+            layer.temperature = _float_or_none(self.temperatures[j])
+            if j in self.layer_metadata:
+                layer.metadata = self.layer_metadata[j].copy()
+            layers.append(layer)
+
+        ice_column = ice.IceColumn(self.dates[index], layers, self.parameters)
+        ice_column.metadata = self.column_metadata.get(index, {}).copy()
+        ice_column.water_line = _float_or_none(self.water_lines[index])
+        ice_column.draft_thickness = _float_or_none(self.draft_thicknesses[index])
+        ice_column.total_column_height = _float_or_none(self.total_column_heights[index])
+        ice_column.top_layer_is_slush = self.top_layer_is_slush[index]
+        ice_column.in_slush_event = bool(self.in_slush_event[index])
+        temp_surface = _float_or_none(self.temp_surfaces[index])
+        if temp_surface is not None:
+            ice_column.temp_surface = temp_surface
+
+        return ice_column
+
+    def head(self, length):
+        """Makes a new trajectory with the first columns of this trajectory.
+
+        :param length:      [int] Number of columns to keep.
+        :return:            [IceTrajectory]
+        """
+
+        length = min(length, len(self))
+        number_of_layers = self.layer_offsets[length]
+
+        trajectory = IceTrajectory(parameters=self.parameters)
+        trajectory.dates = self.dates[:length]
+        trajectory.date_index = _make_date_index(trajectory.dates)
+        for name in self.column_arrays:
+            setattr(trajectory, name, getattr(self, name)[:length].copy())
+        trajectory.top_layer_is_slush = self.top_layer_is_slush[:length]
+        trajectory.column_metadata = {i: m.copy() for i, m in self.column_metadata.items() if i < length}
+
+        trajectory.layer_offsets = self.layer_offsets[:length+1].copy()
+        for name in self.layer_arrays:
+            setattr(trajectory, name, getattr(self, name)[:number_of_layers].copy())
+        trajectory.layer_metadata = {j: m.copy() for j, m in self.layer_metadata.items() if j < number_of_layers}
+
+        return trajectory
+
+    def extend(self, ice_cover):
+        """Adds the columns of another trajectory or a list of IceColumns at the end of this trajectory.
+
+        :param ice_cover:   [IceTrajectory or list of IceColumn]
+        """
+
+        other = as_ice_trajectory(ice_cover)
+        column_offset = len(self)
+        layer_offset = self.layer_offsets[-1]
+
+        if self.parameters is None:
+            self.parameters = other.parameters
+        elif other.parameters is not None and other.parameters != self.parameters:
+            ml.log_and_print("[warning] icetrajectory.py -> IceTrajectory.extend: The columns added are modelled "
+                             "with other parameters. The parameters of this trajectory are kept.")
+
+        self.dates = self.dates + other.dates
+        for d, i in other.date_index.items():
+            self.date_index[d] = i + column_offset
+        for name in self.column_arrays:
+            setattr(self, name, np.concatenate((getattr(self, name), getattr(other, name))))
+        self.top_layer_is_slush = self.top_layer_is_slush + other.top_layer_is_slush
+        self.column_metadata.update({i + column_offset: m.copy() for i, m in other.column_metadata.items()})
+
+        self.layer_offsets = np.concatenate((self.layer_offsets, other.layer_offsets[1:] + layer_offset))
+        for name in self.layer_arrays:
+            setattr(self, name, np.concatenate((getattr(self, name), getattr(other, name))))
+        self.layer_metadata.update({j + layer_offset: m.copy() for j, m in other.layer_metadata.items()})
+
+    def to_ice_cover(self):
+        """Makes all columns of the trajectory.
+
+        :return:            [list of IceColumn]
+        """
+
+        return [self.get_ice_column_at_index(i) for i in range(len(self))]
+
+
+class IceCoverSummary:
+    """Running aggregates of modelled ice cover. The drivers add every modelled column, also those not kept as
+    output (see output_dates and output_every in the drivers), so e.g. the max ice thickness of a season is known
+    without keeping all columns of the season."""
+
+    def __init__(self):
+        self.number_of_columns = 0
+        self.ice_days = 0                       # columns with draft thickness above zero
+        self.first_ice_date = None
+        self.last_ice_date = None
+        self.max_draft_thickness = 0.
+        self.max_draft_thickness_date = None
+        self.max_total_column_height = 0.
+
+    def add(self, date, draft_thickness, total_column_height):
+        """Adds the values of one modelled column. Values not given (None or nan) are not counted.
+
+        :param date:                [datetime]
+        :param draft_thickness:     [float]
+        :param total_column_height: [float]
+        """
+
+        self.number_of_columns += 1
+
+        if draft_thickness is not None and draft_thickness > 0.:
+            self.ice_days += 1
+            if self.first_ice_date is None:
+                self.first_ice_date = date
+            self.last_ice_date = date
+            if draft_thickness > self.max_draft_thickness:
+                self.max_draft_thickness = draft_thickness
+                self.max_draft_thickness_date = date
+
+        if total_column_height is not None and total_column_height > self.max_total_column_height:
+            self.max_total_column_height = total_column_height
+
+    def add_ice_column(self, ice_column):
+        """
+        :param ice_column:  [IceColumn] A modelled column.
+        """
+
+        self.add(ice_column.date, ice_column.draft_thickness, ice_column.total_column_height)
+
+
+def make_output_selection(output_dates=None, output_every=None):
+    """Selection of the modelled columns to keep as output. Used by the drivers so that only the requested
+    columns are copied and kept. This is the rule for output_dates and output_every in all drivers, also in the
+    batch drivers in icebatch: the initial column (number 0) is always kept, so a trajectory starts where the
+    modelling starts, and the other columns are kept if they are on one of the output dates or are every n-th.
+
+    :param output_dates:    [list of date or datetime] Columns on these days are kept. Times of day are not compared.
+    :param output_every:    [int] Every n-th column is kept, counted from the initial column (number 0).
+    :return:                [function] (date, column number) -> bool. All columns are kept if neither is given.
+    """
+
+    if output_dates is None and output_every is None:
+        return lambda date, number: True
+
+    days = get_output_days(output_dates)
+
+    def is_output(date, number):
+        return number == 0 or (output_every is not None and number % output_every == 0) or _as_date(date) in days
+
+    return is_output
+
+
+def get_output_days(output_dates=None):
+    """The days of the output dates. See make_output_selection.
+
+    :param output_dates:    [list of date or datetime] May be None.
+    :return:                [set of date] Empty if output_dates is None.
+    """
+
+    if output_dates is None:
+        return set()
+    return set(_as_date(d) for d in output_dates)
+
+
+def as_ice_trajectory(ice_cover):
+    """Returns the ice cover as an IceTrajectory. If it already is a trajectory it is returned as is.
+
+    :param ice_cover:       [list of IceColumn or IceTrajectory]
+    :return:                [IceTrajectory] or None if ice_cover is None.
+    """
+
+    if ice_cover is None or isinstance(ice_cover, IceTrajectory):
+        return ice_cover
+    return IceTrajectory(ice_cover)
+
+
+def _make_date_index(dates):
+    return {_as_date(d): i for i, d in enumerate(dates)}
+
+
+def _as_date(date):
+    if isinstance(date, dt.datetime):
+        return date.date()
+    return date
+
+
+def _float_array(values):
+    return np.array([np.nan if v is None else v for v in values], dtype=float)
+
+
+def _float_or_none(value):
+    if np.isnan(value):
+        return None
+    return float(value)
+
+
+if __name__ == "__main__":
+
+    from icemodelling import icethickness as it
+
+    first_ice = ice.IceColumn(dt.datetime(2018, 11, 1), [ice.IceLayer(0.1, 'black_ice')])
+    dates = [dt.datetime(2018, 11, 1) + dt.timedelta(days=i) for i in range(60)]
+    temps = [-5. - 0.1 * i for i in range(60)]
+    snow = [0.02 if i % 10 == 0 else 0. for i in range(60)]
+    calculated_ice = it.calculate_ice_cover_air_temp(first_ice, dates, temps, snow)
+
+    trajectory = IceTrajectory(calculated_ice)
+    for ci, ti in zip(calculated_ice, trajectory):
+        assert ci.date == ti.date and ci.draft_thickness == ti.draft_thickness
+        assert [(l.type, l.height) for l in ci.column] == [(l.type, l.height) for l in ti.column]
+
+    print(trajectory.get_draft_thickness(dt.date(2018, 12, 1)))
+
+    # With several columns on a date, the last is used
+    dates = [dt.datetime(2018, 11, 1) + dt.timedelta(hours=6*i) for i in range(40)]
+    calculated_ice = it.calculate_ice_cover_air_temp_adaptive(first_ice, dates, temps[:40], snow[:40])
+    trajectory = IceTrajectory(calculated_ice[:20])
+    trajectory.extend(calculated_ice[20:])
+    for ti in trajectory:
+        last = [i for i, ci in enumerate(calculated_ice) if ci.date.date() == ti.date.date()][-1]
+        assert trajectory.get_index(ti.date) == last
+        assert trajectory.head(last + 1).get_index(ti.date) == last
+
+    print(trajectory.get_draft_thickness(dt.date(2018, 11, 5)))
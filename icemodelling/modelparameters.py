@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""Model constants as an immutable object. The constants in icemodelling.constants are module globals, so all
+runs in a process use the same values. A ModelParameters object holds its own copy of the constants and is
+given to the ice columns (IceColumn.parameters), the step functions and the energy balance. Runs with
+different parameters may then go on side by side, and since the object is hashable it can be used as a key
+when caching results pr parameter set."""
+
+from icemodelling import constants as const
+from utilities import makelogs as ml
+
+__author__ = 'raek'
+
+
+# Names of the model constants. All numbers in icemodelling.constants in the order they are given.
+parameter_names = tuple(name for name, value in vars(const).items()
+                        if not name.startswith('_') and isinstance(value, (int, float)) and not isinstance(value, bool))
+
+# Constants given by other constants, in the order they are found in icemodelling.constants. They are calculated
+# again from the given constants unless they are given themselves.
+_derived_parameters = [
+    ('k_drained_snow', lambda p: p['k_snow']),
+    ('k_slush_ice', lambda p: 0.5 * p['k_black_ice']),
+    ('k_slush', lambda p: (p['k_slush_ice'] * p['k_water']) / (p['k_slush_ice'] * (1 - p['part_ice_in_slush']) + p['k_water'] * p['part_ice_in_slush'])),
+    ('rho_drained_snow', lambda p: p['rho_snow']),
+    ('rho_slush', lambda p: p['part_ice_in_slush'] * p['rho_slush_ice'] + (1 - p['part_ice_in_slush']) * p['rho_water']),
+    ('L_sublimation', lambda p: p['L_fusion'] + p['L_vapour']),
+    ('c_ice', lambda p: p['c_snow']),
+    ('c_slush', lambda p: p['c_ice'] * p['part_ice_in_slush'] + p['c_water'] * (1 - p['part_ice_in_slush'])),
+    ('z_new_snow', lambda p: p['z_snow']),
+    ('z_drained_snow', lambda p: p['z_snow']),
+    ('z_slush_ice', lambda p: p['z_black_ice']),
+    ('z_water', lambda p: p['z_black_ice']),
+    ('z_slush', lambda p: p['z_water']),
+    ('eps_ice', lambda p: p['eps_snow']),
+    ('eps_water', lambda p: p['eps_snow']),
+    ('meltingcoeff_slush', lambda p: p['meltingcoeff_slush_ice']*2),
+    ('U_surface', lambda p: p['k_snow']/0.01)]
+
+
+class ModelParameters:
+    """Immutable set of model constants. Constants are read as attributes, e.g. parameters.rho_water, and are
+    the values in icemodelling.constants if not given otherwise.
+
+    Derived constants (e.g. k_slush and rho_slush which depend on part_ice_in_slush) are calculated from the given
+    constants as in icemodelling.constants, unless they are given themselves. The layer tables in ice.py
+    (layer_densities, layer_conductivities, etc.) are also made from the constants.
+
+    Two objects with the same constants are equal and have the same hash. Use replace to make a new object with
+    some constants changed.
+    """
+
+    def __init__(self, **parameters):
+        """
+        :param parameters:  Constants that differ from icemodelling.constants, e.g. ModelParameters(rho_snow=300.)
+        """
+
+        unknown_names = sorted(set(parameters) - set(parameter_names))
+        if unknown_names:
+            ml.log_and_print("[warning] modelparameters.py -> ModelParameters: Unknown parameters {} are not used."
+                             .format(unknown_names))
+
+        values = {name: parameters.get(name, getattr(const, name)) for name in parameter_names}
+        for name, derive in _derived_parameters:
+            if name not in parameters:
+                values[name] = derive(values)
+
+        for name in parameter_names:
+            object.__setattr__(self, name, values[name])
+        object.__setattr__(self, '_given', tuple((n, values[n]) for n in sorted(parameters) if n in values))
+        object.__setattr__(self, '_key', tuple(values[name] for name in parameter_names))
+
+        # Layer tables pr type code, see the tables in ice.py.
+        p = self
+        object.__setattr__(self, 'layer_conductivities', (
+            p.k_new_snow, p.k_snow, p.k_drained_snow, p.k_slush, p.k_slush_ice, p.k_black_ice, p.k_water,
+            p.k_slush_ice, None))
+        object.__setattr__(self, 'layer_densities', (
+            p.rho_new_snow, p.rho_snow, p.rho_drained_snow, p.rho_slush, p.rho_slush_ice, p.rho_black_ice,
+            p.rho_water, p.rho_slush_ice, None))
+        object.__setattr__(self, 'layer_heat_capacities', (
+            p.c_snow, p.c_snow, p.c_snow, p.c_slush, p.c_ice, p.c_ice, p.c_water, p.c_ice, -1))
+        object.__setattr__(self, 'layer_surface_roughness', (
+            p.z_new_snow, p.z_snow, p.z_drained_snow, p.z_slush, p.z_slush_ice, p.z_black_ice, p.z_water,
+            p.z_black_ice, -1))
+        object.__setattr__(self, 'layer_diffusivity_conductivities', (
+            p.k_new_snow, p.k_snow, p.k_drained_snow, p.k_slush, p.k_slush_ice, p.k_black_ice, p.k_water,
+            p.k_black_ice, None))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ModelParameters is immutable. Use replace to make new parameters.')
+
+    def __delattr__(self, name):
+        raise AttributeError('ModelParameters is immutable.')
+
+    def __eq__(self, other):
+        return isinstance(other, ModelParameters) and self._key == other._key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __repr__(self):
+        return 'ModelParameters({})'.format(', '.join('{}={!r}'.format(n, v) for n, v in self._given))
+
+    def __reduce__(self):
+        return _make_model_parameters, (dict(self._given),)
+
+    def replace(self, **parameters):
+        """Makes new parameters where some constants are changed. Derived constants not given are calculated
+        again from the new constants.
+
+        :param parameters:  Constants to change.
+        :return:            [ModelParameters]
+        """
+
+        given = dict(self._given)
+        given.update(parameters)
+        return ModelParameters(**given)
+
+    def to_dict(self):
+        """
+        :return:    [dict] {name: value} of all constants.
+        """
+
+        return {name: getattr(self, name) for name in parameter_names}
+
+
+def _make_model_parameters(parameters):
+    return ModelParameters(**parameters)
+
+
+def get_parameters(parameters=None):
+    """Returns the given parameters or the default parameters if None is given.
+
+    :param parameters:  [ModelParameters or None]
+    :return:            [ModelParameters]
+    """
+
+    if parameters is None:
+        return default_parameters
+    return parameters
+
+
+# The constants in icemodelling.constants.
+default_parameters = ModelParameters()
+
+
+if __name__ == "__main__":
+
+    import pickle
+
+    for name in parameter_names:
+        assert getattr(default_parameters, name) == getattr(const, name), name
+
+    thin_slush = default_parameters.replace(part_ice_in_slush=0.6)
+    assert thin_slush == ModelParameters(part_ice_in_slush=0.6) and hash(thin_slush) == hash(ModelParameters(part_ice_in_slush=0.6))
+    assert thin_slush != default_parameters and thin_slush.rho_slush != const.rho_slush
+    assert pickle.loads(pickle.dumps(thin_slush)) == thin_slush
+
+    print(thin_slush, thin_slush.rho_slush, thin_slush.k_slush)
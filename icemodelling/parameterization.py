@@ -3,7 +3,8 @@
 import datetime as dt
 import math
 from icemodelling import constants as const, weatherelement as we
-from utilities import doconversions as dc, getwsklima as gws
+from icemodelling import solargeometry as sg
+from utilities import getwsklima as gws
 import random as random
 
 
@@ -202,59 +203,9 @@ def irradiance_clear_sky(utm33_x, utm33_y, date_inn, time_span_in_sec=24*60*60):
     if time_hour == 0:
         time_hour = 24
 
-    phi, thi, ddphi, ddthi = dc.lat_long_from_utm33(utm33_x,utm33_y, output= "both")
-
-    theta = 0.4092*math.cos((2*math.pi/365.25)*(day_no-173))  # solar declination angleday angle, Liston 1995
-    theta2 = 2*math.pi/365.25*(day_no-80)
-
-    r = 149598000   # distance from the sun
-    R = 6378        # Radius of earth
-
-    timezone = -4 * (math.fabs(thi) % 15) * thi/math.fabs(thi)      # ang lengdegrad ikke
-    epsilon = 0.4092    # rad(23.45)
-
-    z_s = r*math.sin(theta2)*math.sin(epsilon)
-    r_p = math.sqrt(r**2-z_s**2)
-    nevner = (R-z_s*math.sin(phi))/(r_p*math.cos(phi))
-
-    if(nevner > -1) and (nevner < 1):
-        # acos(mÂ ha inn verdier ,(mellom-1,1) hvis <-1 sÂ er det midnattsol > 1 er det m¯rketid.
-        t0 = 1440/(2*math.pi)*math.acos((R-z_s*math.sin(phi))/(r_p*math.cos(phi)))
-        that = t0+5
-        n = 720-10*math.sin(4*math.pi*(day_no-80)/365.25)+8*math.sin(2*math.pi*day_no/365.25)
-        sr = (n-that+timezone)/60 #soloppgang
-        ss = (n+that+timezone)/60 #solnedgang
-
-    if nevner <= -1:    # Midnattsol
-        sr = 0.
-        ss = 24.
-
-    if nevner >= 1:     # Mørketid
-        sr = 12.
-        ss = 12.
-
-    dingom = {}         # Values for zenith angle (0 straight up)
-
-    for tid in range(1, 24, 1):
-        if (tid > sr) and (tid < ss):
-            tom = tid-12    # Number of hours from solar noon. Solar noon is tom=0
-            cosarg = 0.2618 * tom   # Radians pr hour
-            dingom[tid] = math.acos(math.sin(phi)*math.sin(theta)+math.cos(phi)*math.cos(theta)*math.cos(cosarg))  # Dingmans zenith angle
-
-        if (tid < sr) or (tid > ss):  # If time is outside sunrise-sunset
-            dingom[tid] = math.pi/2     # Angle below horizin is set to be on the horizon.
-
-    if time_span_in_sec == 86400:
-        zenith_angle = dingom.values()          # list
-    elif time_span_in_sec < 86400:              # Midler transmissvitet og solvinkel For finere tidssoppløsning
-        interv = list(range(time_hour-int(time_span_in_sec/3600)+1, time_hour, 1))     # aktuelle timer
-        zenith_angle = [dingom[i] for i in interv]
-    else:
-        print("Method doesnt work on time intervals greater than 24hrs")
-        zenith_angle = None
-
-    # Mean values
-    zenith_angle = float( sum(zenith_angle) / len(zenith_angle) )
+    # The solar geometry on the location is computed once and looked up
+    zenith_angle = sg.get_solar_geometry_table(utm33_x, utm33_y).get_mean_values(
+        day_no, time_hour, time_span_in_sec)[1]
 
     #Solar radiation
     S0 = const.solar_constant   #[J/m2/s] Solar constant pr sec
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Solar geometry used by the short wave radiation in the energy balance and by the clear sky irradiance in
+parameterization. The geometry on a location only depends on the day of year and the hour, so it is computed once
+pr location for all days and hours and is then looked up. The method is that of
+experimental.energybalance.get_short_wave (Walter 2005, Liston 1995 and Dingman)."""
+
+import math
+import functools
+import numpy as np
+from utilities import doconversions as dc
+
+__author__ = 'raek'
+
+
+# Number of locations with tables kept. A table is about 160 kB and is made again in less than a millisecond.
+max_tables = 128
+
+
+class SolarGeometryTable:
+    """Zenith angle and clear sky transmissivity on one location for each day of year (1-366) and each hour
+    (1-23) of the day. Hours with the sun below the horizon have zenith angle pi/2 and transmissivity 0. An hour
+    exactly at sunrise or sunset is not counted in the mean values, as in get_short_wave."""
+
+    def __init__(self, latitude, longitude):
+        """
+        :param latitude:    [float] In radians.
+        :param longitude:   [float] In radians.
+        """
+
+        self.latitude = latitude
+        self.longitude = longitude
+
+        day_no = np.arange(1, 367, dtype=float)[:, None]
+        self.hours = np.arange(1, 24)
+
+        theta = 0.4092*np.cos((2*math.pi/365.25)*(day_no-173))    # solar declination angleday angle, Liston 1995
+        theta2 = 2*math.pi/365.25*(day_no-80)
+
+        r = 149598000   # distance from the sun
+        R = 6378        # Radius of earth
+
+        timezone = -4 * (math.fabs(longitude) % 15) * longitude/math.fabs(longitude)
+        epsilon = 0.4092    # rad(23.45)
+
+        z_s = r*np.sin(theta2)*math.sin(epsilon)
+        r_p = np.sqrt(r**2-z_s**2)
+        nevner = (R-z_s*math.sin(latitude))/(r_p*math.cos(latitude))
+
+        # Sunrise and sunset. Midnight sun if nevner <= -1 and polar night if nevner >= 1.
+        t0 = 1440/(2*math.pi)*np.arccos(np.clip(nevner, -1., 1.))
+        that = t0+5
+        n = 720-10*np.sin(4*math.pi*(day_no-80)/365.25)+8*np.sin(2*math.pi*day_no/365.25)
+        sunrise = np.where(nevner <= -1, 0., np.where(nevner >= 1, 12., (n-that+timezone)/60))
+        sunset = np.where(nevner <= -1, 24., np.where(nevner >= 1, 12., (n+that+timezone)/60))
+        self.daylight_hours = (sunset - sunrise)[:, 0]
+
+        self.is_daylight = (self.hours > sunrise) & (self.hours < sunset)
+        self.is_counted = self.is_daylight | (self.hours < sunrise) | (self.hours > sunset)
+
+        cosarg = 0.2618 * (self.hours-12)      # Radians pr hour from solar noon
+        cos_zenith = math.sin(latitude)*np.sin(theta) + math.cos(latitude)*np.cos(theta)*np.cos(cosarg)
+        self.zenith_angles = np.where(self.is_daylight, np.arccos(np.clip(cos_zenith, -1., 1.)), math.pi/2)
+        self.transmissivities = np.where(self.is_daylight, 0.6 + 0.2*np.sin((0.5*math.pi)-self.zenith_angles), 0.)
+
+        # Mean values over the day
+        counts = self.is_counted.sum(axis=1)
+        self.mean_zenith_angle = np.where(self.is_counted, self.zenith_angles, 0.).sum(axis=1) / counts
+        self.mean_transmissivity = np.where(self.is_counted, self.transmissivities, 0.).sum(axis=1) / counts
+
+    def get_mean_values(self, day_no, time_hour=24, time_span_in_sec=24*60*60):
+        """Mean clear sky transmissivity and zenith angle over a time span.
+
+        :param day_no:              [int] Day of year, 1-366.
+        :param time_hour:           [1-24] Hour of the day the time_span_in_sec ends.
+        :param time_span_in_sec:    [sec] Time resolution in sec. 24hrs or less.
+        :return transmissivity, zenith_angle:  [float] Transmissivity without clouds and zenith angle in radians.
+                                    None if the time span is longer than 24hrs.
+        """
+
+        day = day_no - 1
+
+        if time_span_in_sec == 86400:
+            return float(self.mean_transmissivity[day]), float(self.mean_zenith_angle[day])
+
+        elif time_span_in_sec < 86400:
+            hours = (self.hours >= time_hour-int(time_span_in_sec/3600)+1) & (self.hours < time_hour)
+            selected = hours & self.is_counted[day]
+            count = selected.sum()
+            return float(self.transmissivities[day][selected].sum() / count), \
+                float(self.zenith_angles[day][selected].sum() / count)
+
+        else:
+            print("Method doesnt work on time intervals greater than 24hrs")
+            return None, None
+
+
+@functools.lru_cache(maxsize=max_tables)
+def get_solar_geometry_table(utm33_x, utm33_y):
+    """The solar geometry table on a location. It is made the first time a location is asked for and then kept.
+    Tables on the max_tables locations last asked for are kept.
+
+    :param utm33_x, utm33_y:    koordinat i UTM 33
+    :return:                    [SolarGeometryTable]
+    """
+
+    phi, thi = dc.lat_long_from_utm33(utm33_x, utm33_y, output="radians")
+    return SolarGeometryTable(phi, thi)
+
+
+if __name__ == "__main__":
+
+    from experimental import energybalance as deb
+
+    table = get_solar_geometry_table(130513, 6802070)
+    for day_no in (1, 80, 180, 355):
+        print(day_no, table.daylight_hours[day_no-1], table.get_mean_values(day_no))
+        S = deb.get_short_wave(130513, 6802070, day_no, -1.5, 0.5, 0.2, 300., 0., 0, 86400, -2., 0.8)[1]
+        print(S)
+
+    # Only the tables on the last locations asked for are kept
+    for utm33_x in range(100000, 100000 + 1000 * (max_tables + 10), 1000):
+        get_solar_geometry_table(utm33_x, 6802070)
+    assert get_solar_geometry_table.cache_info().currsize == max_tables
@@ -14,9 +14,12 @@ import os as os
 import json as json
 import copy
 import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
 from icemodelling import icethickness as it, weatherelement as we
 from icemodelling import parameterization as dp
 from icemodelling import ice as ice
+from icemodelling import icetrajectory as itr
+from icemodelling import icebatch as ib
 import setenvironment as se
 from utilities import fencoding as fe, makepickle as mp, makelogs as ml, makeplots as pts
 from utilities import getregobsdata as gro, getwsklima as gws
@@ -186,7 +189,7 @@ def _plot_season(location_id, from_date, to_date, observed_ice, make_plots=True,
     :param from_date:
     :param to_date:
     :param observed_ice:
-    :param make_plots:
+    :param make_plots:      [bool]          If False, only the calculated ice on the observation dates is returned.
     :param plot_folder:     [string]        Path of folder for plots.
 
     :return calculated_ice, observed_ice:   [list of Ice.IceColumn] observed_ice is returned as given inn.
@@ -228,11 +231,16 @@ def _plot_season(location_id, from_date, to_date, observed_ice, make_plots=True,
     plot_filename = '{0}_{1}.png'.format(location_id, year)
     plot_path_and_filename = '{0}{1}'.format(plot_folder, plot_filename)
 
+    # Without plots, only the calculated ice on the days of the observations is used
+    output_dates = None if make_plots else [o.date for o in observed_ice]
+
     try:
         if len(observed_ice) == 0:
-            calculated_ice = it.calculate_ice_cover_air_temp(ice.IceColumn(date[0], []), date, temp, sno, cc)
+            calculated_ice = it.calculate_ice_cover_air_temp(ice.IceColumn(date[0], []), date, temp, sno, cc,
+                                                             output_dates=output_dates)
         else:
-            calculated_ice = it.calculate_ice_cover_air_temp(copy.deepcopy(observed_ice[0]), date, temp, sno, cc)
+            calculated_ice = it.calculate_ice_cover_air_temp(copy.deepcopy(observed_ice[0]), date, temp, sno, cc,
+                                                             output_dates=output_dates)
 
         if make_plots:
             pts.plot_ice_cover(calculated_ice, observed_ice, date, temp, sno, snotot, plot_path_and_filename)
@@ -246,7 +254,58 @@ def _plot_season(location_id, from_date, to_date, observed_ice, make_plots=True,
     return calculated_ice, observed_ice, plot_filename
 
 
-def plot_season_for_all_regobs_locations(year='2019-20', calculate_new=False, get_new_obs=False, make_plots=False, delete_old_plots=False):
+def _plot_season_for_location(location_id, from_date, to_date, observed_ice, make_plots, plot_folder):
+    """Runs _plot_season on one location and returns the calculated ice as an IceTrajectory, which is cheaper to
+    send back from a worker process than the list of IceColumns.
+
+    :return calculated_ice, plot_filename:  [IceTrajectory or None], [string]
+    """
+
+    calculated, observed, plot_filename = _plot_season(
+        location_id, from_date, to_date, observed_ice, make_plots=make_plots, plot_folder=plot_folder)
+
+    return itr.as_ice_trajectory(calculated), plot_filename
+
+
+def _call_and_catch_errors(function, args):
+    """Calls function(*args) and returns the result and the error, if any. Used so that an error on one lake
+    does not stop the others.
+
+    :return result, error_msg:  error_msg is None if no error.
+    """
+
+    try:
+        return function(*args), None
+    except:
+        return None, sys.exc_info()[0]
+
+
+def _map_in_order(function, list_of_args, workers=1):
+    """Calls function(*args) for each args in list_of_args. If workers is more than 1 the calls are made in a
+    pool of worker processes. The results are returned in the order of list_of_args.
+
+    :param function:        Function defined on module level so that it can be sent to the worker processes.
+    :param list_of_args:    [list of tuples] Arguments to each call.
+    :param workers:         [int] Number of worker processes. 1 or None makes the calls in this process.
+    :return:                [list of tuples] (result, error_msg) for each call. error_msg is None if no error.
+    """
+
+    if workers is None or workers <= 1:
+        return [_call_and_catch_errors(function, args) for args in list_of_args]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_call_and_catch_errors, function, args) for args in list_of_args]
+        for future in futures:
+            try:
+                results.append(future.result())
+            except:
+                results.append((None, sys.exc_info()[0]))
+
+    return results
+
+
+def plot_season_for_all_regobs_locations(year='2019-20', calculate_new=False, get_new_obs=False, make_plots=False, delete_old_plots=False, workers=1):
     """Method specialized for scheduled plotting for iskart.no.
     Method makes a season plot for all ObsLocations in regObs where we have a first ice date.
 
@@ -263,6 +322,8 @@ def plot_season_for_all_regobs_locations(year='2019-20', calculate_new=False, ge
     :param get_new_obs:         [bool]
     :param make_plots:          [bool]  If False all calculations are made, but only the scatter comparison against observatiosn is ploted
     :param delete_old_plots:    [bool]  If True all former plots and pickles are removed.
+    :param workers:             [int]   Number of worker processes for calculating and plotting the lakes.
+                                        The default 1 does all in this process.
     """
 
     pickle_file_name_and_path = '{0}all_calculated_ice_{1}.pickle'.format(se.local_storage, year)
@@ -291,15 +352,22 @@ def plot_season_for_all_regobs_locations(year='2019-20', calculate_new=False, ge
         all_observed = {}
         location_id_metadata = {}
 
-        for location_id, observed_ice in all_observations.items():
-            try:
-                calculated, observed, plot_filename = _plot_season(
-                    location_id, from_date, to_date, observed_ice, make_plots=make_plots, plot_folder=se.sesong_plots_folder)
-                all_calculated[location_id] = calculated
-                all_observed[location_id] = observed
-            except:
-                error_msg = sys.exc_info()[0]
-                ml.log_and_print("[error] calculateandplot.py -> plot_season_for_all_regobs_locations: Error making plot for {}".format(error_msg, location_id))
+        # The lakes are independent and may be calculated and plotted in parallel. Results come in the order given.
+        locations = list(all_observations.items())
+        results = _map_in_order(
+            _plot_season_for_location,
+            [(location_id, from_date, to_date, observed_ice, make_plots, se.sesong_plots_folder)
+             for location_id, observed_ice in locations],
+            workers=workers)
+
+        for (location_id, observed_ice), (result, error_msg) in zip(locations, results):
+            if error_msg is not None:
+                ml.log_and_print("[error] calculateandplot.py -> plot_season_for_all_regobs_locations: Error making plot for {} {}".format(location_id, error_msg))
+                continue
+
+            calculated, plot_filename = result
+            all_calculated[location_id] = calculated
+            all_observed[location_id] = observed_ice
 
             # Make the json with metadata needed for iskart.no. Add only if the plot was made and thus file exists.
             if os.path.isfile(se.sesong_plots_folder + plot_filename):
@@ -387,7 +455,53 @@ def calculate_and_plot9d_regid(regid, plot_folder=se.plot_folder, observed_ice=N
         ml.log_and_print("[Error] calculateandplot.py -> calculate_and_plot9d_regid: {}. Could not plot {}.".format(error_msg, regid))
 
 
-def calculate_and_plot9d_season(period='2019-20'):
+def calculate_and_plot9d_location(observed_ices, plot_folder=se.plot_folder):
+    """For several ice thickness observations on the same lake, plots of the following 9 days are made as in
+    calculate_and_plot9d_regid. Weather data from GTS is requested once for the lake and the forecasts are
+    forked from the observations and calculated together as one batch.
+
+    :param observed_ices:   [dict] {RegID: ice.IceColumn} Observations on the same lake.
+    :param plot_folder:     [string] Path of folder for plots.
+    """
+
+    regids = list(observed_ices.keys())
+    first_observation = observed_ices[regids[0]]
+    x, y = first_observation.metadata['UTMEast'], first_observation.metadata['UTMNorth']
+
+    from_date = min(v.date.date() for v in observed_ices.values())
+    to_date = max(v.date.date() for v in observed_ices.values()) + dt.timedelta(days=9)
+
+    # Get weather and snow data for all the observations
+    gridTemp = gts.getgts(x, y, 'tm', from_date, to_date)
+    gridSno = gts.getgts(x, y, 'sdfsw', from_date, to_date)
+    gridSnoTot = gts.getgts(x, y, 'sd', from_date, to_date)
+
+    temp, date_times = we.strip_metadata(gridTemp, get_date_times=True)
+    dates = [d.date() for d in date_times]
+    sno = we.strip_metadata(gridSno)
+    snotot = we.strip_metadata(gridSnoTot)
+    cc = dp.clouds_from_precipitation(sno)
+
+    icecovers = ib.calculate_forked_forecasts(
+        date_times, temp, sno, cloud_cover=cc, observed_ice=[observed_ices[k] for k in regids], forecast_days=9)
+
+    for regid, icecover in zip(regids, icecovers):
+
+        # The 9 days from the observation date
+        observation_date = observed_ices[regid].date.date()
+        days = [i for i, d in enumerate(dates) if observation_date <= d <= observation_date + dt.timedelta(days=9)]
+        plot_filename = '{0}{1}.png'.format(plot_folder, regid)
+
+        try:
+            pts.plot_ice_cover_9dogn(icecover.to_ice_cover(), observed_ices[regid], [dates[i] for i in days],
+                                     [temp[i] for i in days], [sno[i] for i in days], [snotot[i] for i in days],
+                                     plot_filename)
+        except:
+            error_msg = sys.exc_info()[0]
+            ml.log_and_print("[Error] calculateandplot.py -> calculate_and_plot9d_location: {}. Could not plot {}.".format(error_msg, regid))
+
+
+def calculate_and_plot9d_season(period='2019-20', workers=1):
     """Calculate ice columns for 9 days and make plots of all ice thickness for a given season or optionally 'Today'.
 
     The inner workings:
@@ -395,11 +509,14 @@ def calculate_and_plot9d_season(period='2019-20'):
         this season will be requested. All previous plots and local storage will be deleted.
     1.2 If period='Today' ice thickness observations from today will be requested and plotted. Older plots will be
         in the folder. Metadata dict will be merged.
-    2.  Calculate the 9 day prognosis from the observation time and plots the result.
+    2.  Calculate the 9 day prognosis from the observation time and plots the result. Observations on the same
+        lake are calculated together with one request for weather data.
     3.  Make a metadata json for handling files on iskart.no. Only confirmed files in folder will be
         added to metadata json.
 
     :param period:    [String] Default is current season (2017-18).
+    :param workers:   [int] Number of worker processes for calculating and plotting. The default 1 does all in
+                      this process.
     :return:
     """
 
@@ -431,14 +548,16 @@ def calculate_and_plot9d_season(period='2019-20'):
         # Get new observations
         ice_thicks = gro.get_ice_thickness_observations(period, reset_and_get_new=True)
 
-    # Calculate and plot
+    # Find the plots to make
+    max_file_age = 11
+    date_limit = dt.datetime.now() - dt.timedelta(days=max_file_age)
+    file_names = os.listdir(se.ni_dogn_plots_folder)
+    regids_to_plot = []
+
     for k, v in ice_thicks.items():
 
         # If file is missing, make it. If observation is older than 11 days it is based on gridded data for sure and no plot file needed.
         make_plot = False
-        max_file_age = 11
-        date_limit = dt.datetime.now() - dt.timedelta(days=max_file_age)
-        file_names = os.listdir(se.ni_dogn_plots_folder)
         plot_filename = '{0}.png'.format(k)
         if plot_filename not in file_names:
             make_plot = True
@@ -447,11 +566,22 @@ def calculate_and_plot9d_season(period='2019-20'):
                 make_plot = True
 
         if make_plot:
-            try:
-                calculate_and_plot9d_regid(k, plot_folder=se.ni_dogn_plots_folder, observed_ice=v)
-            except:
-                error_msg = sys.exc_info()[0]
-                ml.log_and_print("[Error] {} Error making plot for {} {}".format(log_referance, k, error_msg))
+            regids_to_plot.append(k)
+
+    # Group the observations pr lake. Lakes are independent and may be calculated and plotted in parallel.
+    observations_on_lakes = {}
+    for k in regids_to_plot:
+        lake_id = ice_thicks[k].metadata.get('LocationID', 'RegID {}'.format(k))
+        observations_on_lakes.setdefault(lake_id, {})[k] = ice_thicks[k]
+
+    results = _map_in_order(
+        calculate_and_plot9d_location,
+        [(observed_ices, se.ni_dogn_plots_folder) for observed_ices in observations_on_lakes.values()],
+        workers=workers)
+
+    for observed_ices, (result, error_msg) in zip(observations_on_lakes.values(), results):
+        if error_msg is not None:
+            ml.log_and_print("[Error] {} Error making plot for {} {}".format(log_referance, list(observed_ices.keys()), error_msg))
 
     # Make json with metadata for using files on iskart.no. Load metadata from pickle if available and
     # new observations where a plot is available will be made.
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Calibration of model constants against the record of observed ice thickness. For each lake and season all
+parameter sets are modelled together as one ensemble (see icemodelling.iceensemble) from the first observation,
+and the modelled draft thickness is scored against the later observations in the record."""
+
+import datetime as dt
+import numpy as np
+from icemodelling import weatherelement as we, constants as const
+from icemodelling import parameterization as dp
+from icemodelling import iceensemble as ie
+from icemodellingscripts import calculateandplot as cap
+import setenvironment as se
+from utilities import getregobsdata as gro, makelogs as ml
+from utilities import getmisc as gm
+from utilities import getgts as gts
+
+__author__ = 'raek'
+
+
+def _model_ensemble_on_location(observed_ice, observations, from_date, to_date, parameter_sets):
+    """Models all parameter sets on one lake one season and pairs the modelled and observed draft thickness.
+
+    :param observed_ice:    [list of IceColumn] Observations this season. The model starts from the first.
+    :param observations:    [list of tuples] (date, observed draft thickness) to score against.
+    :param from_date:       [datetime] Start of the weather data.
+    :param to_date:         [datetime]
+    :param parameter_sets:  [list of ModelParameters or dict]
+    :return modelled, observed: See iceensemble.get_modelled_and_observed.
+    """
+
+    x, y = observed_ice[0].metadata['UTMEast'], observed_ice[0].metadata['UTMNorth']
+
+    # get weather data and adjust grid temperature (at grid elevation) to lake elevation.
+    gridTemp = gts.getgts(x, y, 'tm', from_date, to_date)
+    gridSno = gts.getgts(x, y, 'sdfsw', from_date, to_date)
+    lake_altitude = gm.get_masl_from_utm33(x, y)
+    gridTempNewElevation = we.adjust_temperature_to_new_altitude(gridTemp, lake_altitude)
+
+    temp, date = we.strip_metadata(gridTempNewElevation, get_date_times=True)
+    sno = we.strip_metadata(gridSno, False)
+    cc = dp.clouds_from_precipitation(sno)
+
+    # only the days with observations are kept
+    trajectories = ie.calculate_ice_cover_ensemble(observed_ice[0].copy(), date, temp, sno, parameter_sets,
+                                                   cloud_cover=cc, output_dates=[d for d, o in observations])
+
+    return ie.get_modelled_and_observed(trajectories, observations)
+
+
+def calibrate_on_observed_record(parameter_sets, years=('2014-15', '2015-16', '2016-17', '2017-18', '2018-19'),
+                                 file_name_and_path=None, get_new_obs=False, workers=1):
+    """Scores parameter sets against the observed draft thickness in a data set made by
+    experimental.machinelearning. The skill scores are for all observations on all lakes together.
+
+    :param parameter_sets:      [list of ModelParameters or dict] See icebatch.get_parameter_sets. Use {} for
+                                the constants as they are in icemodelling.constants.
+    :param years:               [list of strings] Seasons to model, e.g. '2018-19'.
+    :param file_name_and_path:  [string] The data set. Default is all_observed_and_calculated_ice_2014-19.csv.
+    :param get_new_obs:         [bool] If true, new observations are requested from regObs.
+    :param workers:             [int] Number of worker processes. The default 1 does all in this process.
+    :return:                    [dict of arrays] Skill scores pr parameter set, see iceensemble.calculate_skill_scores.
+    """
+
+    if file_name_and_path is None:
+        file_name_and_path = '{0}all_observed_and_calculated_ice_2014-19.csv'.format(se.data_sets_folder)
+
+    observed_drafts = ie.read_observed_drafts(file_name_and_path)
+    list_of_args = []
+
+    for year in years:
+        from_date, to_date = gm.get_dates_from_year(year)
+        from_date = dt.datetime.strptime(from_date, '%Y-%m-%d')
+        to_date = dt.datetime.strptime(to_date, '%Y-%m-%d')
+
+        # special rule for this season, as in calculateandplot._plot_season
+        if year == '2018-19':
+            from_date = dt.datetime(2018, 9, 1)
+
+        all_observations = gro.get_all_season_ice(year, get_new=get_new_obs)
+
+        for location_id, observed_ice in all_observations.items():
+            if len(observed_ice) == 0:
+                continue
+
+            # The model starts from the first observation, so only the later observations are scored
+            observations = [(d, o) for d, o in observed_drafts.get(location_id, [])
+                            if from_date <= d < to_date and d > observed_ice[0].date]
+            if len(observations) > 0:
+                list_of_args.append((observed_ice, observations, from_date, to_date, parameter_sets))
+
+    modelled = [np.zeros((len(parameter_sets), 0))]
+    observed = [np.zeros(0)]
+    for args, (result, error_msg) in zip(list_of_args, cap._map_in_order(_model_ensemble_on_location, list_of_args, workers)):
+        if error_msg is not None:
+            location_id = args[0][0].metadata.get('LocationID')
+            ml.log_and_print("[Error] calibrateparameters.py -> calibrate_on_observed_record: {}. Could not model {}."
+                             .format(error_msg, location_id))
+            continue
+        modelled.append(result[0])
+        observed.append(result[1])
+
+    return ie.calculate_skill_scores(np.concatenate(modelled, axis=1), np.concatenate(observed))
+
+
+if __name__ == "__main__":
+
+    parameter_sets = ie.make_parameter_grid({'meltingcoeff_snow': [f * const.meltingcoeff_snow for f in (0.5, 1., 1.5)],
+                                             'snow_pull_on_water': [0.01, 0.02, 0.04]})
+    scores = calibrate_on_observed_record(parameter_sets, workers=4)
+
+    for parameter_set, nse, rmse in zip(parameter_sets, scores['nash_sutcliffe'], scores['rmse']):
+        print(parameter_set, nse, rmse)
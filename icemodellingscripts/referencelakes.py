@@ -8,6 +8,8 @@ import datetime as dt
 from icemodelling import weatherelement as we, icethickness as it
 from icemodelling import parameterization as dp
 from icemodelling import ice as ice
+from icemodelling import icetrajectory as itr
+from icemodelling import icecheckpoint as icp
 import setenvironment as se
 from utilities import getregobsdata as gro, makeplots as pts
 from utilities import getgts as gts
@@ -15,7 +17,7 @@ from utilities import getgts as gts
 __author__ = 'ragnarekker'
 
 
-def calculate_reference_lakes(calculation_date=dt.datetime.now(), make_plots=False, get_new_obs=False):
+def calculate_reference_lakes(calculation_date=dt.datetime.now(), make_plots=False, get_new_obs=False, use_checkpoints=False):
     """Plot ice thickness for this season for all reference lakes. Create a json-file with information about
     changes in the ice thickness last week and expected changes next week.
 
@@ -23,6 +25,9 @@ def calculate_reference_lakes(calculation_date=dt.datetime.now(), make_plots=Fal
     :param make_plots:       [bool] If true plots of reference lakes are made.
     :param calculation_date: [datetime] Defines the day the plots are made for. Datetime since the ice model uses this.
     :param get_new_obs:      [bool] If true, new observations ar requested from Regobs and added to local storage.
+    :param use_checkpoints:  [bool] If true, the modelled ice from the last run is reused for the days where the
+                             weather data, the initial ice and the model constants are unchanged and only the new
+                             days are modelled. Default False models the whole season.
 
     """
 
@@ -71,6 +76,11 @@ def calculate_reference_lakes(calculation_date=dt.datetime.now(), make_plots=Fal
     with open(reference_lakes_jsonfile, encoding='utf-8-sig') as reference_lakes_json:
         reference_lakes_data = json.load(reference_lakes_json)
 
+    # Modelled ice from earlier runs. Keyed by location id and weather data source.
+    checkpoint_store = None
+    if use_checkpoints:
+        checkpoint_store = icp.IceCheckpointStore('{0}reference_lakes_checkpoints.pickle'.format(se.local_storage))
+
     # Store plot file names for later ftp
     lastregion = ''
     ftp_files = []
@@ -187,10 +197,7 @@ def calculate_reference_lakes(calculation_date=dt.datetime.now(), make_plots=Fal
                     sno_tot = we.strip_metadata(gridSnoTot)
                     cc = dp.clouds_from_precipitation(sno)
 
-                    calculated_ice = it.calculate_ice_cover_air_temp(copy.deepcopy(first_ice),
-                                                                     date, temp, sno, cloud_cover=cc)
-
-                    # Create output json
+                    # Create output json. The wanted dates are known before the ice is calculated.
                     wanted_output_dates = []
                     # 7 days ago at 00:00
                     wdate = calculation_date - dt.timedelta(days=7)
@@ -203,7 +210,17 @@ def calculate_reference_lakes(calculation_date=dt.datetime.now(), make_plots=Fal
                     wdate = calculation_date + dt.timedelta(days=7)
                     wdate = dt.datetime(wdate.year, wdate.month, wdate.day)
                     wanted_output_dates.append(wdate)
-                    # Get Ice columns at these dates
+
+                    if checkpoint_store is not None:
+                        calculated_trajectory = icp.calculate_ice_cover_air_temp_incremental(
+                            checkpoint_store, regobs_location_id, 'gts', first_ice, date, temp, sno, cloud_cover=cc)
+                    else:
+                        # Without plots, only the ice on the wanted dates is kept
+                        calculated_trajectory = itr.IceTrajectory(it.calculate_ice_cover_air_temp(
+                            copy.deepcopy(first_ice), date, temp, sno, cloud_cover=cc,
+                            output_dates=None if make_plots else wanted_output_dates))
+
+                    # Get Ice columns at these dates. The trajectory gives the column on a date by lookup.
                     wanted_snow_thickness = []
                     wanted_slush_thickness = []
                     wanted_ice_thickness = []
@@ -217,35 +234,31 @@ def calculate_reference_lakes(calculation_date=dt.datetime.now(), make_plots=Fal
                         tot_slush = 0
                         tot_ice = 0
                         thickest_ice_layer = 0
-                        for ci in calculated_ice:
-                            if ci.date == wanted_date:
-                                # Find snow and slush
-                                for il in ci.column:
-                                    if il.type == 'new snow' or il.type == 'snow' or il.type == 'drained_snow':
-                                        tot_snow += il.height
-                                    elif il.type == 'slush':
-                                        tot_slush += il.height
-                                # Total thickness of pure ice layers avoid type = 5 (water intermediate)
-                                merged_ice_thickness = 0
-                                for il in ci.column:
-                                    if il.type == 'slush_ice' or il.type == 'black_ice' or il.type == 'unknown':
-                                        tot_ice += il.height
-                                        if il.type == 'black_ice':
-                                            merged_ice_thickness = il.height + merged_ice_thickness
-                                        else:
-                                            # Weaker ice than black ice. Use half the height
-                                            merged_ice_thickness = il.height * 0.5 + merged_ice_thickness
-                                        if merged_ice_thickness > thickest_ice_layer:
-                                            thickest_ice_layer = merged_ice_thickness
+                        ci = calculated_trajectory.get_ice_column(wanted_date)
+                        if ci is not None:
+                            # Find snow and slush
+                            for il in ci.column:
+                                if il.type == 'new snow' or il.type == 'snow' or il.type == 'drained_snow':
+                                    tot_snow += il.height
+                                elif il.type == 'slush':
+                                    tot_slush += il.height
+                            # Total thickness of pure ice layers avoid type = 5 (water intermediate)
+                            merged_ice_thickness = 0
+                            for il in ci.column:
+                                if il.type == 'slush_ice' or il.type == 'black_ice' or il.type == 'unknown':
+                                    tot_ice += il.height
+                                    if il.type == 'black_ice':
+                                        merged_ice_thickness = il.height + merged_ice_thickness
                                     else:
-                                        # Not an ice layer
-                                        merged_ice_thickness = 0
+                                        # Weaker ice than black ice. Use half the height
+                                        merged_ice_thickness = il.height * 0.5 + merged_ice_thickness
+                                    if merged_ice_thickness > thickest_ice_layer:
+                                        thickest_ice_layer = merged_ice_thickness
+                                else:
+                                    # Not an ice layer
+                                    merged_ice_thickness = 0
 
-                                found = True
-                                break
-                            elif ci.date > wanted_date:
-                                # No ice at this date
-                                break
+                            found = True
 
                         # Add the ice information to the array
                         wanted_snow_thickness.append(tot_snow)
@@ -307,6 +320,7 @@ def calculate_reference_lakes(calculation_date=dt.datetime.now(), make_plots=Fal
                                 newsno_tot.append(sno_tot[i])
                         plot_path_and_filename = '{0}{1}'.format(plot_folder, plot_filename)
                         # pts.plot_ice_cover(calculated_ice, observed_ice, newdate, temp, sno, sno_tot, plot_path_and_filename)
+                        calculated_ice = calculated_trajectory.to_ice_cover()
                         pts.plot_reference_lake(calculated_ice, observed_ice, newdate, newtemp, newsno, newsno_tot, plot_path_and_filename)
 
                     # Add todays date
@@ -320,6 +334,9 @@ def calculate_reference_lakes(calculation_date=dt.datetime.now(), make_plots=Fal
                         outfile.write(reference_lakes_output_json)
                         outfile.close()
 
+    if checkpoint_store is not None:
+        checkpoint_store.save()
+
     # Save revised json-files
     with open(output_latest_filename, 'w', encoding='utf-8-sig') as outfile_latest:
         outfile_latest.write(reference_lakes_output_json)
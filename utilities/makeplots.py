@@ -8,6 +8,7 @@ import collections as collections
 import copy as copy
 import setenvironment as se
 from utilities import getmisc as gm
+from icemodelling import icetrajectory as itr
 
 __author__ = 'raek'
 
@@ -99,7 +100,7 @@ def scatter_calculated_vs_observed(all_calculated, all_observed, year):
     """For yearly data setts og all observed ice from regObs and all calculations on lakes where these observations
     are made, a scatter plot is made, comparing calculations vs. observations.
 
-    :param all_calculated:
+    :param all_calculated:  [dict] {location: list of IceColumn or IceTrajectory}
     :param all_observed:
     :param year:            [string]    Eg. '2017-18', '2016-17', ..
     """
@@ -110,6 +111,7 @@ def scatter_calculated_vs_observed(all_calculated, all_observed, year):
     scatter_plot_data = []
     for ln in all_observed.keys():
         skipp_first = True
+        calculated_trajectory = itr.as_ice_trajectory(all_calculated[ln])
 
         for oi in all_observed[ln]:
 
@@ -118,9 +120,8 @@ def scatter_calculated_vs_observed(all_calculated, all_observed, year):
             else:
                 observed_draft = oi.draft_thickness
                 calculated_draft = None
-                for ci in all_calculated[ln]:
-                    if ci.date.date() == oi.date.date():
-                        calculated_draft = ci.draft_thickness
+                if calculated_trajectory is not None:
+                    calculated_draft = calculated_trajectory.get_draft_thickness(oi.date)
 
                 data = ObsCalScatterData(calculated_draft, observed_draft, oi.date.date(), ln)
                 scatter_plot_data.append(data)
@@ -354,7 +355,7 @@ def plot_ice_cover_9dogn(ice_cover, observed_ice, date, temp, sno, snotot, filen
 def plot_ice_cover(ice_cover, observed_ice, date, temp, sno, snotot, filename):
     """Plots ice cover over a given time period. It also plots observed data and snow and temperature data.
 
-    :param ice_cover:
+    :param ice_cover:       [list of IceColumn or IceTrajectory]
     :param observed_ice:    A list of ice_cover objects. If no observed ice use [] for resources.
     :param date:
     :param temp:
@@ -371,6 +372,10 @@ def plot_ice_cover(ice_cover, observed_ice, date, temp, sno, snotot, filename):
     sno = [s * 100 for s in sno]
     snotot = [st * 100 for st in snotot]
 
+    # A trajectory is made to ice columns. These are new objects so the trajectory is not changed below.
+    if isinstance(ice_cover, itr.IceTrajectory):
+        ice_cover = ice_cover.to_ice_cover()
+
     # convert ice_cover and observed_ice from m to cm
     for oc in observed_ice:
         if oc.water_line != -1: